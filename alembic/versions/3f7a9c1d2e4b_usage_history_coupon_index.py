@@ -0,0 +1,37 @@
+"""usage_history_coupon_index
+
+Revision ID: 3f7a9c1d2e4b
+Revises: 774361e3f202
+Create Date: 2026-10-16 09:12:41.204519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7a9c1d2e4b'
+down_revision = '774361e3f202'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so usage_history keeps accepting reservations.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'usage_history_coupon_id_customer_key_index',
+            'usage_history',
+            ['coupon_id', 'customer_key'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'usage_history_coupon_id_customer_key_index',
+            table_name='usage_history',
+            postgresql_concurrently=True,
+        )
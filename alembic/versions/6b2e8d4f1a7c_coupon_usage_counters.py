@@ -0,0 +1,79 @@
+"""coupon_usage_counters
+
+Revision ID: 6b2e8d4f1a7c
+Revises: 3f7a9c1d2e4b
+Create Date: 2026-10-16 11:03:27.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b2e8d4f1a7c'
+down_revision = '3f7a9c1d2e4b'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+BACKFILL_BATCH = sa.text(
+    """
+    WITH batch AS (
+        SELECT coupon_id FROM coupon
+        WHERE coupon_id > :last_coupon_id
+        ORDER BY coupon_id
+        LIMIT :batch_size
+    ), counters AS (
+        SELECT
+            batch.coupon_id,
+            count(usage_history.id) FILTER (
+                WHERE usage_history.status = 'reserved'
+            ) AS reserved_count,
+            count(usage_history.id) FILTER (
+                WHERE usage_history.status = 'confirmed'
+            ) AS confirmed_count,
+            coalesce(sum(usage_history.discount_amount), 0)
+                AS accumulated_discount
+        FROM batch
+        LEFT JOIN usage_history ON usage_history.coupon_id = batch.coupon_id
+        GROUP BY batch.coupon_id
+    )
+    UPDATE coupon SET
+        reserved_count = counters.reserved_count,
+        confirmed_count = counters.confirmed_count,
+        accumulated_discount = counters.accumulated_discount
+    FROM counters
+    WHERE coupon.coupon_id = counters.coupon_id
+    RETURNING coupon.coupon_id
+    """
+)
+
+
+def upgrade():
+    # Columns with a constant default do not rewrite the table.
+    op.add_column('coupon', sa.Column('reserved_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('coupon', sa.Column('confirmed_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('coupon', sa.Column('accumulated_discount', sa.Numeric(scale=2), server_default='0', nullable=False))
+
+    # Backfill one batch per statement, committed on its own, so coupons are
+    # never locked for long. Reservations written between a batch and the
+    # deploy of the new code are fixed by
+    # `python -m app.commands.usage_counters --repair`.
+    connection = op.get_bind()
+    last_coupon_id = ''
+    with op.get_context().autocommit_block():
+        while True:
+            coupon_ids = connection.execute(
+                BACKFILL_BATCH,
+                {'last_coupon_id': last_coupon_id, 'batch_size': BATCH_SIZE},
+            ).scalars().all()
+            if not coupon_ids:
+                break
+            last_coupon_id = max(coupon_ids)
+
+
+def downgrade():
+    op.drop_column('coupon', 'accumulated_discount')
+    op.drop_column('coupon', 'confirmed_count')
+    op.drop_column('coupon', 'reserved_count')
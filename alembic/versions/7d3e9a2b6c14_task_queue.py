@@ -0,0 +1,49 @@
+"""task_queue
+
+Revision ID: 7d3e9a2b6c14
+Revises: e5b19d7c42f0
+Create Date: 2026-10-16 21:02:18.114562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e9a2b6c14'
+down_revision = 'e5b19d7c42f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A value cannot be added to an enum inside a transaction before
+    # PostgreSQL 12.
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE taskstatus ADD VALUE IF NOT EXISTS 'failed'")
+    op.add_column('task', sa.Column('owner', sa.String(length=200), nullable=True))
+    op.add_column('task', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('task', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_task_status_created_at',
+            'task',
+            ['status', 'created_at'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_task_status_created_at',
+            table_name='task',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('task', 'attempts')
+    op.drop_column('task', 'heartbeat_at')
+    op.drop_column('task', 'owner')
+    # Values cannot be dropped from an enum: the failed tasks go back to
+    # completed, and the type keeps the value.
+    op.execute("UPDATE task SET status = 'completed' WHERE status = 'failed'")
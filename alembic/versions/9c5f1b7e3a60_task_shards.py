@@ -0,0 +1,43 @@
+"""task_shards
+
+Revision ID: 9c5f1b7e3a60
+Revises: 7d3e9a2b6c14
+Create Date: 2026-10-16 23:12:40.385027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.db.base import CustomID
+
+
+# revision identifiers, used by Alembic.
+revision = '9c5f1b7e3a60'
+down_revision = '7d3e9a2b6c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('task', sa.Column('parent_id', CustomID(), nullable=True))
+    op.add_column('task', sa.Column('shards', sa.Integer(), nullable=True))
+    op.create_foreign_key('task_parent_id_fkey', 'task', 'task', ['parent_id'], ['id'])
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_task_parent_id'),
+            'task',
+            ['parent_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f('ix_task_parent_id'),
+            table_name='task',
+            postgresql_concurrently=True,
+        )
+    op.drop_constraint('task_parent_id_fkey', 'task', type_='foreignkey')
+    op.drop_column('task', 'shards')
+    op.drop_column('task', 'parent_id')
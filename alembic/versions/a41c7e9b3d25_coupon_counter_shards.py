@@ -0,0 +1,40 @@
+"""coupon_counter_shards
+
+Revision ID: a41c7e9b3d25
+Revises: 6b2e8d4f1a7c
+Create Date: 2026-10-16 14:22:09.731846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.db.base import CustomID
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e9b3d25'
+down_revision = '6b2e8d4f1a7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'coupon_counter_shard',
+        sa.Column('coupon_id', CustomID(), nullable=False),
+        sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('max_usage', sa.Integer(), nullable=True),
+        sa.Column('budget', sa.Numeric(scale=2), nullable=True),
+        sa.Column('reserved_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('confirmed_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('accumulated_discount', sa.Numeric(scale=2), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['coupon_id'], ['coupon.coupon_id']),
+        sa.PrimaryKeyConstraint('coupon_id', 'shard'),
+    )
+    op.add_column('coupon', sa.Column('counter_shards', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('usage_history', sa.Column('counter_shard', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('usage_history', 'counter_shard')
+    op.drop_column('coupon', 'counter_shards')
+    op.drop_table('coupon_counter_shard')
@@ -0,0 +1,27 @@
+"""task_run_after
+
+Revision ID: b81d4f2a6e95
+Revises: 9c5f1b7e3a60
+Create Date: 2026-10-17 10:24:51.702318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81d4f2a6e95'
+down_revision = '9c5f1b7e3a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'task',
+        sa.Column('run_after', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column('task', 'run_after')
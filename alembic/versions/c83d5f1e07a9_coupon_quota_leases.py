@@ -0,0 +1,52 @@
+"""coupon_quota_leases
+
+Revision ID: c83d5f1e07a9
+Revises: a41c7e9b3d25
+Create Date: 2026-10-16 16:05:41.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.db.base import CustomID
+
+
+# revision identifiers, used by Alembic.
+revision = 'c83d5f1e07a9'
+down_revision = 'a41c7e9b3d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'coupon_lease',
+        sa.Column('id', CustomID(), server_default=sa.text("concat(CAST(EXTRACT(EPOCH FROM now()) AS BIGINT),text('-'),gen_random_uuid())"), nullable=False),
+        sa.Column('coupon_id', CustomID(), nullable=False),
+        sa.Column('owner', sa.String(length=200), nullable=False),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('max_usage', sa.Integer(), nullable=True),
+        sa.Column('budget', sa.Numeric(scale=2), nullable=True),
+        sa.Column('reserved_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('confirmed_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('accumulated_discount', sa.Numeric(scale=2), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['coupon_id'], ['coupon.coupon_id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_coupon_lease_coupon_id'), 'coupon_lease', ['coupon_id'], unique=False)
+    op.create_index(op.f('ix_coupon_lease_expires_at'), 'coupon_lease', ['expires_at'], unique=False)
+    op.add_column('coupon', sa.Column('quota_leasing', sa.Boolean(), server_default='false', nullable=False))
+    op.add_column('coupon', sa.Column('leased_usage', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('coupon', sa.Column('leased_budget', sa.Numeric(scale=2), server_default='0', nullable=False))
+    op.add_column('usage_history', sa.Column('lease_id', CustomID(), nullable=True))
+    op.create_foreign_key('usage_history_lease_id_fkey', 'usage_history', 'coupon_lease', ['lease_id'], ['id'])
+
+
+def downgrade():
+    op.drop_constraint('usage_history_lease_id_fkey', 'usage_history', type_='foreignkey')
+    op.drop_column('usage_history', 'lease_id')
+    op.drop_column('coupon', 'leased_budget')
+    op.drop_column('coupon', 'leased_usage')
+    op.drop_column('coupon', 'quota_leasing')
+    op.drop_index(op.f('ix_coupon_lease_expires_at'), table_name='coupon_lease')
+    op.drop_index(op.f('ix_coupon_lease_coupon_id'), table_name='coupon_lease')
+    op.drop_table('coupon_lease')
@@ -0,0 +1,40 @@
+"""coupon_update_at
+
+Revision ID: e5b19d7c42f0
+Revises: c83d5f1e07a9
+Create Date: 2026-10-16 18:31:07.552814
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b19d7c42f0'
+down_revision = 'c83d5f1e07a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # now() is stable, so existing rows get the migration time without a
+    # table rewrite.
+    op.add_column('coupon', sa.Column('update_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_coupon_update_at'),
+            'coupon',
+            ['update_at'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f('ix_coupon_update_at'),
+            table_name='coupon',
+            postgresql_concurrently=True,
+        )
+    op.drop_column('coupon', 'update_at')
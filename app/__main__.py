@@ -1,22 +1,33 @@
-from uvicorn import Config, Server
+import sys
+
+import uvicorn
+from uvicorn import Config
 
 from app.api.helpers.logging import setup_logging
+from app.runner import event_loop, http_protocol, serve, workers_count
 from app.settings import settings
 
 
 def main() -> None:
-    server = Server(
-        Config(
-            "app.application:get_app",
-            workers=settings.workers_count,
-            host=settings.host,
-            port=settings.port,
-            reload=settings.reload,
-            factory=True,
-        ),
-    )
     setup_logging()
-    server.run()
+    options = {
+        "host": settings.host,
+        "port": settings.port,
+        "loop": event_loop(),
+        "http": http_protocol(),
+        "factory": True,
+    }
+    if settings.reload:
+        # The reloader imports the application in its own process.
+        uvicorn.run("app.application:get_app", reload=True, **options)
+        return
+
+    sys.exit(
+        serve(
+            Config("app.application:get_app", **options),
+            workers_count(settings.workers_count),
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -189,6 +189,10 @@ class CouponUnreservedConfirmedInputSchema(BaseModel):
     transaction_id: str
 
 
+class CouponCounterShardsInputSchema(BaseModel):
+    shards: int = Field(..., ge=2, le=64)
+
+
 class CouponInputWithManyCustomers(CouponSchemaBase):
     customer_keys: Optional[List[str]] = None
     file_with_customer_keys: Optional[UploadFile] = None
@@ -229,12 +233,9 @@ class CouponInputWithManyCustomers(CouponSchemaBase):
 
         copy_data["valid_from"] = copy_data["valid_from"].isoformat()
         copy_data["valid_until"] = copy_data["valid_until"].isoformat()
-        copy_data["value"] = str(copy_data["value"])
-        copy_data["max_amount"] = str(copy_data["max_amount"])
-        copy_data["min_purchase_amount"] = str(
-            copy_data["min_purchase_amount"],
-        )
-        copy_data["budget"] = str(copy_data["budget"])
+        for field in ("value", "max_amount", "min_purchase_amount", "budget"):
+            if copy_data[field] is not None:
+                copy_data[field] = str(copy_data[field])
         return copy_data
 
     @classmethod
@@ -1,7 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
 
-from fastapi import APIRouter, BackgroundTasks, Depends, Query
+from fastapi import APIRouter, Depends, Query
 from loguru import logger
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -15,6 +15,7 @@ from starlette.status import (
 )
 
 from app.api.coupon.v1.schema import (
+    CouponCounterShardsInputSchema,
     CouponInputSchema,
     CouponInputWithManyCustomers,
     CouponReservedInputSchema,
@@ -25,11 +26,12 @@ from app.api.coupon.v1.schema import (
     MessageError,
 )
 from app.api.helpers.exception import DomainException, HTTPError
-from app.db.dependencies import get_db_session
+from app.api.helpers.routing import CommittingRoute
+from app.db.dependencies import get_db_session, get_read_session
 from app.repository.coupon import CouponRepository
 from app.services.coupon import CouponService
 
-router = APIRouter()
+router = APIRouter(route_class=CommittingRoute)
 
 
 @router.get("")
@@ -41,7 +43,7 @@ async def index(
     valid_until: datetime = Query(None, description="Valid Until of coupon"),
     description: str = Query(None, description="Description of coupon"),
     code: str = Query(None, description="Code of Coupon"),
-    db_session: AsyncSession = Depends(get_db_session),
+    db_session: AsyncSession = Depends(get_read_session),
 ):
     """
     List all coupons or filter by query params.
@@ -209,7 +211,7 @@ async def get_valid_coupon(
     customer_key: str,
     purchase_amount: Decimal,
     first_purchase: bool,
-    db_session: AsyncSession = Depends(get_db_session),
+    db_session: AsyncSession = Depends(get_read_session),
 ):
     """
     Get valid coupon model in database.
@@ -250,7 +252,7 @@ async def get_valid_coupon(
 )
 async def show(
     coupon_id: str,
-    db_session: AsyncSession = Depends(get_db_session),
+    db_session: AsyncSession = Depends(get_read_session),
 ):
     """
     Get a coupon model in database by id.
@@ -401,9 +403,73 @@ async def deactivate_coupon(
         )
 
 
+@router.post(
+    "/{coupon_id}/sharded-counters",
+    status_code=HTTP_204_NO_CONTENT,
+    responses={HTTP_404_NOT_FOUND: {"model": MessageError}},
+)
+async def enable_counter_shards(
+    coupon_id: str,
+    counter_shards_input: CouponCounterShardsInputSchema,
+    db_session: AsyncSession = Depends(get_db_session),
+):
+    """
+    Shard the usage counters of a hot coupon.
+
+    :param coupon_id: coupon id to shard.
+    :param counter_shards_input: number of counter shards.
+
+    :return: Success with No Content.
+
+    :raises HTTPError: 404 - Coupon not found
+    """
+    try:
+        coupon_service: CouponService = CouponService(db_session)
+        return await coupon_service.enable_counter_shards(
+            coupon_id,
+            counter_shards_input.shards,
+        )
+
+    except NoResultFound:
+        raise HTTPError(
+            status_code=HTTP_404_NOT_FOUND,
+            error_message="coupon not found",
+            error_code="coupon_not_exists",
+        )
+
+
+@router.post(
+    "/{coupon_id}/quota-leasing",
+    status_code=HTTP_204_NO_CONTENT,
+    responses={HTTP_404_NOT_FOUND: {"model": MessageError}},
+)
+async def enable_quota_leasing(
+    coupon_id: str,
+    db_session: AsyncSession = Depends(get_db_session),
+):
+    """
+    Let each pod lease blocks of the usage and budget of a hot coupon.
+
+    :param coupon_id: coupon id to lease.
+
+    :return: Success with No Content.
+
+    :raises HTTPError: 404 - Coupon not found
+    """
+    try:
+        coupon_service: CouponService = CouponService(db_session)
+        return await coupon_service.enable_quota_leasing(coupon_id)
+
+    except NoResultFound:
+        raise HTTPError(
+            status_code=HTTP_404_NOT_FOUND,
+            error_message="coupon not found",
+            error_code="coupon_not_exists",
+        )
+
+
 @router.post("/bulk/by-client", status_code=HTTP_202_ACCEPTED)
 async def bulk_create(
-    background_tasks: BackgroundTasks,
     form_data: CouponInputWithManyCustomers = Depends(
         CouponInputWithManyCustomers.as_form,
     ),
@@ -411,10 +477,7 @@ async def bulk_create(
 ):
     try:
         coupon_service: CouponService = CouponService(db_session)
-        task_model = await coupon_service.create_task(
-            form_data,
-            background_tasks,
-        )
+        task_model = await coupon_service.create_task(form_data)
     except Exception as e:
         raise HTTPError(
             status_code=HTTP_412_PRECONDITION_FAILED,
@@ -13,10 +13,11 @@ from app.api.coupon.v2.schema import (
     MessageError,
 )
 from app.api.helpers.exception import DomainException, HTTPError
+from app.api.helpers.routing import CommittingRoute
 from app.db.dependencies import get_db_session
 from app.services.coupon import CouponService
 
-router = APIRouter()
+router = APIRouter(route_class=CommittingRoute)
 
 
 @router.put(
@@ -1,24 +1,27 @@
 import time
 
+from sqlalchemy import text
+
 from .base import Base
 
 
 class Checker(Base):
     def __init__(
         self,
-        session,
+        engine,
         name="Postgres",
     ):
         super().__init__(name)
         self.name = name
-        self.session = session
+        self.engine = engine
 
     async def check(self):
         start = time.time()
         status = False
         try:
-            result = await self.session.execute("select 1=1")
-            status = result.scalar_one()
+            async with self.engine.connect() as connection:
+                result = await connection.execute(text("select 1=1"))
+                status = result.scalar_one()
         except Exception:
             status = False
 
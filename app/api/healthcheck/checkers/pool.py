@@ -0,0 +1,40 @@
+from app.db.engine import InstrumentedPool
+from app.settings import settings
+
+from .base import Base
+
+
+class Checker(Base):
+    """
+    Fails while the check outs of the pool wait, not merely while all its
+    connections are busy: a pool fully used at peak still serves, and
+    taking every busy pod out of service would cascade.
+    """
+
+    def __init__(self, engine, name="Pool"):
+        super().__init__(name)
+        self.name = name
+        self.engine = engine
+
+    async def check(self):
+        pool = self.engine.sync_engine.pool
+        if not isinstance(pool, InstrumentedPool):
+            # Waits are only observed on the pools of the application.
+            return {"name": self.name, "status": True, "time": 0}
+
+        checkouts = pool.recent_checkouts(settings.health_check_pool_window)
+        timeouts = sum(checkout.timed_out for checkout in checkouts)
+        wait_ms = 0
+        if checkouts:
+            wait_ms = sum(c.wait_ms for c in checkouts) / len(checkouts)
+        return {
+            "name": self.name,
+            "status": (
+                not timeouts and wait_ms < settings.health_check_pool_wait_ms
+            ),
+            "time": 0,
+            "checked_out": pool.checkedout(),
+            "capacity": pool.capacity,
+            "wait_ms": round(wait_ms, 1),
+            "timeouts": timeouts,
+        }
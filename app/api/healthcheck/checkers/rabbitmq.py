@@ -1,7 +1,6 @@
+import asyncio
 import time
 
-import pika
-
 from .base import Base
 
 
@@ -17,13 +16,20 @@ class Checker(Base):
         start = time.time()
         status = False
         try:
-            parameters = pika.URLParameters(self.url)
-            connection = pika.BlockingConnection(parameters)
-            if connection.is_open:
-                status = True
-                connection.close()
+            # The blocking client runs off the event loop.
+            status = await asyncio.to_thread(self._connect)
         except Exception:
             status = False
 
         time_passed = time.time() - start
         return {"name": self.name, "status": status, "time": time_passed}
+
+    def _connect(self) -> bool:
+        import pika
+
+        parameters = pika.URLParameters(self.url)
+        connection = pika.BlockingConnection(parameters)
+        if not connection.is_open:
+            return False
+        connection.close()
+        return True
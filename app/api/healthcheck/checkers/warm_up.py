@@ -0,0 +1,11 @@
+from .base import Base
+
+
+class Checker(Base):
+    def __init__(self, warm_up, name="Warm-up"):
+        super().__init__(name)
+        self.name = name
+        self.warm_up = warm_up
+
+    async def check(self):
+        return {"name": self.name, "status": self.warm_up.ready, "time": 0}
@@ -1,36 +1,121 @@
+import asyncio
+import time
 from importlib import metadata
+from typing import Dict, List, Tuple
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
 
 import app.api.healthcheck.checkers.database as database
-from app.db.dependencies import get_db_session
+import app.api.healthcheck.checkers.pool as pool
+import app.api.healthcheck.checkers.warm_up as warm_up_checker
+from app.metrics import metrics
+from app.repository.single_flight import SingleFlight
+from app.services.utils.warm_up import warm_up
 from app.settings import settings
 
 router = APIRouter()
 
+# Readiness results, by time they were checked, shared by the probes.
+_results: Dict[str, Tuple[float, dict]] = {}
+_checks = SingleFlight("health_check")
+
+
+def get_engines() -> List[AsyncEngine]:
+    """
+    Get the engines the readiness depends on.
+
+    :return: the writer engine, and the reader engine if distinct.
+    """
+    from app.lifetime import engine, read_engine
+
+    if read_engine is engine:
+        return [engine]
+    return [engine, read_engine]
+
 
 @router.get("/", include_in_schema=False)
 async def get_app():
     return [{"app": settings.service_name, "version": metadata.version("app")}]
 
 
+@router.get("/health/live")
+async def get_liveness():
+    """
+    Check the process answers, without touching its dependencies.
+
+    :return: the liveness of the service.
+    """
+    return {"name": settings.service_name, "status": True, "checks": []}
+
+
 @router.get("/health")
-async def get_health(session: AsyncSession = Depends(get_db_session)):
-    checkers = [
-        database.Checker(session),
-    ]
+@router.get("/health/ready")
+async def get_health(
+    response: Response,
+    engines: List[AsyncEngine] = Depends(get_engines),
+):
+    """
+    Check the process is ready to take requests.
+
+    The database and the pools of the engines are checked concurrently,
+    and the result reused by the probes for the cache ttl.
+
+    :return: the readiness of the service, with a 503 status if not ready.
+    """
+    checkers = [warm_up_checker.Checker(warm_up)]
+    for index, engine in enumerate(engines):
+        suffix = " (reader)" if index else ""
+        checkers.append(database.Checker(engine, name=f"Postgres{suffix}"))
+        checkers.append(pool.Checker(engine, name=f"Pool{suffix}"))
 
-    return await healthcheck(checkers)
+    result = await cached_healthcheck("ready", checkers)
+    if not result["status"]:
+        response.status_code = HTTP_503_SERVICE_UNAVAILABLE
+    return result
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics.snapshot()
+
+
+async def cached_healthcheck(key: str, checkers=[]):
+    """
+    Run the checkers, unless they were run in the cache ttl.
+
+    :param key: key of the result in the cache.
+    :param checkers: checkers to run.
+
+    :return: the health check result.
+    """
+    checked = _results.get(key)
+    if checked is not None and checked[0] > time.monotonic():
+        return checked[1]
+
+    async def check():
+        result = await healthcheck(checkers)
+        ttl = settings.health_check_cache_ttl
+        _results[key] = (time.monotonic() + ttl, result)
+        return result
+
+    return await _checks.do(key, check)
 
 
 async def healthcheck(checkers=[]):
-    checks = []
-    for checker in checkers:
-        checks.append(await checker.check())
+    checks = await asyncio.gather(*(_check(checker) for checker in checkers))
 
     status = True
     for check in checks:
         if check["status"] is False:
             status = False
     return {"name": settings.service_name, "status": status, "checks": checks}
+
+
+async def _check(checker) -> dict:
+    timeout = settings.health_check_timeout
+    try:
+        return await asyncio.wait_for(checker.check(), timeout)
+    except asyncio.TimeoutError:
+        return {"name": checker.name, "status": False, "time": timeout}
@@ -1,7 +1,6 @@
 import json
 import logging
 
-import stackprinter
 from loguru import logger
 
 from app.settings import settings
@@ -37,6 +36,8 @@ def formatter(record):
     format_ = "{time} | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | {message}"  # noqa
 
     if record["exception"] is not None:
+        import stackprinter
+
         record["extra"]["stack"] = stackprinter.format(
             record["exception"], style="darkbg2"
         )
@@ -54,6 +55,8 @@ def serialize(record):
             "span_id": record["extra"]["dd"].get("span_id"),
         }
     if record["exception"] is not None:
+        import stackprinter
+
         show_vals = "like_source" if diagnose() else None
         exception = stackprinter.format(
             record["exception"], show_vals=show_vals
@@ -1,7 +1,15 @@
+import asyncio
+
 from loguru import logger
-from opentelemetry import trace
+from starlette.responses import JSONResponse
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
 from starlette.types import ASGIApp, Receive, Scope, Send
 
+from app.services.utils.drain import drain
+
+# Served while draining, so the drain can be watched, and not waited for.
+DRAIN_EXEMPT_PATHS = ("/metrics", "/health/live")
+
 
 class LogCorrelationMiddleware:
     def __init__(self, app: ASGIApp):
@@ -10,6 +18,9 @@ class LogCorrelationMiddleware:
     async def __call__(
         self, scope: Scope, receive: Receive, send: Send
     ) -> None:
+        # Imported on first use, it takes long to import.
+        from opentelemetry import trace
+
         span_local = trace.get_current_span()
         ctx = span_local.get_span_context()
         logger.configure(
@@ -21,3 +32,29 @@ class LogCorrelationMiddleware:
             }
         )
         await self.app(scope, receive, send)
+
+
+class DrainMiddleware:
+    """Track the requests for the drain, refused once it started."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if scope["type"] != "http" or scope["path"] in DRAIN_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if drain.draining:
+            response = JSONResponse(
+                {"detail": "shutting down"},
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"connection": "close"},
+            )
+            await response(scope, receive, send)
+            return
+
+        drain.track(asyncio.current_task())
+        await self.app(scope, receive, send)
@@ -0,0 +1,30 @@
+from typing import Callable, Coroutine
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from app.db.dependencies import LAST_WRITE_HEADER, commit_request_session
+from app.settings import settings
+
+
+class CommittingRoute(APIRoute):
+    """
+    Route committing the database session before sending the response.
+
+    The dependencies are closed once the response is sent, so the session
+    would otherwise commit after the client got its response, and a failed
+    commit would go unnoticed. The writes tell the client when they
+    committed, to be echoed back on its reads.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine]:
+        handler = super().get_route_handler()
+
+        async def commit_before_response(request: Request) -> Response:
+            response = await handler(request)
+            committed_at = await commit_request_session(request)
+            if committed_at is not None and settings.db_read_your_writes_ms:
+                response.headers[LAST_WRITE_HEADER] = str(committed_at)
+            return response
+
+        return commit_before_response
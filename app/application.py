@@ -1,15 +1,18 @@
 from importlib import metadata
 from pathlib import Path
 
-from ddtrace import config
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi_pagination import add_pagination
 
 from app.api.helpers.handler import register_exception_handlers
-from app.api.helpers.middlewares import LogCorrelationMiddleware
+from app.api.helpers.middlewares import (
+    DrainMiddleware,
+    LogCorrelationMiddleware,
+)
 from app.api.router import api_router
+from app.db.dependencies import LAST_WRITE_HEADER
 from app.enums import Environment
 from app.lifetime import shutdown, startup
 from app.settings import settings
@@ -28,11 +31,14 @@ def get_app() -> FastAPI:
     :return: application.
     """
 
-    # Override service name
-    config.fastapi["service_name"] = str(settings.service_name)
-
     # Telemetry
     if Environment.is_valid():
+        # ddtrace takes long to import, only where telemetry is enabled.
+        from ddtrace import config
+
+        # Override service name
+        config.fastapi["service_name"] = str(settings.service_name)
+
         Telemetry.init()
         Telemetry.configure_exporter(DatadogExporter())
 
@@ -46,6 +52,7 @@ def get_app() -> FastAPI:
     )
 
     app.add_middleware(LogCorrelationMiddleware)
+    app.add_middleware(DrainMiddleware)
     if settings.backend_cors_origins:
         app.add_middleware(
             CORSMiddleware,
@@ -55,6 +62,7 @@ def get_app() -> FastAPI:
             allow_credentials=True,
             allow_methods=["*"],
             allow_headers=["*"],
+            expose_headers=[LAST_WRITE_HEADER],
         )
 
     app.on_event("startup")(startup(app))
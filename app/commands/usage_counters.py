@@ -0,0 +1,86 @@
+"""
+Check the stored usage counters of coupons against the usage histories.
+
+Usage::
+
+    python -m app.commands.usage_counters [--repair] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+from typing import List
+
+from loguru import logger
+
+from app.lifetime import engine, session_factory
+from app.repository.coupon import CouponCountersDrift, CouponRepository
+
+
+async def check_usage_counters(
+    repair: bool = False,
+    batch_size: int = 1000,
+) -> List[CouponCountersDrift]:
+    """
+    Scan every coupon looking for drifted usage counters.
+
+    Each page is checked, and repaired when asked, in its own transaction,
+    so the scan never holds locks on more than one page of coupons.
+
+    :param repair: recompute the counters of the drifted coupons.
+    :param batch_size: number of coupons checked by transaction.
+
+    :return: the drifted coupons found.
+    """
+    drifted = []
+    last_coupon_id = ""
+    while last_coupon_id is not None:
+        session = session_factory()
+        try:
+            repository = CouponRepository(session)
+            drift, last_coupon_id = await repository.get_usage_counters_drift(
+                after_coupon_id=last_coupon_id,
+                limit=batch_size,
+            )
+            for coupon in drift:
+                logger.warning(f"Usage counters drift: {coupon}")
+
+            if repair and drift:
+                await repository.repair_usage_counters(
+                    [coupon.coupon_id for coupon in drift],
+                )
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session_factory.remove()
+
+        drifted.extend(drift)
+
+    return drifted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="recompute the counters of the drifted coupons",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    async def _run():
+        try:
+            return await check_usage_counters(args.repair, args.batch_size)
+        finally:
+            await engine.dispose()
+
+    drifted = asyncio.run(_run())
+    action = "repaired" if args.repair else "found"
+    logger.info(f"{len(drifted)} coupons with drifted usage counters {action}")
+    if drifted and not args.repair:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,9 @@ from app.db.meta import meta
 
 class CustomID(TypeDecorator):
     impl = String
-    cache_ok = False
+    # Every instance has the same length, so the statements using it can
+    # be cached.
+    cache_ok = True
 
     def __init__(self):
         super().__init__(length=64)
@@ -18,6 +20,7 @@ class CustomID(TypeDecorator):
 
 class CreateCustomID(FunctionElement):
     name = "custom_id"
+    inherit_cache = True
 
 
 @compiles(CreateCustomID)
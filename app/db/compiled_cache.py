@@ -0,0 +1,83 @@
+import functools
+import inspect
+from contextvars import ContextVar
+from typing import Dict, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import (
+    CACHE_HIT,
+    CACHE_MISS,
+    CACHING_DISABLED,
+    NO_CACHE_KEY,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.metrics import Counter, metrics
+
+# Repository method running the current statement.
+statement_source: ContextVar[str] = ContextVar(
+    "statement_source",
+    default="other",
+)
+
+_OUTCOMES = {
+    CACHE_HIT: "hits",
+    CACHE_MISS: "misses",
+    CACHING_DISABLED: "uncached",
+    NO_CACHE_KEY: "uncached",
+}
+_counters: Dict[Tuple[str, str], Counter] = {}
+
+
+def instrument_compiled_cache(engine: AsyncEngine):
+    """
+    Count the statements of an engine by outcome in its compiled cache.
+
+    The counters are named after the outcome and the repository method
+    running the statement, as in
+    ``sql_compiled_cache_misses.CouponRepository.reserve_usage``.
+
+    :param engine: engine to instrument.
+    """
+    target = engine.sync_engine
+    if not event.contains(target, "after_cursor_execute", _count_statement):
+        event.listen(target, "after_cursor_execute", _count_statement)
+
+
+def track_statement_sources(cls):
+    """
+    Attribute the statements of the coroutine methods of a class to them.
+
+    :param cls: repository class.
+    """
+    for name, method in list(vars(cls).items()):
+        if inspect.iscoroutinefunction(method):
+            setattr(cls, name, _tracked(f"{cls.__name__}.{name}", method))
+
+
+def _tracked(source: str, method):
+    @functools.wraps(method)
+    async def tracked(*args, **kwargs):
+        token = statement_source.set(source)
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            statement_source.reset(token)
+
+    return tracked
+
+
+def _count_statement(conn, cursor, statement, parameters, context, many):
+    outcome = _OUTCOMES.get(getattr(context, "cache_hit", None))
+    if outcome is None:
+        # The dialect has no compiled cache.
+        return
+
+    key = (outcome, statement_source.get())
+    counter = _counters.get(key)
+    if counter is None:
+        counter = _counters[key] = metrics.counter(
+            f"sql_compiled_cache_{outcome}.{key[1]}",
+            f"Statements of {key[1]} by outcome in the compiled cache.",
+        )
+    counter.inc()
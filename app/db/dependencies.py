@@ -1,17 +1,37 @@
-from typing import AsyncGenerator
+import time
+from typing import AsyncGenerator, Optional
 
+from fastapi import Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.lifetime import session_factory
+from app.db.engine import route_statement_timeout
+from app.lifetime import (
+    read_session_factory,
+    session_factory,
+    writer_read_session_factory,
+)
+from app.settings import settings
 
+# Header with the time (milliseconds) of the last write of a client, set on
+# its committed writes and echoed back by the client on its reads.
+LAST_WRITE_HEADER = "X-Last-Write"
 
-async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+async def get_db_session(
+    request: Request,
+) -> AsyncGenerator[AsyncSession, None]:
     """
     Create and get database session.
     :param request: current request.
     :yield: database session.
     """
+    if settings.db_route_statement_timeouts:
+        route_statement_timeout.set(_route_statement_timeout(request))
+
     session: AsyncSession = session_factory()
+    request.state.db_session = session
 
     try:
         yield session
@@ -20,3 +40,92 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
         await session.rollback()
     finally:
         await session.close()
+
+
+async def get_read_session(
+    request: Request,
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Create and get read-only database session of the reader endpoint.
+
+    The session is only closed, never committed. Requests of a client that
+    wrote within the read your writes window are served by the writer, so
+    they see their own writes despite the replication lag.
+
+    :param request: current request.
+    :yield: database session.
+    """
+    if settings.db_route_statement_timeouts:
+        route_statement_timeout.set(_route_statement_timeout(request))
+
+    if follows_own_write(request):
+        session: AsyncSession = writer_read_session_factory()
+    else:
+        session = read_session_factory()
+
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+async def commit_request_session(request: Request) -> Optional[int]:
+    """
+    Commit the database session of a request, if it has one.
+
+    :param request: current request.
+    :return: time (milliseconds) of the commit of a write, None otherwise.
+    """
+    session: Optional[AsyncSession] = getattr(
+        request.state,
+        "db_session",
+        None,
+    )
+    if session is None:
+        return None
+
+    await session.commit()
+    if request.method in READ_METHODS:
+        return None
+    return _now_ms()
+
+
+def follows_own_write(request: Request) -> bool:
+    """
+    Check if a request follows a write of its client within the read your
+    writes window.
+
+    :param request: current request.
+    :return: True if the request must be served by the writer.
+    """
+    if not settings.db_read_your_writes_ms:
+        return False
+    try:
+        written_at = int(request.headers[LAST_WRITE_HEADER])
+    except (KeyError, ValueError):
+        return False
+    return _now_ms() - written_at < settings.db_read_your_writes_ms
+
+
+def route_name(request: Request) -> str:
+    """
+    Name the route of a request after its method and path template.
+
+    :param request: current request.
+    :return: name of the route, as in ``GET /v1/coupons/{coupon_id}``.
+    """
+    endpoint = request.scope.get("endpoint")
+    for route in request.app.routes:
+        if getattr(route, "endpoint", None) is endpoint and (
+            request.method in getattr(route, "methods", ())
+        ):
+            return f"{request.method} {route.path}"
+    return f"{request.method} {request.url.path}"
+
+
+def _route_statement_timeout(request: Request) -> Optional[int]:
+    return settings.db_route_statement_timeouts.get(route_name(request))
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
@@ -0,0 +1,263 @@
+import time
+from collections import deque
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+from uuid import uuid4
+
+from asyncpg import Connection
+from loguru import logger
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.metrics import metrics
+from app.settings import settings
+
+# Modes of the prepared statement cache of the connections.
+STATEMENT_CACHE_MODES = ("cached", "pooler", "direct")
+
+# Statement timeout (milliseconds) of the route being served, when it
+# overrides the timeout of the connections.
+route_statement_timeout: ContextVar[Optional[int]] = ContextVar(
+    "route_statement_timeout",
+    default=None,
+)
+
+pool_wait = metrics.histogram(
+    "db_pool_wait_ms",
+    "Time to check out a connection of the pools, in milliseconds.",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+
+
+# Check outs of a pool kept for the readiness, at most.
+RECENT_CHECKOUTS = 1000
+
+
+class Checkout(NamedTuple):
+    """Check out of a connection of a pool."""
+
+    at: float
+    wait_ms: float
+    timed_out: bool
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool observing the time taken to check out a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._checkouts = deque(maxlen=RECENT_CHECKOUTS)
+
+    @property
+    def capacity(self) -> Optional[int]:
+        """Connections the pool may open, None without an overflow limit."""
+        if self._max_overflow < 0:
+            return None
+        return self.size() + self._max_overflow
+
+    def connect(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait_ms = (time.perf_counter() - start) * 1000
+            pool_wait.observe(wait_ms)
+            self._checkouts.append(
+                Checkout(time.monotonic(), wait_ms, timed_out),
+            )
+
+    def recent_checkouts(self, window: float) -> List[Checkout]:
+        """
+        :param window: seconds back from now.
+        :return: the check outs of the window.
+        """
+        since = time.monotonic() - window
+        return [
+            checkout for checkout in self._checkouts if checkout.at >= since
+        ]
+
+
+class PoolerSafeConnection(Connection):
+    """
+    asyncpg connection whose prepared statements have unique names.
+
+    A transaction pooler hands the server connections to other clients
+    between transactions, where the statements named after a counter of
+    this process could collide with the statements of other processes.
+    """
+
+    def _get_unique_id(self, prefix: str) -> str:
+        return f"__asyncpg_{prefix}_{uuid4().hex}__"
+
+
+def engine_options(mode: str = settings.db_statement_cache_mode) -> dict:
+    """
+    Build the options of ``create_async_engine``, the pool in the settings
+    and the connections of a statement cache mode.
+
+    ``cached`` prepares each statement once per connection and keeps up to
+    ``db_statement_cache_size`` of them, which needs every statement of a
+    connection to reach the same server connection, as the session pooling
+    of the sidecar does. ``pooler`` prepares every statement again under a
+    unique name, safe behind a transaction pooler. ``direct`` caches like
+    ``cached`` on a connection to PostgreSQL that bypasses the sidecar.
+
+    :param mode: statement cache mode.
+    :return: options of the engine.
+
+    :raises ValueError: unknown mode.
+    """
+    if mode not in STATEMENT_CACHE_MODES:
+        raise ValueError(f"Unknown statement cache mode: {mode}")
+
+    if mode == "pooler":
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "connection_class": PoolerSafeConnection,
+        }
+    else:
+        connect_args = {
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+            "statement_cache_size": settings.db_statement_cache_size,
+        }
+    connect_args["server_settings"] = _server_settings()
+
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
+
+def _server_settings() -> dict:
+    # Sent when connecting, so they cost no statement.
+    server_settings = {}
+    if settings.db_statement_timeout_ms:
+        server_settings["statement_timeout"] = str(
+            settings.db_statement_timeout_ms,
+        )
+    if settings.db_idle_in_transaction_timeout_ms:
+        server_settings["idle_in_transaction_session_timeout"] = str(
+            settings.db_idle_in_transaction_timeout_ms,
+        )
+    return server_settings
+
+
+def instrument_pool(engine: AsyncEngine, name: str):
+    """
+    Expose the use of the pool of an engine as gauges.
+
+    :param engine: engine with a queue pool.
+    :param name: prefix of the gauges.
+    """
+
+    def read(attribute: str):
+        # The pool is replaced when the engine is disposed.
+        return lambda: getattr(engine.sync_engine.pool, attribute)()
+
+    metrics.gauge(
+        f"{name}_pool_size",
+        "Connections kept open by the pool.",
+    ).set_function(read("size"))
+    metrics.gauge(
+        f"{name}_pool_checked_out",
+        "Connections of the pool in use.",
+    ).set_function(read("checkedout"))
+    metrics.gauge(
+        f"{name}_pool_overflow",
+        "Connections opened beyond the pool size, negative while the "
+        "pool is not full.",
+    ).set_function(read("overflow"))
+
+
+@event.listens_for(Session, "after_begin")
+def _set_route_statement_timeout(session, transaction, connection):
+    timeout = route_statement_timeout.get()
+    if timeout is None or connection.dialect.name != "postgresql":
+        return
+    # Local to the transaction, the connection goes back to the pool with
+    # its own timeout.
+    connection.execute(
+        select(func.set_config("statement_timeout", str(timeout), True)),
+    )
+
+
+def install_numeric_codec(engine: AsyncEngine):
+    """
+    Decode the numeric columns of the connections of an engine from text.
+
+    asyncpg builds the decimals of the binary numeric format digit by
+    digit in Python objects, parsing their text is cheaper.
+
+    :param engine: engine with the asyncpg driver.
+    """
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def register_codec(dbapi_connection, connection_record):
+        dbapi_connection.run_async(
+            lambda connection: connection.set_type_codec(
+                "numeric",
+                encoder=str,
+                decoder=Decimal,
+                schema="pg_catalog",
+                format="text",
+            ),
+        )
+
+
+async def check_statement_cache(engine: AsyncEngine, mode: str):
+    """
+    Check the statement cache mode against the database of an engine.
+
+    A statement is run twice on a connection, which fails if a cached
+    statement is lost because the connection moved to another server
+    connection. The ``direct`` mode must not connect through pgpool.
+
+    :param engine: engine of the database.
+    :param mode: statement cache mode of the engine.
+
+    :raises RuntimeError: the mode does not work with the database.
+    """
+    try:
+        async with engine.connect() as connection:
+            for value in range(2):
+                await connection.execute(
+                    text("SELECT CAST(:value AS integer)"),
+                    {"value": value},
+                )
+    except DBAPIError as error:
+        raise RuntimeError(
+            f"The {mode} statement cache failed its self-test",
+        ) from error
+
+    behind_pgpool = await _behind_pgpool(engine)
+    if mode == "direct" and behind_pgpool:
+        raise RuntimeError("The direct statement cache connects to pgpool")
+    logger.info(
+        f"The {mode} statement cache passed its self-test"
+        f"{' behind pgpool' if behind_pgpool else ''}",
+    )
+
+
+async def _behind_pgpool(engine: AsyncEngine) -> bool:
+    # Only pgpool answers this command.
+    try:
+        async with engine.connect() as connection:
+            await connection.exec_driver_sql("SHOW pool_version")
+    except DBAPIError:
+        return False
+    return True
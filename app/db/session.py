@@ -0,0 +1,39 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class ReadOnlySession(AsyncSession):
+    """
+    Session of the read-only views.
+
+    Nothing is written, so it is never flushed, committed or rolled back,
+    only closed. Outside a transaction, at the AUTOCOMMIT isolation level,
+    its connection goes back to the pool after every statement instead of
+    at the end of the request, unless a streamed result still reads from
+    it.
+    """
+
+    def __init__(self, *args, release_connections: bool = False, **kwargs):
+        kwargs["autoflush"] = False
+        super().__init__(*args, **kwargs)
+        self.release_connections = release_connections
+        self._streaming = False
+
+    async def execute(self, *args, **kwargs):
+        result = await super().execute(*args, **kwargs)
+        await self._release()
+        return result
+
+    async def get(self, *args, **kwargs):
+        instance = await super().get(*args, **kwargs)
+        await self._release()
+        return instance
+
+    async def stream(self, *args, **kwargs):
+        self._streaming = True
+        return await super().stream(*args, **kwargs)
+
+    async def _release(self):
+        # The results are buffered, and the instances they loaded keep
+        # their attributes once detached.
+        if self.release_connections and not self._streaming:
+            await self.close()
@@ -26,6 +26,7 @@ class TaskStatus(str, Enum):
     CREATED = "created"
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
+    FAILED = "failed"
 
     @classmethod
     def choices(cls):
@@ -3,13 +3,24 @@ from typing import Awaitable, Callable
 
 from fastapi import FastAPI
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession,
     async_scoped_session,
     create_async_engine,
 )
 from sqlalchemy.orm import configure_mappers, sessionmaker
 
+from app.db.compiled_cache import instrument_compiled_cache
+from app.db.engine import (
+    check_statement_cache,
+    engine_options,
+    install_numeric_codec,
+    instrument_pool,
+)
+from app.db.session import ReadOnlySession
 from app.enums import Environment
+from app.repository.coupon_code_filter import coupon_code_filter
+from app.services.utils.drain import drain
 from app.settings import settings
 
 from .telemetry import (
@@ -19,7 +30,11 @@ from .telemetry import (
     Telemetry,
 )
 
-engine = create_async_engine(str(settings.db_url), echo=settings.db_echo)
+engine = create_async_engine(
+    str(settings.db_url),
+    echo=settings.db_echo,
+    **engine_options(),
+)
 session_factory = async_scoped_session(
     sessionmaker(
         engine,
@@ -29,6 +44,47 @@ session_factory = async_scoped_session(
     scopefunc=current_task,
 )
 
+# The read-only views use the reader endpoint, when one is set.
+if settings.db_read_url != settings.db_url:
+    read_engine = create_async_engine(
+        str(settings.db_read_url),
+        echo=settings.db_echo,
+        **engine_options(),
+    )
+else:
+    read_engine = engine
+
+if settings.db_fast_numeric_codec:
+    install_numeric_codec(engine)
+    if read_engine is not engine:
+        install_numeric_codec(read_engine)
+
+
+def _read_only_sessionmaker(bind: AsyncEngine) -> sessionmaker:
+    """
+    Create a factory of read-only sessions on an engine.
+
+    :param bind: engine of the sessions.
+    :return: session factory.
+    """
+    options = {}
+    if settings.db_read_isolation_level:
+        options["isolation_level"] = settings.db_read_isolation_level
+    if settings.db_read_only_transactions:
+        options["postgresql_readonly"] = True
+
+    return sessionmaker(
+        bind.execution_options(**options),
+        expire_on_commit=False,
+        class_=ReadOnlySession,
+        release_connections=settings.db_read_isolation_level == "AUTOCOMMIT",
+    )
+
+
+read_session_factory = _read_only_sessionmaker(read_engine)
+# Reads pinned to the writer, to see the writes of their client.
+writer_read_session_factory = _read_only_sessionmaker(engine)
+
 
 def _setup_db(app: FastAPI) -> None:
     """
@@ -41,13 +97,67 @@ def _setup_db(app: FastAPI) -> None:
 
     # Instrumentation
     if Environment.is_valid():
-        Telemetry.instrument(SQLAlchemyInstrument(), engine)
+        if read_engine is engine:
+            Telemetry.instrument(SQLAlchemyInstrument(), engine)
+        else:
+            Telemetry.instrument(SQLAlchemyInstrument(), engine, read_engine)
+
+    instrument_compiled_cache(engine)
+    instrument_compiled_cache(read_engine)
+    instrument_pool(engine, "db")
+    if read_engine is not engine:
+        instrument_pool(read_engine, "db_read")
 
     app.state.db_engine = engine
     app.state.db_session_factory = session_factory
+    app.state.db_read_engine = read_engine
+    app.state.db_read_session_factory = read_session_factory
     configure_mappers()
 
 
+async def _start_services() -> None:
+    """Start the background services enabled in the settings."""
+    # The services import the session factory of this module.
+    from app.services.utils.cache_invalidation import (
+        cache_invalidation_listener,
+    )
+    from app.services.utils.quota_lease import quota_lease_manager
+    from app.services.utils.usage_write_coalescer import usage_write_coalescer
+    from app.services.utils.warm_up import warm_up
+
+    if settings.quota_lease_enabled:
+        quota_lease_manager.start(session_factory.session_factory)
+    if settings.usage_write_batching:
+        usage_write_coalescer.start(session_factory.session_factory)
+    if settings.coupon_code_filter_enabled:
+        await coupon_code_filter.start(session_factory.session_factory)
+    if settings.cache_invalidation_enabled:
+        cache_invalidation_listener.start()
+    if settings.warm_up_enabled:
+        engines = [engine] if read_engine is engine else [engine, read_engine]
+        warm_up.start(engines, session_factory.session_factory)
+    else:
+        warm_up.ready = True
+
+
+async def _stop_services() -> None:
+    """Stop the background services."""
+    from app.services.utils.cache_invalidation import (
+        cache_invalidation_listener,
+    )
+    from app.services.utils.quota_lease import quota_lease_manager
+    from app.services.utils.usage_write_coalescer import usage_write_coalescer
+    from app.services.utils.warm_up import warm_up
+
+    # Pending writes are flushed and leases given back while the
+    # database is still reachable.
+    await warm_up.stop()
+    await usage_write_coalescer.stop()
+    await quota_lease_manager.stop()
+    await coupon_code_filter.stop()
+    await cache_invalidation_listener.stop()
+
+
 def startup(app: FastAPI) -> Callable[[], Awaitable[None]]:
     """
     Actions to run on application startup.
@@ -58,7 +168,15 @@ def startup(app: FastAPI) -> Callable[[], Awaitable[None]]:
     """
 
     async def _startup() -> None:
+        drain.reset()
         _setup_db(app)
+        await check_statement_cache(engine, settings.db_statement_cache_mode)
+        if read_engine is not engine:
+            await check_statement_cache(
+                read_engine,
+                settings.db_statement_cache_mode,
+            )
+        await _start_services()
 
         # Instrumentation and Log correlation
         if Environment.is_valid():
@@ -76,7 +194,14 @@ def shutdown(app: FastAPI) -> Callable[[], Awaitable[None]]:
     """
 
     async def _shutdown() -> None:
-        Telemetry.uninstrument(FastAPIInstrument(), app)
+        # In-flight work ends before the services and pools it uses.
+        await drain.wait()
+        if Environment.is_valid():
+            Telemetry.uninstrument(FastAPIInstrument(), app)
+        await _stop_services()
         await app.state.db_engine.dispose()
+        if app.state.db_read_engine is not app.state.db_engine:
+            await app.state.db_read_engine.dispose()
+        drain.finish()
 
     return _shutdown
@@ -0,0 +1,104 @@
+from typing import Callable, Dict, Optional, Sequence
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self, description: str):
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def snapshot(self) -> dict:
+        return {"type": "counter", "value": self.value}
+
+
+class Gauge:
+    """Value that goes up and down, set or read from a callback."""
+
+    def __init__(self, description: str):
+        self.description = description
+        self.value = 0
+        self._read: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, read: Callable[[], float]):
+        self._read = read
+
+    def snapshot(self) -> dict:
+        value = self._read() if self._read is not None else self.value
+        return {"type": "gauge", "value": value}
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets."""
+
+    def __init__(self, description: str, buckets: Sequence[float]):
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "type": "histogram",
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(self.buckets, self.bucket_counts)
+            },
+        }
+
+
+class MetricsRegistry:
+    """In-process metrics of the application, by name."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(name, Counter(description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._register(name, Gauge(description))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        buckets: Sequence[float],
+    ) -> Histogram:
+        return self._register(name, Histogram(description, buckets))
+
+    def snapshot(self) -> dict:
+        """
+        Read the current value of every metric.
+
+        :return: the metric values by name.
+        """
+        return {
+            name: metric.snapshot()
+            for name, metric in sorted(self._metrics.items())
+        }
+
+    def _register(self, name: str, metric):
+        return self._metrics.setdefault(name, metric)
+
+
+metrics = MetricsRegistry()
@@ -9,9 +9,11 @@ from sqlalchemy import (
     Numeric,
     String,
     UniqueConstraint,
+    case,
     func,
+    select,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import column_property, relationship
 
 from app.db.base import Base, CreateCustomID, CustomID
 from app.enums import UsageHistoryStatus
@@ -48,34 +50,75 @@ class Coupon(Base):
         nullable=False,
         default=func.now(),
     )
+    # Set when the definition changes, not when the usage counters do.
+    update_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=func.now(),
+        server_default=func.now(),
+        index=True,
+    )
     user_create = Column(String(STRING_SIZE))
     limit_per_customer = Column(Integer)
     delete_at = Column(DateTime(timezone=True))
     user_delete = Column(String(STRING_SIZE))
+    reserved_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    confirmed_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    accumulated_discount = Column(
+        Numeric(scale=2),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    counter_shards = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    quota_leasing = Column(
+        Boolean,
+        nullable=False,
+        default=False,
+        server_default="false",
+    )
+    leased_usage = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    leased_budget = Column(
+        Numeric(scale=2),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
     usage_histories = relationship("UsageHistory", backref="coupon")
 
     @property
     def accumulated_value(self):
-        return sum(
-            usage_history.discount_amount
-            for usage_history in self.usage_histories
+        return self.accumulated_discount + (
+            self.distributed_accumulated_discount or 0
         )
 
     @property
     def confirmed_usage(self):
-        confirmed_histories = [
-            h for h in self.usage_histories if h.is_confirmed()
-        ]
-
-        return len(confirmed_histories)
+        return self.confirmed_count + (self.distributed_confirmed_count or 0)
 
     @property
     def reserved_usage(self):
-        reserved_histories = [
-            h for h in self.usage_histories if h.is_reserved()
-        ]
-
-        return len(reserved_histories)
+        return self.reserved_count + (self.distributed_reserved_count or 0)
 
     @property
     def total_usage(self):
@@ -120,6 +163,8 @@ class UsageHistory(Base):
         ForeignKey("coupon.coupon_id"),
         nullable=False,
     )
+    counter_shard = Column(Integer)
+    lease_id = Column(CustomID(), ForeignKey("coupon_lease.id"))
     __table_args__ = (
         UniqueConstraint(
             "transaction_id",
@@ -133,3 +178,127 @@ class UsageHistory(Base):
 
     def is_reserved(self):
         return self.status == UsageHistoryStatus.RESERVED
+
+
+Index(
+    "usage_history_coupon_id_customer_key_index",
+    UsageHistory.coupon_id,
+    UsageHistory.customer_key,
+)
+
+
+class CouponCounterShard(Base):
+    """
+    Model of a shard of the usage counters of a hot coupon.
+
+    The remaining usage and budget of the coupon are split between its
+    shards, so reservations can lock any shard instead of the coupon row.
+    """
+
+    __tablename__ = "coupon_counter_shard"
+    coupon_id = Column(
+        CustomID(),
+        ForeignKey("coupon.coupon_id"),
+        primary_key=True,
+    )
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    max_usage = Column(Integer)
+    budget = Column(Numeric(scale=2))
+    reserved_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    confirmed_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    accumulated_discount = Column(
+        Numeric(scale=2),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+
+class CouponLease(Base):
+    """
+    Model of a block of usage and budget of a coupon leased by a pod.
+
+    The leased quota is taken from the coupon when the lease is granted,
+    and its unused part is given back when the lease is released.
+    """
+
+    __tablename__ = "coupon_lease"
+    id = Column(
+        CustomID(),
+        primary_key=True,
+        default=CreateCustomID(),
+        server_default=CreateCustomID(),
+    )
+    coupon_id = Column(
+        CustomID(),
+        ForeignKey("coupon.coupon_id"),
+        nullable=False,
+        index=True,
+    )
+    owner = Column(String(STRING_SIZE), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    max_usage = Column(Integer)
+    budget = Column(Numeric(scale=2))
+    reserved_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    confirmed_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+    accumulated_discount = Column(
+        Numeric(scale=2),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+
+def _sum_distributed_counters(shard_column, lease_column):
+    # Only coupons with sharded counters or leased quota are summed.
+    return column_property(
+        case(
+            (
+                Coupon.counter_shards > 0,
+                select(func.coalesce(func.sum(shard_column), 0))
+                .where(CouponCounterShard.coupon_id == Coupon.coupon_id)
+                .scalar_subquery(),
+            ),
+            (
+                Coupon.quota_leasing.is_(True),
+                select(func.coalesce(func.sum(lease_column), 0))
+                .where(CouponLease.coupon_id == Coupon.coupon_id)
+                .scalar_subquery(),
+            ),
+            else_=0,
+        ),
+    )
+
+
+Coupon.distributed_reserved_count = _sum_distributed_counters(
+    CouponCounterShard.reserved_count,
+    CouponLease.reserved_count,
+)
+Coupon.distributed_confirmed_count = _sum_distributed_counters(
+    CouponCounterShard.confirmed_count,
+    CouponLease.confirmed_count,
+)
+Coupon.distributed_accumulated_discount = _sum_distributed_counters(
+    CouponCounterShard.accumulated_discount,
+    CouponLease.accumulated_discount,
+)
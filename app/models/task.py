@@ -1,4 +1,14 @@
-from sqlalchemy import JSON, Column, DateTime, Enum, String, func
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    func,
+)
 
 from app.db.base import Base, CreateCustomID, CustomID
 from app.enums import TaskStatus
@@ -8,9 +18,19 @@ STRING_SIZE_LESS = 60
 
 
 class Task(Base):
-    """Model of task."""
+    """
+    Model of task.
+
+    The tasks are queued by status and claimed by the workers, which keep
+    their heartbeat while running them. A failed task is queued again, to
+    run after a backoff, until out of attempts. A task split in shards is
+    done when its shards, tasks of their own, are.
+    """
 
     __tablename__ = "task"
+    __table_args__ = (
+        Index("ix_task_status_created_at", "status", "created_at"),
+    )
 
     id = Column(
         CustomID(),
@@ -35,3 +55,9 @@ class Task(Base):
         nullable=False,
         default=func.now(),
     )
+    owner = Column(String(length=STRING_SIZE))
+    heartbeat_at = Column(DateTime(timezone=True))
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    run_after = Column(DateTime(timezone=True))
+    parent_id = Column(CustomID(), ForeignKey("task.id"), index=True)
+    shards = Column(Integer)
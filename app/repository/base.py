@@ -3,16 +3,21 @@ from datetime import datetime
 from sqlalchemy import and_, asc, desc, func, select, update
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncScalarResult, AsyncSession
-from sqlalchemy.orm import selectinload
 from sqlalchemy.sql.elements import BinaryExpression
 
 from app.api.helpers.exception import IntegrityException as IntegrityException
 from app.db.base import Base
+from app.db.compiled_cache import track_statement_sources
 
 
 class BaseRepository:
     """Class for accessing model table."""
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The compiled cache use is counted by repository method.
+        track_statement_sources(cls)
+
     def __init__(self, session: AsyncSession, model: Base):
         self.session = session
         self.model = model
@@ -45,7 +50,6 @@ class BaseRepository:
         """
         valid_cupom = (
             select(self.model)
-            .options(selectinload(self.model.usage_histories))
             .where(
                 and_(
                     self.model.valid_until >= datetime.today(),
@@ -58,7 +62,6 @@ class BaseRepository:
 
         unvalid_cupom = (
             select(self.model)
-            .options(selectinload(self.model.usage_histories))
             .where(
                 and_(
                     self.model.valid_until < datetime.today(),
@@ -126,3 +129,6 @@ class BaseRepository:
             await self.session.rollback()
             raise AssertionError("More than one row is being changed")
         return raw.rowcount
+
+
+track_statement_sources(BaseRepository)
@@ -1,8 +1,28 @@
+import json
+import random
+from collections import Counter, defaultdict
 from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 
 from fastapi import Depends
-from sqlalchemy import and_, or_, select
+from sqlalchemy import (
+    Integer,
+    String,
+    Table,
+    and_,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 from sqlalchemy.sql.sqltypes import Boolean
@@ -13,8 +33,58 @@ from app.api.helpers.exception import (
     MinPurchaseAmountException,
 )
 from app.db.dependencies import get_db_session
-from app.models.coupon import Coupon
+from app.enums import UsageHistoryStatus
+from app.models.coupon import (
+    Coupon,
+    CouponCounterShard,
+    CouponLease,
+    UsageHistory,
+)
 from app.repository.base import BaseRepository
+from app.repository.coupon_cache import (
+    INVALIDATION_CHANNEL,
+    CouponDefinition,
+    coupon_definition_cache,
+    coupon_definition_loads,
+    coupon_negative_cache,
+)
+from app.repository.coupon_code_filter import coupon_code_filter
+
+
+# Code, id and customer of the statements run by the warm-up, matching no
+# coupon.
+WARM_UP_KEY = "__warm_up__"
+
+
+class CouponUsage(NamedTuple):
+    """Usage aggregates of a coupon, computed by the database."""
+
+    total_usage: int
+    customer_usage: int
+    accumulated_value: Decimal
+
+
+class UsageReservation(NamedTuple):
+    """Reservation of a usage of a coupon, written by a batch."""
+
+    transaction_id: str
+    customer_key: str
+    discount_amount: Decimal
+    lease_id: Optional[str] = None
+
+
+class CouponCountersDrift(NamedTuple):
+    """Stored usage counters of a coupon, shard or lease and their recount."""
+
+    coupon_id: str
+    reserved_count: int
+    confirmed_count: int
+    accumulated_discount: Decimal
+    expected_reserved: int
+    expected_confirmed: int
+    expected_accumulated: Decimal
+    shard: Optional[int] = None
+    lease_id: Optional[str] = None
 
 
 class CouponRepository(BaseRepository):
@@ -33,9 +103,7 @@ class CouponRepository(BaseRepository):
         :return: a Coupon.
         """
         raw = await self.session.execute(
-            select(Coupon)
-            .options(selectinload(Coupon.usage_histories))
-            .where(Coupon.coupon_id == coupon_id),
+            select(Coupon).where(Coupon.coupon_id == coupon_id),
         )
 
         return raw.scalar_one()
@@ -50,7 +118,6 @@ class CouponRepository(BaseRepository):
         """
         raw = await self.session.execute(
             select(Coupon)
-            .options(selectinload(Coupon.usage_histories))
             .where(Coupon.code == code)
             .where(Coupon.active.is_(True)),
         )
@@ -66,7 +133,6 @@ class CouponRepository(BaseRepository):
         """
         raw = await self.session.execute(
             select(Coupon)
-            .options(selectinload(Coupon.usage_histories))
             .where(Coupon.code == code)
             .where(Coupon.valid_from <= datetime.today())
             .where(Coupon.valid_until >= datetime.today())
@@ -80,50 +146,237 @@ class CouponRepository(BaseRepository):
         customer_key: str,
         first_purchase: bool,
         purchase_amount: Decimal,
-    ) -> Coupon:
+    ) -> Tuple[Union[Coupon, CouponDefinition], CouponUsage]:
         """
         Check if coupon is valid.
 
+        The usage counters are stored in the coupon row and the usage by
+        the customer is computed by a correlated subquery in the same
+        statement, so the cost does not grow with the number of usage
+        histories of the coupon.
+
+        The definition of the coupon is cached, so later lookups only read
+        its counters by primary key and use the cached definition. Its
+        state and counters are always read from the database.
+
+        Concurrent lookups of a code not cached share a single read of the
+        coupon, and the lookups waiting for it only read the counters.
+
         :param code: code of coupon.
         :param customer_key: key of customer.
         :param first_purchase: indicates if is first purchase.
         :param purchase_amount: total purchase amount.
 
-        :return: True if coupon is valid, False otherwise.
+        :return: the valid coupon, or its cached definition, and its usage
+            aggregates.
         """
+        result = await self._get_cached_valid_coupon(
+            code,
+            customer_key,
+            first_purchase,
+            purchase_amount,
+        )
+        if result is None:
+            result = await self._load_valid_coupon(code, customer_key)
 
-        raw = await self.session.execute(
-            select(Coupon)
-            .options(selectinload(Coupon.usage_histories))
-            .where(Coupon.code == code)
-            .where(Coupon.valid_from <= datetime.now(timezone.utc))
-            .where(Coupon.valid_until >= datetime.now(timezone.utc))
-            .where(
-                or_(
-                    Coupon.customer_key.is_(None),
-                    Coupon.customer_key == customer_key,
-                ),
+        coupon, coupon_usage = result
+        _check_purchase(coupon, first_purchase, purchase_amount)
+
+        if coupon.max_usage and coupon_usage.total_usage >= coupon.max_usage:
+            raise MaxUsageException()
+
+        return coupon, coupon_usage
+
+    async def _load_valid_coupon(
+        self,
+        code: str,
+        customer_key: str,
+    ) -> Tuple[Union[Coupon, CouponDefinition], CouponUsage]:
+        """
+        Read a valid coupon by its code, or wait for the read in flight.
+
+        :param code: code of coupon.
+        :param customer_key: key of customer.
+
+        :return: the coupon, or its definition if read by a concurrent
+            lookup, and its usage aggregates.
+
+        :raises NoResultFound: no valid coupon with the code.
+        """
+        loaded = []
+
+        async def load() -> CouponDefinition:
+            coupon, coupon_usage = await self._get_valid_coupon_by_code(
+                code,
+                customer_key,
             )
-            .where(Coupon.active.is_(True)),
+            loaded.append((coupon, coupon_usage))
+            return CouponDefinition.from_coupon(coupon)
+
+        definition = await coupon_definition_loads.do(
+            (code, customer_key),
+            load,
         )
-        coupon = raw.scalar_one()
+        if loaded:
+            return loaded[0]
 
-        if coupon.first_purchase and not first_purchase:
-            raise FirstPurchaseException()
+        coupon_usage = await self._get_coupon_usage(definition, customer_key)
+        if coupon_usage is None:
+            raise NoResultFound("No valid coupon with the code")
+        return definition, coupon_usage
 
-        if coupon.min_purchase_amount and (
-            coupon.min_purchase_amount > purchase_amount
-        ):
-            raise MinPurchaseAmountException()
+    async def _get_valid_coupon_by_code(
+        self,
+        code: str,
+        customer_key: str,
+    ) -> Tuple[Coupon, CouponUsage]:
+        """
+        Read a valid coupon by its code and cache its definition.
 
+        Codes ruled out by the code filter, or recently not found for the
+        customer, are rejected without a query.
+
+        :param code: code of coupon.
+        :param customer_key: key of customer.
+
+        :return: the coupon and its usage aggregates.
+
+        :raises NoResultFound: no valid coupon with the code.
+        """
         if (
-            coupon.max_usage
-            and coupon.usage_histories
-            and len(coupon.usage_histories) >= coupon.max_usage
+            not coupon_code_filter.might_contain(code)
+            or (code, customer_key) in coupon_negative_cache
         ):
-            raise MaxUsageException()
+            raise NoResultFound("No valid coupon with the code")
 
-        return coupon
+        generation = coupon_definition_cache.generation
+        negative_generation = coupon_negative_cache.generation
+        raw = await self.session.execute(
+            _select_valid_coupon(code, customer_key),
+        )
+        row = raw.one_or_none()
+        if row is None:
+            coupon_code_filter.record_not_found()
+            coupon_negative_cache.put(code, customer_key, negative_generation)
+            raise NoResultFound("No valid coupon with the code")
+
+        coupon, customer_usage = row
+        coupon_definition_cache.put(
+            CouponDefinition.from_coupon(coupon),
+            customer_key,
+            generation,
+        )
+        return coupon, CouponUsage(
+            total_usage=coupon.total_usage,
+            customer_usage=customer_usage,
+            accumulated_value=coupon.accumulated_value,
+        )
+
+    async def _get_cached_valid_coupon(
+        self,
+        code: str,
+        customer_key: str,
+        first_purchase: bool,
+        purchase_amount: Decimal,
+    ) -> Optional[Tuple[CouponDefinition, CouponUsage]]:
+        """
+        Read the usage of the valid coupon of a cached definition.
+
+        The static conditions are checked against the definition before
+        the counters are read. A definition whose coupon is no longer valid
+        is invalidated, as the code may now belong to another coupon.
+
+        :param code: code of coupon.
+        :param customer_key: key of customer.
+        :param first_purchase: indicates if is first purchase.
+        :param purchase_amount: total purchase amount.
+
+        :return: the definition and the usage aggregates of the coupon,
+            None if the definition is not cached.
+        """
+        definition = coupon_definition_cache.get(code, customer_key)
+        if definition is None:
+            return None
+
+        _check_purchase(definition, first_purchase, purchase_amount)
+        coupon_usage = await self._get_coupon_usage(definition, customer_key)
+        if coupon_usage is None:
+            coupon_definition_cache.invalidate(definition.coupon_id)
+            return None
+        return definition, coupon_usage
+
+    async def _get_coupon_usage(
+        self,
+        definition: CouponDefinition,
+        customer_key: str,
+    ) -> Optional[CouponUsage]:
+        """
+        Read the usage aggregates of the coupon of a definition.
+
+        :param definition: definition of coupon.
+        :param customer_key: key of customer.
+
+        :return: the usage aggregates, None if the coupon is no longer
+            valid.
+        """
+        raw = await self.session.execute(
+            select(
+                (
+                    Coupon.reserved_count
+                    + Coupon.confirmed_count
+                    + Coupon.distributed_reserved_count
+                    + Coupon.distributed_confirmed_count
+                ),
+                _customer_usage(customer_key),
+                (
+                    Coupon.accumulated_discount
+                    + Coupon.distributed_accumulated_discount
+                ),
+            ).where(
+                Coupon.coupon_id == definition.coupon_id,
+                *_coupon_guards(),
+            ),
+        )
+        row = raw.one_or_none()
+        if row is None:
+            return None
+        return CouponUsage(*row)
+
+    async def get_most_used_valid(self, limit: int) -> List[Coupon]:
+        """
+        Get the valid coupons with the most usages.
+
+        :param limit: max number of coupons.
+
+        :return: list of coupons, the most used first.
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(*_coupon_guards())
+            .order_by((Coupon.reserved_count + Coupon.confirmed_count).desc())
+            .limit(limit),
+        )
+        return raw.scalars().all()
+
+    async def warm_up(self):
+        """
+        Run the statements of the lookup and the reservation of a coupon
+        once, so they are compiled before the first requests.
+
+        The statements match no coupon, and the session is expected to be
+        rolled back.
+        """
+        coupon = Coupon(
+            coupon_id=WARM_UP_KEY,
+            code=WARM_UP_KEY,
+            max_usage=1,
+            counter_shards=0,
+        )
+        await self.session.execute(
+            _select_valid_coupon(WARM_UP_KEY, WARM_UP_KEY),
+        )
+        await self._get_coupon_usage(coupon, WARM_UP_KEY)
+        await self._reserve_usage(coupon, WARM_UP_KEY, WARM_UP_KEY, Decimal(0))
 
     async def check_duplicate_coupon_name(
         self,
@@ -155,24 +408,131 @@ class CouponRepository(BaseRepository):
                 ),
             )
             .where(Coupon.active.is_(True))
-            .filter(
-                or_(
-                    and_(
-                        Coupon.valid_from <= valid_from,
-                        Coupon.valid_until >= valid_from,
-                    ),
-                    and_(
-                        Coupon.valid_from <= valid_until,
-                        Coupon.valid_until >= valid_until,
-                    ),
-                ),
-            ),
+            .filter(_overlapping(valid_from, valid_until)),
         )
 
         if len(raw.all()) > 0:
             return True
         return False
 
+    async def get_duplicate_customer_keys(
+        self,
+        code: str,
+        customer_keys: List[str],
+        valid_from: datetime,
+        valid_until: datetime,
+    ) -> Set[str]:
+        """
+        Find the customer keys of a batch whose coupon name is taken.
+
+        The whole batch is checked in one query, with the rules of
+        ``check_duplicate_coupon_name``.
+
+        :param code: code of coupon.
+        :param customer_keys: keys of customers of the batch.
+        :param valid_from: initial date of the coupons
+        :param valid_until: end date of the coupons
+
+        :return: the taken keys, all of them if a coupon of any customer
+            takes the name.
+        """
+        raw = await self.session.execute(
+            select(Coupon.customer_key)
+            .distinct()
+            .where(Coupon.code == code)
+            .where(
+                or_(
+                    Coupon.customer_key.is_(None),
+                    Coupon.customer_key.in_(customer_keys),
+                ),
+            )
+            .where(Coupon.active.is_(True))
+            .filter(_overlapping(valid_from, valid_until)),
+        )
+
+        taken = set(raw.scalars())
+        if None in taken:
+            return set(customer_keys)
+        return taken
+
+    async def insert_staged_coupons(
+        self,
+        staging: Table,
+        values: dict,
+    ) -> List[str]:
+        """
+        Insert the coupons of the customer keys of a staging table.
+
+        One statement inserts the coupons, skipping the keys repeated in
+        the staging table or whose coupon name is taken, with the rules of
+        ``check_duplicate_coupon_name``. The merges of a code are
+        serialized until commit. Only on PostgreSQL.
+
+        :param staging: table of ``ordinal`` and ``customer_key`` columns.
+        :param values: column values of the coupons, but the customer key.
+
+        :return: the keys skipped, in the order of the staging table.
+        """
+        # The shards of a file are merged one at a time, each seeing the
+        # coupons committed by the previous ones.
+        await self.session.execute(
+            select(
+                func.pg_advisory_xact_lock(
+                    func.hashtext(f"bulk:{values['code']}"),
+                ),
+            ),
+        )
+        taken = select(Coupon.coupon_id).where(
+            Coupon.code == values["code"],
+            Coupon.active.is_(True),
+            _overlapping(values["valid_from"], values["valid_until"]),
+        )
+        repeated = (
+            func.row_number().over(
+                partition_by=staging.c.customer_key,
+                order_by=staging.c.ordinal,
+            )
+            > 1
+        )
+        staged = select(
+            staging.c.ordinal,
+            staging.c.customer_key,
+            or_(
+                repeated,
+                # Not correlated, evaluated once for all the keys.
+                exists(taken.where(Coupon.customer_key.is_(None))),
+                exists(
+                    taken.where(
+                        Coupon.customer_key == staging.c.customer_key,
+                    ),
+                ),
+            ).label("skipped"),
+        ).cte("staged")
+
+        columns = Coupon.__table__.c
+        inserted = (
+            insert(Coupon)
+            .from_select(
+                list(values) + ["customer_key"],
+                select(
+                    *[
+                        literal(value, columns[name].type)
+                        for name, value in values.items()
+                    ],
+                    staged.c.customer_key,
+                ).where(staged.c.skipped.is_(False)),
+            )
+            .cte("inserted")
+        )
+        # Every part of the statement sees the coupons from before it.
+        raw = await self.session.execute(
+            select(staged.c.customer_key)
+            .add_cte(inserted)
+            .where(staged.c.skipped.is_(True))
+            .order_by(staged.c.ordinal),
+        )
+        return list(raw.scalars())
+
     async def check_valid_delete(self, coupon_id):
         """
         Check this delete is valid.
@@ -197,6 +557,34 @@ class CouponRepository(BaseRepository):
         except TypeError:
             return True
 
+    async def notify_coupon_changed(
+        self,
+        coupon_id: Optional[str] = None,
+        code: Optional[str] = None,
+    ):
+        """
+        Tell every process to drop its cached state of a coupon.
+
+        The notification is sent when the transaction commits, so no
+        process reloads the coupon before the change is visible. Identical
+        notifications of a transaction are sent once.
+
+        :param coupon_id: id of the changed coupon.
+        :param code: code the coupon now has, if it can now be found.
+        """
+        if self.session.bind.dialect.name != "postgresql":
+            return
+
+        payload = json.dumps(
+            {
+                "coupon_id": None if coupon_id is None else str(coupon_id),
+                "code": code,
+            },
+        )
+        await self.session.execute(
+            select(func.pg_notify(INVALIDATION_CHANNEL, payload)),
+        )
+
     async def activate_coupon(self, coupon_id):
         """
         Activate a coupon.
@@ -216,8 +604,9 @@ class CouponRepository(BaseRepository):
 
             await self.update(
                 (Coupon.coupon_id == coupon_id),
-                {"active": True},
+                {"active": True, "update_at": func.now()},
             )
+            await self.notify_coupon_changed(coupon_id, coupon.code)
 
         except AttributeError:
             return True
@@ -244,6 +633,1220 @@ class CouponRepository(BaseRepository):
                 (Coupon.coupon_id == coupon_id),
                 {"active": False},
             )
+            await self.notify_coupon_changed(coupon_id)
 
         except AttributeError:
             return True
+
+    async def update_usage_counters(
+        self,
+        coupon_id: str,
+        reserved: int = 0,
+        confirmed: int = 0,
+        discount_amount: Decimal = Decimal(0),
+        shard: Optional[int] = None,
+        lease_id: Optional[str] = None,
+    ) -> int:
+        """
+        Increment the usage counters of a coupon.
+
+        The increment is computed by the database, so concurrent updates of
+        the same coupon are serialized by the row lock instead of
+        overwriting each other.
+
+        :param coupon_id: id of coupon.
+        :param reserved: increment of the reserved usage counter.
+        :param confirmed: increment of the confirmed usage counter.
+        :param discount_amount: increment of the accumulated discount.
+        :param shard: counter shard of the usage, None for the coupon row.
+        :param lease_id: quota lease of the usage, None for the coupon row.
+
+        :return: count of updated rows.
+
+        :raises NoResultFound: 404 - Coupon not found
+        """
+        if lease_id is not None:
+            raw = await self.session.execute(
+                update(CouponLease)
+                .where(CouponLease.id == lease_id)
+                .values(
+                    _increment_usage_counters(
+                        CouponLease,
+                        reserved,
+                        confirmed,
+                        discount_amount,
+                    ),
+                ),
+            )
+            if raw.rowcount:
+                return raw.rowcount
+            # The lease was released, its counters moved to the coupon.
+
+        if shard is None:
+            return await self.update(
+                (Coupon.coupon_id == coupon_id),
+                _increment_usage_counters(
+                    Coupon,
+                    reserved,
+                    confirmed,
+                    discount_amount,
+                ),
+            )
+
+        raw = await self.session.execute(
+            update(CouponCounterShard)
+            .where(CouponCounterShard.coupon_id == coupon_id)
+            .where(CouponCounterShard.shard == shard)
+            .values(
+                _increment_usage_counters(
+                    CouponCounterShard,
+                    reserved,
+                    confirmed,
+                    discount_amount,
+                ),
+            ),
+        )
+        if raw.rowcount == 0:
+            raise NoResultFound("CouponCounterShard not found")
+        return raw.rowcount
+
+    async def reserve_usage(
+        self,
+        coupon: Coupon,
+        transaction_id: str,
+        customer_key: str,
+        discount_amount: Decimal,
+        lease_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Reserve a usage of a coupon if the coupon limits allow it.
+
+        The limits are checked by the statement that inserts the usage
+        history, so concurrent reservations cannot oversubscribe the
+        coupon. On PostgreSQL the counters row is locked, the usage history
+        inserted and the counters updated by a single statement, after the
+        reservations of the customer are serialized if the coupon limits
+        the usage per customer.
+
+        Coupons with sharded counters reserve on a random shard with room
+        left, falling back to the other shards. When no shard has room the
+        quotas of the shards are rebalanced, so the reservation is only
+        refused by the limits of the coupon. Reservations on a quota
+        lease only check and update the lease.
+
+        :param coupon: coupon model item.
+        :param transaction_id: transaction id of the reservation.
+        :param customer_key: key of customer.
+        :param discount_amount: discount granted by the reservation.
+        :param lease_id: quota lease the reservation is taken from.
+
+        :return: True if reserved, False if a limit refused the reservation.
+        """
+        reserve = (
+            coupon,
+            transaction_id,
+            customer_key,
+            discount_amount,
+            lease_id,
+        )
+        reserved = await self._reserve_usage(*reserve)
+        if reserved or lease_id is not None or not coupon.counter_shards:
+            return reserved
+
+        rebalanced = await self.rebalance_counter_shards(
+            coupon.coupon_id,
+            discount_amount,
+        )
+        return rebalanced and await self._reserve_usage(*reserve)
+
+    async def _reserve_usage(
+        self,
+        coupon: Coupon,
+        transaction_id: str,
+        customer_key: str,
+        discount_amount: Decimal,
+        lease_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Reserve a usage of a coupon on a single counters row.
+
+        :param coupon: coupon model item.
+        :param transaction_id: transaction id of the reservation.
+        :param customer_key: key of customer.
+        :param discount_amount: discount granted by the reservation.
+        :param lease_id: quota lease the reservation is taken from.
+
+        :return: True if reserved, False if a limit refused the reservation.
+        """
+        usage_history = {
+            UsageHistory.transaction_id: transaction_id,
+            UsageHistory.customer_key: customer_key,
+            UsageHistory.discount_amount: discount_amount,
+            UsageHistory.status: UsageHistoryStatus.RESERVED.value,
+        }
+        usage_history_values = [
+            cast(literal(value), column.type)
+            for column, value in usage_history.items()
+        ]
+        counter, counter_column, available_counter = _select_available_counter(
+            coupon,
+            lease_id,
+            customer_key,
+            discount_amount,
+            usage_history_values,
+        )
+        columns = [*usage_history, UsageHistory.coupon_id]
+        if counter_column is not None:
+            columns.append(counter_column)
+
+        if self.session.bind.dialect.name == "postgresql":
+            if coupon.limit_per_customer:
+                await self._lock_customer_usage(coupon.coupon_id, customer_key)
+            return await self._reserve_usage_returning(
+                counter,
+                columns,
+                available_counter,
+                discount_amount,
+            )
+
+        raw = await self.session.execute(
+            insert(UsageHistory).from_select(
+                columns,
+                available_counter.where(
+                    ~exists().where(
+                        UsageHistory.coupon_id == coupon.coupon_id,
+                        UsageHistory.transaction_id == transaction_id,
+                    ),
+                ),
+            ),
+        )
+        if raw.rowcount != 1:
+            return False
+
+        raw = await self.session.execute(
+            select(UsageHistory.counter_shard, UsageHistory.lease_id)
+            .where(UsageHistory.coupon_id == coupon.coupon_id)
+            .where(UsageHistory.transaction_id == transaction_id),
+        )
+        shard, lease_id = raw.one()
+        await self.update_usage_counters(
+            coupon.coupon_id,
+            reserved=1,
+            discount_amount=discount_amount,
+            shard=shard,
+            lease_id=lease_id,
+        )
+        return True
+
+    async def reserve_usages(
+        self,
+        coupon_id: str,
+        reservations: List[UsageReservation],
+    ) -> List[bool]:
+        """
+        Reserve several usages of a coupon with a single insert.
+
+        The coupon row is locked once and the reservations are checked
+        against its limits in order, as if they were reserved one by one.
+        Only coupons whose counters are held by the coupon row can be
+        reserved in batch.
+
+        :param coupon_id: id of coupon.
+        :param reservations: reservations, in arrival order.
+
+        :return: for each reservation, True if reserved, False if a limit
+            refused it.
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(
+                Coupon.coupon_id == coupon_id,
+                Coupon.counter_shards == 0,
+                Coupon.quota_leasing.is_(False),
+                *_coupon_guards(),
+            )
+            .with_for_update(of=Coupon)
+            .execution_options(populate_existing=True),
+        )
+        coupon = raw.scalar_one_or_none()
+        if coupon is None:
+            return [False] * len(reservations)
+
+        raw = await self.session.execute(
+            select(UsageHistory.transaction_id).where(
+                UsageHistory.coupon_id == coupon_id,
+                UsageHistory.transaction_id.in_(
+                    [
+                        reservation.transaction_id
+                        for reservation in reservations
+                    ],
+                ),
+            ),
+        )
+        taken = set(raw.scalars().all())
+        raw = await self.session.execute(
+            select(UsageHistory.customer_key, func.count(UsageHistory.id))
+            .where(
+                UsageHistory.coupon_id == coupon_id,
+                UsageHistory.customer_key.in_(
+                    {reservation.customer_key for reservation in reservations},
+                ),
+            )
+            .group_by(UsageHistory.customer_key),
+        )
+        admission = _BatchAdmission(coupon, taken, Counter(dict(raw.all())))
+        reserved = [
+            admission.admit(reservation) for reservation in reservations
+        ]
+        if not admission.admitted:
+            return reserved
+
+        await self.session.execute(
+            insert(UsageHistory).values(
+                [
+                    {
+                        "transaction_id": reservation.transaction_id,
+                        "customer_key": reservation.customer_key,
+                        "discount_amount": reservation.discount_amount,
+                        "status": UsageHistoryStatus.RESERVED.value,
+                        "coupon_id": coupon_id,
+                    }
+                    for reservation in admission.admitted
+                ],
+            ),
+        )
+        await self.update_usage_counters(
+            coupon_id,
+            reserved=len(admission.admitted),
+            discount_amount=sum(
+                reservation.discount_amount
+                for reservation in admission.admitted
+            ),
+        )
+        return reserved
+
+    async def confirm_usages(self, coupon_id: str, transaction_ids: List[str]):
+        """
+        Confirm several reserved usages of a coupon with a single update.
+
+        Usages already confirmed or no longer reserved are left untouched.
+
+        :param coupon_id: id of coupon.
+        :param transaction_ids: transaction ids of the usages.
+        """
+        usages = await self._lock_usages(coupon_id, transaction_ids)
+        reserved = [
+            usage
+            for usage in usages
+            if usage.status == UsageHistoryStatus.RESERVED.value
+        ]
+        if not reserved:
+            return
+
+        await self.session.execute(
+            update(UsageHistory)
+            .where(UsageHistory.id.in_([usage.id for usage in reserved]))
+            .values(status=UsageHistoryStatus.CONFIRMED.value)
+            .execution_options(synchronize_session=False),
+        )
+        for (shard, lease_id), (count, _) in _group_by_counter(reserved):
+            await self.update_usage_counters(
+                coupon_id,
+                reserved=-count,
+                confirmed=count,
+                shard=shard,
+                lease_id=lease_id,
+            )
+
+    async def release_usages(
+        self,
+        coupon_id: str,
+        transaction_ids: List[str],
+    ) -> Set[str]:
+        """
+        Delete several reserved usages of a coupon with a single delete.
+
+        :param coupon_id: id of coupon.
+        :param transaction_ids: transaction ids of the usages.
+
+        :return: transaction ids of the usages that could not be released
+            because they are already confirmed.
+        """
+        usages = await self._lock_usages(coupon_id, transaction_ids)
+        reserved = [
+            usage
+            for usage in usages
+            if usage.status == UsageHistoryStatus.RESERVED.value
+        ]
+        if reserved:
+            await self.session.execute(
+                delete(UsageHistory)
+                .where(UsageHistory.id.in_([usage.id for usage in reserved]))
+                .execution_options(synchronize_session=False),
+            )
+        for (shard, lease_id), (count, discount) in _group_by_counter(
+            reserved,
+        ):
+            await self.update_usage_counters(
+                coupon_id,
+                reserved=-count,
+                discount_amount=-discount,
+                shard=shard,
+                lease_id=lease_id,
+            )
+
+        return {
+            usage.transaction_id
+            for usage in usages
+            if usage.status == UsageHistoryStatus.CONFIRMED.value
+        }
+
+    async def _lock_usages(self, coupon_id: str, transaction_ids: List[str]):
+        """
+        Lock the usage histories of a coupon by transaction id.
+
+        :param coupon_id: id of coupon.
+        :param transaction_ids: transaction ids of the usages.
+
+        :return: rows with the id, transaction id, status, discount and
+            counters row of each usage.
+        """
+        raw = await self.session.execute(
+            select(
+                UsageHistory.id,
+                UsageHistory.transaction_id,
+                UsageHistory.status,
+                UsageHistory.discount_amount,
+                UsageHistory.counter_shard,
+                UsageHistory.lease_id,
+            )
+            .where(UsageHistory.coupon_id == coupon_id)
+            .where(UsageHistory.transaction_id.in_(transaction_ids))
+            .order_by(UsageHistory.id)
+            .with_for_update(),
+        )
+        return raw.all()
+
+    async def _reserve_usage_returning(
+        self,
+        counter,
+        columns: list,
+        available_counter,
+        discount_amount: Decimal,
+    ) -> bool:
+        """
+        Reserve a usage on the first counters row with room left.
+
+        :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+        :param columns: usage history columns filled by the select.
+        :param available_counter: select of the counters row with room.
+        :param discount_amount: discount granted by the reservation.
+
+        :return: True if reserved.
+        """
+        if counter is CouponCounterShard:
+            # Busy shards are skipped first, and only waited for when
+            # every shard is busy.
+            reserved = await self._insert_usage_returning(
+                counter,
+                columns,
+                available_counter.with_for_update(
+                    of=counter,
+                    skip_locked=True,
+                ),
+                discount_amount,
+            )
+            if reserved:
+                return True
+
+        return await self._insert_usage_returning(
+            counter,
+            columns,
+            available_counter.with_for_update(of=counter),
+            discount_amount,
+        )
+
+    async def _lock_customer_usage(self, coupon_id: str, customer_key: str):
+        """
+        Serialize the reservations of a customer on a coupon until commit.
+
+        The usage by the customer is counted by the reservation statement
+        from its snapshot, which is not refreshed when the statement waits
+        for the counters row. Holding this lock first makes the snapshot
+        include the reservations of the customer committed meanwhile.
+
+        :param coupon_id: id of coupon.
+        :param customer_key: key of customer.
+        """
+        await self.session.execute(
+            select(
+                func.pg_advisory_xact_lock(
+                    func.hashtext(f"{coupon_id}:{customer_key}"),
+                ),
+            ),
+        )
+
+    async def _insert_usage_returning(
+        self,
+        counter,
+        columns: list,
+        available_counter,
+        discount_amount: Decimal,
+    ) -> bool:
+        """
+        Insert a reserved usage and update its counters in one statement.
+
+        :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+        :param columns: usage history columns filled by the select.
+        :param available_counter: select of the counters row with room.
+        :param discount_amount: discount granted by the reservation.
+
+        :return: True if reserved.
+        """
+        reserved = (
+            postgresql_insert(UsageHistory)
+            .from_select(columns, available_counter)
+            .on_conflict_do_nothing(
+                constraint="usage_history_transaction_id_coupon_id_key",
+            )
+            .returning(
+                UsageHistory.coupon_id,
+                UsageHistory.counter_shard,
+                UsageHistory.lease_id,
+            )
+            .cte("reserved")
+        )
+        counter_filter = counter.coupon_id == reserved.c.coupon_id
+        if counter is CouponLease:
+            counter_filter = CouponLease.id == reserved.c.lease_id
+        elif counter is CouponCounterShard:
+            counter_filter = and_(
+                counter_filter,
+                CouponCounterShard.shard == reserved.c.counter_shard,
+            )
+
+        raw = await self.session.execute(
+            update(counter)
+            .where(counter_filter)
+            .values(
+                _increment_usage_counters(
+                    counter,
+                    reserved=1,
+                    discount_amount=discount_amount,
+                ),
+            )
+            .returning(counter.coupon_id)
+            .execution_options(synchronize_session=False),
+        )
+        return raw.first() is not None
+
+    async def enable_counter_shards(self, coupon_id: str, shards: int):
+        """
+        Split the usage counters of a coupon across shard rows.
+
+        :param coupon_id: id of coupon.
+        :param shards: number of counter shards.
+
+        :return: True if the counters are already sharded or leased, False
+            otherwise.
+
+        :raises NoResultFound: 404 - Coupon not found
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(of=Coupon)
+            .execution_options(populate_existing=True),
+        )
+        coupon = raw.scalar_one()
+        if coupon.counter_shards or coupon.quota_leasing:
+            return True
+
+        self.session.add_all(
+            [
+                CouponCounterShard(
+                    coupon_id=coupon_id,
+                    shard=shard,
+                    reserved_count=0,
+                    confirmed_count=0,
+                    accumulated_discount=Decimal(0),
+                )
+                for shard in range(shards)
+            ],
+        )
+        coupon.counter_shards = shards
+        await self.session.flush()
+        await self.split_counter_shards_quota(coupon_id)
+        return False
+
+    async def split_counter_shards_quota(self, coupon_id: str):
+        """
+        Split the usage and budget left of a coupon between its shards.
+
+        Each shard keeps what it has already used and receives an equal
+        part of what is left, so the shards together never exceed the
+        ``max_usage`` and ``budget`` of the coupon.
+
+        :param coupon_id: id of coupon.
+
+        :raises NoResultFound: 404 - Coupon not found
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(of=Coupon)
+            .execution_options(populate_existing=True),
+        )
+        coupon = raw.scalar_one()
+        raw = await self.session.execute(
+            select(CouponCounterShard)
+            .where(CouponCounterShard.coupon_id == coupon_id)
+            .order_by(CouponCounterShard.shard)
+            .with_for_update()
+            .execution_options(populate_existing=True),
+        )
+        counter_shards = raw.scalars().all()
+        if not counter_shards:
+            return
+
+        if coupon.max_usage is None:
+            usage_quotas = [None] * len(counter_shards)
+        else:
+            usage_left = max(coupon.max_usage - coupon.total_usage, 0)
+            usage_quotas = _split_evenly(usage_left, len(counter_shards))
+
+        if not coupon.budget:
+            budget_quotas = [None] * len(counter_shards)
+        else:
+            cents_left = max(
+                int((coupon.budget - coupon.accumulated_value) * 100),
+                0,
+            )
+            budget_quotas = [
+                Decimal(cents) / 100
+                for cents in _split_evenly(cents_left, len(counter_shards))
+            ]
+
+        for counter_shard, usage_quota, budget_quota in zip(
+            counter_shards,
+            usage_quotas,
+            budget_quotas,
+        ):
+            counter_shard.max_usage = (
+                None
+                if usage_quota is None
+                else counter_shard.reserved_count
+                + counter_shard.confirmed_count
+                + usage_quota
+            )
+            counter_shard.budget = (
+                None
+                if budget_quota is None
+                else counter_shard.accumulated_discount + budget_quota
+            )
+        await self.session.flush()
+
+    async def rebalance_counter_shards(
+        self,
+        coupon_id: str,
+        discount_amount: Decimal,
+    ) -> bool:
+        """
+        Move quota between the shards so one of them can take a usage.
+
+        The quotas left in the other shards are moved to the shard with the
+        most budget left until it has room for the usage, so a discount
+        bigger than the part of any shard is only refused when the shards
+        together cannot take it.
+
+        :param coupon_id: id of coupon.
+        :param discount_amount: discount of the usage to make room for.
+
+        :return: True if quota was moved to make room for the usage, False
+            if the shards had room already or cannot make it.
+        """
+        await self.session.execute(
+            select(Coupon.coupon_id)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(of=Coupon),
+        )
+        raw = await self.session.execute(
+            select(CouponCounterShard)
+            .where(CouponCounterShard.coupon_id == coupon_id)
+            .order_by(CouponCounterShard.shard)
+            .with_for_update()
+            .execution_options(populate_existing=True),
+        )
+        counter_shards = raw.scalars().all()
+        if not counter_shards:
+            return False
+
+        target = max(counter_shards, key=_shard_budget_left)
+        donors = [shard for shard in counter_shards if shard is not target]
+        usage_needed = 1 - _shard_usage_left(target)
+        budget_needed = discount_amount - _shard_budget_left(target)
+        if usage_needed <= 0 and budget_needed <= 0:
+            # The shards were not what refused the usage.
+            return False
+        if usage_needed > sum(map(_shard_usage_left, donors)) or (
+            budget_needed > sum(map(_shard_budget_left, donors))
+        ):
+            return False
+
+        for donor in donors:
+            moved_usage, moved_budget = _move_shard_quota(
+                donor,
+                target,
+                max(usage_needed, 0),
+                max(budget_needed, Decimal(0)),
+            )
+            usage_needed -= moved_usage
+            budget_needed -= moved_budget
+        await self.session.flush()
+        return True
+
+    async def enable_quota_leasing(self, coupon_id: str):
+        """
+        Let the pods lease blocks of usage and budget of a coupon.
+
+        :param coupon_id: id of coupon.
+
+        :return: True if the counters are already sharded or leased, False
+            otherwise.
+
+        :raises NoResultFound: 404 - Coupon not found
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(of=Coupon)
+            .execution_options(populate_existing=True),
+        )
+        coupon = raw.scalar_one()
+        if coupon.counter_shards or coupon.quota_leasing:
+            return True
+
+        coupon.quota_leasing = True
+        await self.session.flush()
+        return False
+
+    async def get_usage_counters_drift(
+        self,
+        after_coupon_id: str = "",
+        limit: int = 1000,
+    ) -> Tuple[List[CouponCountersDrift], Optional[str]]:
+        """
+        Compare the stored usage counters with the usage histories.
+
+        Coupons are scanned in pages ordered by id so the check can run
+        against a live database without a long running statement.
+
+        :param after_coupon_id: last coupon id of the previous page.
+        :param limit: number of coupons of the page.
+
+        :return: the drifted counters of the page and the last coupon id of
+            the page, None when there are no more coupons.
+        """
+        raw = await self.session.execute(
+            _select_usage_counters(Coupon)
+            .where(Coupon.coupon_id > after_coupon_id)
+            .order_by(Coupon.coupon_id)
+            .limit(limit),
+        )
+        rows = raw.all()
+        if not rows:
+            return [], None
+
+        last_coupon_id = rows[-1].coupon_id
+        for counter in (CouponCounterShard, CouponLease):
+            raw = await self.session.execute(
+                _select_usage_counters(counter)
+                .where(counter.coupon_id > after_coupon_id)
+                .where(counter.coupon_id <= last_coupon_id)
+                .order_by(*counter.__table__.primary_key),
+            )
+            rows += raw.all()
+
+        drift = [
+            CouponCountersDrift(*row)
+            for row in rows
+            if (row[1], row[2], row[3]) != (row[4], row[5], row[6])
+        ]
+        return drift, last_coupon_id
+
+    async def repair_usage_counters(self, coupon_ids: List[str]) -> int:
+        """
+        Recompute the usage counters of coupons from the usage histories.
+
+        The coupons, their counter shards and leases are locked before the
+        recount, so reservations running concurrently either are counted
+        or update the counters after the repair commits.
+
+        :param coupon_ids: ids of coupons to repair.
+
+        :return: count of repaired coupons.
+        """
+        if not coupon_ids:
+            return 0
+
+        for counter in (Coupon, CouponCounterShard, CouponLease):
+            await self.session.execute(
+                select(counter.coupon_id)
+                .where(counter.coupon_id.in_(coupon_ids))
+                .with_for_update(),
+            )
+
+        for counter in (CouponCounterShard, CouponLease):
+            await self.session.execute(
+                update(counter)
+                .where(counter.coupon_id.in_(coupon_ids))
+                .values(_expected_usage_counters(counter))
+                .execution_options(synchronize_session="fetch"),
+            )
+        raw = await self.session.execute(
+            update(Coupon)
+            .where(Coupon.coupon_id.in_(coupon_ids))
+            .values(_expected_usage_counters(Coupon))
+            .execution_options(synchronize_session="fetch"),
+        )
+        return raw.rowcount
+
+
+class _BatchAdmission:
+    """Check batched reservations against the limits of a locked coupon."""
+
+    def __init__(self, coupon: Coupon, taken: Set[str], customer_usage):
+        self.coupon = coupon
+        self.taken = taken
+        self.customer_usage = customer_usage
+        self.usage = (
+            coupon.reserved_count
+            + coupon.confirmed_count
+            + coupon.leased_usage
+        )
+        self.accumulated = coupon.accumulated_discount + coupon.leased_budget
+        self.admitted: List[UsageReservation] = []
+
+    def admit(self, reservation: UsageReservation) -> bool:
+        coupon = self.coupon
+        accumulated = self.accumulated + reservation.discount_amount
+        customer_usage = self.customer_usage[reservation.customer_key]
+        admitted = (
+            reservation.transaction_id not in self.taken
+            and (coupon.max_usage is None or self.usage < coupon.max_usage)
+            and (not coupon.budget or accumulated <= coupon.budget)
+            and (
+                not coupon.limit_per_customer
+                or customer_usage < coupon.limit_per_customer
+            )
+        )
+        if admitted:
+            self.taken.add(reservation.transaction_id)
+            self.usage += 1
+            self.accumulated = accumulated
+            self.customer_usage[reservation.customer_key] += 1
+            self.admitted.append(reservation)
+        return admitted
+
+
+def _group_by_counter(usages) -> list:
+    """
+    Sum usage histories by the counters row they are counted in.
+
+    :param usages: rows with the discount, shard and lease of each usage.
+
+    :return: list of ``((shard, lease_id), (count, discount))``.
+    """
+    groups: Dict[tuple, list] = defaultdict(lambda: [0, Decimal(0)])
+    for usage in usages:
+        group = groups[(usage.counter_shard, usage.lease_id)]
+        group[0] += 1
+        group[1] += usage.discount_amount
+    return [(key, tuple(value)) for key, value in groups.items()]
+
+
+def _check_purchase(coupon, first_purchase: bool, purchase_amount: Decimal):
+    """
+    Check the purchase against the static conditions of a coupon.
+
+    :param coupon: coupon model item or definition.
+    :param first_purchase: indicates if is first purchase.
+    :param purchase_amount: total purchase amount.
+
+    :raises FirstPurchaseException.
+    :raises MinPurchaseAmountException.
+    """
+    if coupon.first_purchase and not first_purchase:
+        raise FirstPurchaseException()
+
+    if coupon.min_purchase_amount and (
+        coupon.min_purchase_amount > purchase_amount
+    ):
+        raise MinPurchaseAmountException()
+
+
+def _select_available_counter(
+    coupon: Coupon,
+    lease_id: Optional[str],
+    customer_key: str,
+    discount_amount: Decimal,
+    usage_history_values: list,
+):
+    """
+    Select the counters row able to take a reservation.
+
+    :param coupon: coupon model item.
+    :param lease_id: quota lease the reservation is taken from.
+    :param customer_key: key of customer.
+    :param discount_amount: discount granted by the reservation.
+    :param usage_history_values: values of the reserved usage history.
+
+    :return: the model holding the counters, the usage history column
+        pointing to the counters row, if any, and the select of the usage
+        history values with the counters row.
+    """
+    coupon_guards = _reservation_guards(customer_key)
+
+    if lease_id is not None:
+        return (
+            CouponLease,
+            UsageHistory.lease_id,
+            select(
+                *usage_history_values, CouponLease.coupon_id, CouponLease.id
+            )
+            .join(Coupon, Coupon.coupon_id == CouponLease.coupon_id)
+            .where(
+                CouponLease.id == lease_id,
+                *coupon_guards,
+                *_counter_guards(CouponLease, discount_amount),
+            ),
+        )
+
+    if coupon.counter_shards:
+        first_shard = random.randrange(coupon.counter_shards)
+        return (
+            CouponCounterShard,
+            UsageHistory.counter_shard,
+            select(
+                *usage_history_values,
+                CouponCounterShard.coupon_id,
+                CouponCounterShard.shard,
+            )
+            .join(Coupon, Coupon.coupon_id == CouponCounterShard.coupon_id)
+            .where(
+                CouponCounterShard.coupon_id == coupon.coupon_id,
+                *coupon_guards,
+                *_counter_guards(CouponCounterShard, discount_amount),
+            )
+            .order_by(
+                (
+                    CouponCounterShard.shard
+                    + coupon.counter_shards
+                    - first_shard
+                )
+                % coupon.counter_shards,
+            )
+            .limit(1),
+        )
+
+    return (
+        Coupon,
+        None,
+        select(*usage_history_values, Coupon.coupon_id).where(
+            Coupon.coupon_id == coupon.coupon_id,
+            Coupon.counter_shards == 0,
+            *coupon_guards,
+            *_counter_guards(Coupon, discount_amount),
+        ),
+    )
+
+
+def _shard_usage_left(counter_shard: CouponCounterShard) -> float:
+    """
+    Usage a shard can still take, infinite if not limited.
+
+    :param counter_shard: counter shard of a coupon.
+    """
+    if counter_shard.max_usage is None:
+        return float("inf")
+    return max(
+        counter_shard.max_usage
+        - counter_shard.reserved_count
+        - counter_shard.confirmed_count,
+        0,
+    )
+
+
+def _shard_budget_left(counter_shard: CouponCounterShard):
+    """
+    Budget a shard can still grant, infinite if not limited.
+
+    :param counter_shard: counter shard of a coupon.
+    """
+    if counter_shard.budget is None:
+        return Decimal("Infinity")
+    return max(
+        counter_shard.budget - counter_shard.accumulated_discount,
+        Decimal(0),
+    )
+
+
+def _move_shard_quota(
+    donor: CouponCounterShard,
+    target: CouponCounterShard,
+    usage: int,
+    budget: Decimal,
+) -> Tuple[int, Decimal]:
+    """
+    Move up to an amount of quota left from a shard to another.
+
+    :param donor: shard giving quota.
+    :param target: shard receiving quota.
+    :param usage: usage quota to move.
+    :param budget: budget quota to move.
+
+    :return: the usage and budget quota moved.
+    """
+    usage = min(usage, _shard_usage_left(donor))
+    budget = min(budget, _shard_budget_left(donor))
+    if usage:
+        donor.max_usage -= usage
+        target.max_usage += usage
+    if budget:
+        donor.budget -= budget
+        target.budget += budget
+    return usage, budget
+
+
+def _split_evenly(total: int, parts: int) -> List[int]:
+    """
+    Split an amount in integer parts differing by one at most.
+
+    :param total: amount to split.
+    :param parts: number of parts.
+
+    :return: the parts.
+    """
+    part, remainder = divmod(total, parts)
+    return [part + 1 if index < remainder else part for index in range(parts)]
+
+
+def _increment_usage_counters(
+    counter,
+    reserved: int = 0,
+    confirmed: int = 0,
+    discount_amount: Decimal = Decimal(0),
+) -> dict:
+    """
+    Build the values that increment the usage counters of a coupon.
+
+    :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+    :param reserved: increment of the reserved usage counter.
+    :param confirmed: increment of the confirmed usage counter.
+    :param discount_amount: increment of the accumulated discount.
+
+    :return: the incremented counters by column name.
+    """
+    return {
+        "reserved_count": counter.reserved_count + reserved,
+        "confirmed_count": counter.confirmed_count + confirmed,
+        "accumulated_discount": counter.accumulated_discount + discount_amount,
+    }
+
+
+def _overlapping(valid_from: datetime, valid_until: datetime):
+    # Coupons valid at the start or at the end of the period.
+    return or_(
+        and_(
+            Coupon.valid_from <= valid_from,
+            Coupon.valid_until >= valid_from,
+        ),
+        and_(
+            Coupon.valid_from <= valid_until,
+            Coupon.valid_until >= valid_until,
+        ),
+    )
+
+
+def _select_valid_coupon(code: str, customer_key: str):
+    """
+    Build the lookup of the valid coupon of a code for a customer.
+
+    :param code: code of coupon.
+    :param customer_key: key of customer.
+
+    :return: select of the coupon and the usage by the customer.
+    """
+    return (
+        select(Coupon, _customer_usage(customer_key))
+        .where(
+            Coupon.code == code,
+            or_(
+                Coupon.customer_key.is_(None),
+                Coupon.customer_key == customer_key,
+            ),
+            *_coupon_guards(),
+        )
+        .execution_options(populate_existing=True)
+    )
+
+
+def _customer_usage(customer_key: str):
+    """
+    Build the correlated subquery counting the usage of a customer.
+
+    :param customer_key: key of customer.
+
+    :return: the usage count of the customer, labeled customer_usage.
+    """
+    return (
+        select(func.count(UsageHistory.id))
+        .where(UsageHistory.coupon_id == Coupon.coupon_id)
+        .where(UsageHistory.customer_key == customer_key)
+        .scalar_subquery()
+        .label("customer_usage")
+    )
+
+
+def _reservation_guards(customer_key: str) -> list:
+    """
+    Build the conditions a coupon must meet to accept a reservation.
+
+    :param customer_key: key of customer.
+
+    :return: the conditions on the coupon row.
+    """
+    customer_usage = (
+        select(func.count(UsageHistory.id))
+        .where(UsageHistory.coupon_id == Coupon.coupon_id)
+        .where(UsageHistory.customer_key == customer_key)
+        .scalar_subquery()
+    )
+
+    return [
+        *_coupon_guards(),
+        or_(
+            func.coalesce(Coupon.limit_per_customer, 0) == 0,
+            customer_usage < Coupon.limit_per_customer,
+        ),
+    ]
+
+
+def _coupon_guards() -> list:
+    """
+    Build the conditions a coupon must meet to accept any reservation.
+
+    :return: the conditions on the coupon row.
+    """
+    now = datetime.now(timezone.utc)
+
+    return [
+        Coupon.active.is_(True),
+        Coupon.valid_from <= now,
+        Coupon.valid_until >= now,
+    ]
+
+
+def _counter_guards(counter, discount_amount: Decimal) -> list:
+    """
+    Build the conditions the counters must meet to accept a reservation.
+
+    A zero ``budget`` means the coupon is not limited, while a zero
+    ``max_usage`` forbids any usage. Shards and leases hold quotas instead,
+    where only an empty limit means not limited. The quota leased to the
+    pods is already taken from the coupon limits.
+
+    :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+    :param discount_amount: discount granted by the reservation.
+
+    :return: the conditions on the counters row.
+    """
+    usage = counter.reserved_count + counter.confirmed_count
+    accumulated = counter.accumulated_discount + discount_amount
+    if counter is Coupon:
+        usage = usage + Coupon.leased_usage
+        accumulated = accumulated + Coupon.leased_budget
+        unlimited_budget = func.coalesce(Coupon.budget, 0) == 0
+    else:
+        unlimited_budget = counter.budget.is_(None)
+
+    return [
+        or_(counter.max_usage.is_(None), usage < counter.max_usage),
+        or_(unlimited_budget, accumulated <= counter.budget),
+    ]
+
+
+def _expected_usage_counters(counter) -> dict:
+    """
+    Build the correlated subqueries that recount the usage of a counter.
+
+    :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+
+    :return: the expected counters by column name.
+    """
+    if counter is Coupon:
+        counted = and_(
+            UsageHistory.coupon_id == Coupon.coupon_id,
+            UsageHistory.counter_shard.is_(None),
+            UsageHistory.lease_id.is_(None),
+        )
+    elif counter is CouponLease:
+        counted = UsageHistory.lease_id == CouponLease.id
+    else:
+        counted = and_(
+            UsageHistory.coupon_id == counter.coupon_id,
+            UsageHistory.counter_shard == counter.shard,
+        )
+
+    def count_by_status(status: UsageHistoryStatus):
+        return (
+            select(func.count(UsageHistory.id))
+            .where(counted)
+            .where(UsageHistory.status == status.value)
+            .scalar_subquery()
+        )
+
+    return {
+        "reserved_count": count_by_status(UsageHistoryStatus.RESERVED),
+        "confirmed_count": count_by_status(UsageHistoryStatus.CONFIRMED),
+        "accumulated_discount": (
+            select(func.coalesce(func.sum(UsageHistory.discount_amount), 0))
+            .where(counted)
+            .scalar_subquery()
+        ),
+    }
+
+
+def _select_usage_counters(counter):
+    """
+    Select the stored usage counters next to the recounted ones.
+
+    :param counter: model holding the counters, Coupon, a shard or a
+        lease.
+
+    :return: select of the counters.
+    """
+    expected = _expected_usage_counters(counter)
+    shard = literal(None, Integer)
+    lease_id = literal(None, String)
+    if counter is CouponCounterShard:
+        shard = CouponCounterShard.shard
+    elif counter is CouponLease:
+        lease_id = CouponLease.id
+
+    return select(
+        counter.coupon_id,
+        counter.reserved_count,
+        counter.confirmed_count,
+        counter.accumulated_discount,
+        expected["reserved_count"].label("expected_reserved"),
+        expected["confirmed_count"].label("expected_confirmed"),
+        expected["accumulated_discount"].label("expected_accumulated"),
+        shard.label("shard"),
+        lease_id.label("lease_id"),
+    )
@@ -0,0 +1,234 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import NamedTuple, Optional, Tuple
+
+from app.metrics import metrics
+from app.models.coupon import Coupon
+from app.repository.single_flight import SingleFlight
+from app.settings import settings
+
+# Channel of the notifications of the changed coupons.
+INVALIDATION_CHANNEL = "coupon_cache_invalidation"
+
+cache_hits = metrics.counter(
+    "coupon_cache_hits",
+    "Valid coupon lookups answered by the definition cache.",
+)
+cache_misses = metrics.counter(
+    "coupon_cache_misses",
+    "Valid coupon lookups read from the database.",
+)
+negative_cache_hits = metrics.counter(
+    "coupon_negative_cache_hits",
+    "Lookups rejected because the code was recently not found.",
+)
+
+
+class CouponDefinition(NamedTuple):
+    """Static part of a coupon, which does not change with its usage."""
+
+    coupon_id: str
+    code: str
+    customer_key: Optional[str]
+    type: str
+    value: Decimal
+    max_amount: Optional[Decimal]
+    min_purchase_amount: Optional[Decimal]
+    valid_from: datetime
+    valid_until: datetime
+    first_purchase: bool
+    description: Optional[str] = None
+    max_usage: Optional[int] = None
+    budget: Optional[Decimal] = None
+    limit_per_customer: Optional[int] = None
+    counter_shards: int = 0
+    quota_leasing: bool = False
+
+    @classmethod
+    def from_coupon(cls, coupon: Coupon) -> "CouponDefinition":
+        return cls(*(getattr(coupon, field) for field in cls._fields))
+
+
+class CouponDefinitionCache:
+    """
+    LRU cache of the definitions of the valid coupons, with a ttl.
+
+    Entries are keyed by normalized code and customer, public coupons by
+    code alone, and expire after the ttl or when the coupon stops being
+    valid, whichever comes first.
+    Changing a coupon invalidates its entries in this process, and in the
+    other processes once they are notified of the change.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.coupon_cache_max_entries,
+        ttl: float = settings.coupon_cache_ttl,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], tuple]" = (
+            OrderedDict()
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(
+        self,
+        code: str,
+        customer_key: Optional[str],
+    ) -> Optional[CouponDefinition]:
+        """
+        Get the definition of the valid coupon of a code for a customer.
+
+        :param code: code of coupon.
+        :param customer_key: key of customer.
+
+        :return: the cached definition, None if not cached or expired.
+        """
+        for key in ((code.upper(), customer_key), (code.upper(), None)):
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                continue
+
+            self._entries.move_to_end(key)
+            cache_hits.inc()
+            return entry[0]
+
+        cache_misses.inc()
+        return None
+
+    def put(
+        self,
+        definition: CouponDefinition,
+        customer_key: Optional[str],
+        generation: int,
+    ):
+        """
+        Cache the definition of a valid coupon.
+
+        :param definition: definition of coupon.
+        :param customer_key: key of the customer it was looked up for,
+            ignored for the public coupons.
+        :param generation: generation of the cache when the lookup started,
+            the definition is discarded if a coupon was invalidated since.
+        """
+        if generation != self.generation or self.max_entries <= 0:
+            return
+
+        valid_for = (
+            _as_utc(definition.valid_until) - datetime.now(timezone.utc)
+        ).total_seconds()
+        expires_at = time.monotonic() + min(self.ttl, valid_for)
+        if definition.customer_key is None:
+            customer_key = None
+        key = (definition.code.upper(), customer_key)
+        self._entries[key] = (definition, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, coupon_id: str):
+        """
+        Drop the cached definitions of a coupon.
+
+        :param coupon_id: id of coupon.
+        """
+        self.generation += 1
+        for key, (definition, _) in list(self._entries.items()):
+            if str(definition.coupon_id) == str(coupon_id):
+                del self._entries[key]
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+class CouponNegativeCache:
+    """
+    LRU cache of the codes recently not found for a customer, with a ttl.
+
+    Entries are keyed by the exact code and customer, as the lookups are.
+    Coupons created or changed by any process clear it, once notified,
+    and the ttl is kept short in case a notification is missed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.coupon_negative_cache_max_entries,
+        ttl: float = settings.coupon_negative_cache_ttl,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], float]" = (
+            OrderedDict()
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple[str, Optional[str]]) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False
+
+        negative_cache_hits.inc()
+        return True
+
+    def put(
+        self,
+        code: str,
+        customer_key: Optional[str],
+        generation: int,
+    ):
+        """
+        Cache a code not found for a customer.
+
+        :param code: code of coupon.
+        :param customer_key: key of customer.
+        :param generation: generation of the cache when the lookup started,
+            the entry is discarded if the cache was cleared since.
+        """
+        if generation != self.generation or self.max_entries <= 0:
+            return
+
+        key = (code, customer_key)
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite returns naive datetimes.
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+coupon_definition_cache = CouponDefinitionCache()
+coupon_negative_cache = CouponNegativeCache()
+coupon_definition_loads = SingleFlight("coupon_definition")
+metrics.gauge(
+    "coupon_cache_entries",
+    "Definitions held by the coupon definition cache.",
+).set_function(lambda: len(coupon_definition_cache))
+metrics.gauge(
+    "coupon_negative_cache_entries",
+    "Codes held by the negative coupon cache.",
+).set_function(lambda: len(coupon_negative_cache))
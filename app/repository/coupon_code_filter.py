@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from loguru import logger
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.metrics import metrics
+from app.models.coupon import Coupon
+from app.settings import settings
+
+BUILD_BATCH = 10000
+# Coupons committed late keep the update time of the start of their
+# transaction, so each refresh reads again this much before the newest
+# change it has seen.
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+filter_rejections = metrics.counter(
+    "coupon_code_filter_rejections",
+    "Codes rejected by the code filter without a query.",
+)
+filter_passes = metrics.counter(
+    "coupon_code_filter_passes",
+    "Codes the code filter could not rule out.",
+)
+filter_false_positives = metrics.counter(
+    "coupon_code_filter_false_positives",
+    "Codes passed by the code filter and then not found by the query, "
+    "an upper bound of its false positives.",
+)
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings.
+
+    It answers if a string may have been added, without false negatives,
+    with about the error rate of false positives up to its capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(capacity, 1)
+        self.size = math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2,
+        )
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.items = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def error_rate(self) -> float:
+        """Expected false positive rate for the items added so far."""
+        filled = 1 - math.exp(-self.hashes * self.items / self.size)
+        return filled**self.hashes
+
+    def add(self, key: str):
+        """
+        Add a string to the filter.
+
+        :param key: string to add.
+        """
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.items += 1
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return (
+            (first + index * second) % self.size
+            for index in range(self.hashes)
+        )
+
+
+class CouponCodeFilter:
+    """
+    Per process Bloom filter of the codes of the existing coupons.
+
+    It is built when started, and refreshed from the coupons changed since
+    the last refresh, so a code it rules out does not exist and can be
+    rejected without a query. Until it is built it rules nothing out.
+    Deleted coupons are never removed, they only cost false positives
+    until it is rebuilt, which happens when it outgrows its capacity.
+    """
+
+    def __init__(
+        self,
+        capacity: int = settings.coupon_code_filter_capacity,
+        error_rate: float = settings.coupon_code_filter_error_rate,
+        refresh_interval: float = settings.coupon_code_filter_refresh,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._bloom: Optional[BloomFilter] = None
+        self._watermark: Optional[datetime] = None
+        # Codes added by this process while the filter is being built.
+        self._added_while_building: Optional[List[str]] = None
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+        self._refreshing: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self._bloom.nbytes if self.ready else 0
+
+    @property
+    def estimated_error_rate(self) -> float:
+        return self._bloom.error_rate if self.ready else 0.0
+
+    def might_contain(self, code: str) -> bool:
+        """
+        Check if a code may belong to a coupon.
+
+        :param code: code of coupon.
+
+        :return: False if no coupon has the code.
+        """
+        if not self.ready:
+            return True
+        if code in self._bloom:
+            filter_passes.inc()
+            return True
+
+        filter_rejections.inc()
+        return False
+
+    def add(self, code: str):
+        """
+        Add the code of a coupon created or changed by this process.
+
+        :param code: code of coupon.
+        """
+        if self._added_while_building is not None:
+            self._added_while_building.append(code)
+        if self.ready:
+            self._bloom.add(code)
+
+    def record_not_found(self):
+        """Record a code passed by the filter which the query did not find."""
+        if self.ready:
+            filter_false_positives.inc()
+
+    async def start(self, session_factory: Callable[[], AsyncSession]):
+        """
+        Build the filter and refresh it periodically.
+
+        :param session_factory: factory of the sessions of the refreshes.
+        """
+        self._session_factory = session_factory
+        try:
+            await self.build()
+        except Exception:
+            logger.exception("Could not build the coupon code filter")
+        self._refreshing = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        """Stop refreshing the filter."""
+        if self._refreshing is None:
+            return
+
+        self._refreshing.cancel()
+        await asyncio.gather(self._refreshing, return_exceptions=True)
+        self._refreshing = None
+        self._session_factory = None
+
+    def clear(self):
+        self._bloom = None
+        self._watermark = None
+
+    async def build(self):
+        """
+        Build the filter from the codes of all the coupons.
+
+        The deleted coupons are included, as they can be reactivated, and
+        their codes only cost false positives.
+        """
+        self._added_while_building = []
+        try:
+            async with self._session_factory() as session:
+                count = await session.scalar(
+                    select(func.count()).select_from(Coupon),
+                )
+                bloom = BloomFilter(
+                    max(self.capacity, 2 * count),
+                    self.error_rate,
+                )
+                result = await session.stream(
+                    select(Coupon.code, Coupon.update_at),
+                )
+                watermark = await _add_codes(bloom, result, None)
+            for code in self._added_while_building:
+                bloom.add(code)
+        finally:
+            self._added_while_building = None
+
+        self._bloom = bloom
+        self._watermark = watermark
+        logger.info(
+            f"Coupon code filter built with {bloom.items} codes "
+            f"in {bloom.nbytes} bytes",
+        )
+
+    async def refresh(self):
+        """Add the codes of the coupons changed since the last refresh."""
+        if not self.ready:
+            await self.build()
+            return
+
+        async with self._session_factory() as session:
+            query = select(Coupon.code, Coupon.update_at)
+            if self._watermark is not None:
+                query = query.where(
+                    Coupon.update_at > self._watermark - REFRESH_OVERLAP,
+                )
+            result = await session.stream(query)
+            self._watermark = await _add_codes(
+                self._bloom,
+                result,
+                self._watermark,
+            )
+
+        if self._bloom.items > self._bloom.capacity:
+            await self.build()
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the coupon code filter")
+
+
+async def _add_codes(
+    bloom: BloomFilter,
+    result,
+    watermark: Optional[datetime],
+) -> Optional[datetime]:
+    """
+    Add the codes of a streamed result to a filter.
+
+    :param bloom: filter to add the codes to.
+    :param result: stream of codes and update times.
+    :param watermark: newest update time seen before.
+
+    :return: the newest update time seen.
+    """
+    async for rows in result.partitions(BUILD_BATCH):
+        for code, update_at in rows:
+            bloom.add(code)
+            update_at = _as_utc(update_at)
+            if watermark is None or update_at > watermark:
+                watermark = update_at
+    return watermark
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite returns naive datetimes.
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+coupon_code_filter = CouponCodeFilter()
+metrics.gauge(
+    "coupon_code_filter_bytes",
+    "Memory held by the bits of the coupon code filter.",
+).set_function(lambda: coupon_code_filter.nbytes)
+metrics.gauge(
+    "coupon_code_filter_estimated_false_positive_rate",
+    "False positive rate expected from the fill of the code filter.",
+).set_function(lambda: coupon_code_filter.estimated_error_rate)
+metrics.gauge(
+    "coupon_code_filter_false_positive_rate",
+    "Share of the codes passed by the filter that were not found.",
+).set_function(
+    lambda: filter_false_positives.value / max(filter_passes.value, 1),
+)
@@ -0,0 +1,287 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List, Optional, Set
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.coupon import Coupon, CouponLease, UsageHistory
+from app.repository.base import BaseRepository
+
+
+class CouponLeaseRepository(BaseRepository):
+    """Class for accessing CouponLease Model Table"""
+
+    def __init__(self, session: AsyncSession):
+        super().__init__(session, CouponLease)
+        self.session = session
+
+    async def acquire(
+        self,
+        coupon_id: str,
+        owner: str,
+        usage: int,
+        budget: Decimal,
+        ttl: int,
+    ) -> Optional[CouponLease]:
+        """
+        Lease a block of the usage and budget left of a coupon to an owner.
+
+        The block is added to the lease the owner already holds on the
+        coupon, if any, and taken from the coupon limits, so the leases
+        together never exceed the ``max_usage`` and ``budget`` of the
+        coupon.
+
+        :param coupon_id: id of coupon.
+        :param owner: owner of the lease.
+        :param usage: usages of the block.
+        :param budget: budget of the block.
+        :param ttl: seconds until the lease expires if not renewed.
+
+        :return: the lease of the owner, None if the coupon cannot be leased.
+        """
+        raw = await self.session.execute(
+            select(Coupon)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(of=Coupon)
+            .execution_options(populate_existing=True),
+        )
+        coupon = raw.scalar_one_or_none()
+        if coupon is None or not coupon.quota_leasing or not coupon.active:
+            return None
+
+        raw = await self.session.execute(
+            select(CouponLease)
+            .where(CouponLease.coupon_id == coupon_id)
+            .where(CouponLease.owner == owner)
+            .with_for_update()
+            .execution_options(populate_existing=True),
+        )
+        lease = raw.scalar_one_or_none()
+
+        granted_usage, granted_budget = _grant(coupon, usage, budget)
+        if 0 in (granted_usage, granted_budget):
+            # Nothing is left to lease, the current lease is only renewed.
+            if lease is None:
+                return None
+            granted_usage = granted_budget = None
+
+        if lease is None:
+            lease = CouponLease(
+                coupon_id=coupon_id,
+                owner=owner,
+                max_usage=granted_usage,
+                budget=granted_budget,
+                reserved_count=0,
+                confirmed_count=0,
+                accumulated_discount=Decimal(0),
+            )
+            self.session.add(lease)
+        else:
+            _top_up(lease, granted_usage, granted_budget)
+
+        lease.expires_at = _expires_at(ttl)
+        coupon.leased_usage += granted_usage or 0
+        coupon.leased_budget += granted_budget or 0
+        await self.session.flush()
+        return lease
+
+    async def release(self, lease_id: str, expired_only: bool = False):
+        """
+        Give the unused quota of a lease back to its coupon.
+
+        The usage counted by the lease is moved to the coupon counters and
+        its usage histories are detached from the lease before it is
+        deleted. The coupon is locked before the lease, as when leasing.
+
+        :param lease_id: id of lease.
+        :param expired_only: release the lease only if it has expired, as
+            its owner may renew it concurrently.
+
+        :return: True if released, False otherwise.
+        """
+        raw = await self.session.execute(
+            select(CouponLease.coupon_id).where(CouponLease.id == lease_id),
+        )
+        coupon_id = raw.scalar_one_or_none()
+        if coupon_id is None:
+            return False
+
+        await self.session.execute(
+            select(Coupon.coupon_id)
+            .where(Coupon.coupon_id == coupon_id)
+            .with_for_update(),
+        )
+        raw = await self.session.execute(
+            select(CouponLease)
+            .where(CouponLease.id == lease_id)
+            .with_for_update()
+            .execution_options(populate_existing=True),
+        )
+        lease = raw.scalar_one_or_none()
+        if lease is None or (
+            expired_only and _as_utc(lease.expires_at) > _now()
+        ):
+            return False
+
+        await self.session.execute(
+            update(Coupon)
+            .where(Coupon.coupon_id == coupon_id)
+            .values(
+                reserved_count=Coupon.reserved_count + lease.reserved_count,
+                confirmed_count=Coupon.confirmed_count + lease.confirmed_count,
+                accumulated_discount=Coupon.accumulated_discount
+                + lease.accumulated_discount,
+                leased_usage=Coupon.leased_usage - (lease.max_usage or 0),
+                leased_budget=Coupon.leased_budget - (lease.budget or 0),
+            )
+            .execution_options(synchronize_session=False),
+        )
+        await self.session.execute(
+            update(UsageHistory)
+            .where(UsageHistory.lease_id == lease_id)
+            .values(lease_id=None)
+            .execution_options(synchronize_session=False),
+        )
+        await self.session.execute(
+            delete(CouponLease)
+            .where(CouponLease.id == lease_id)
+            .execution_options(synchronize_session=False),
+        )
+        self.session.expunge(lease)
+        return True
+
+    async def release_all(self, coupon_id: str) -> int:
+        """
+        Release every lease of a coupon, after its limits changed.
+
+        :param coupon_id: id of coupon.
+
+        :return: number of released leases.
+        """
+        raw = await self.session.execute(
+            select(CouponLease.id).where(CouponLease.coupon_id == coupon_id),
+        )
+        released = 0
+        for lease_id in raw.scalars().all():
+            released += await self.release(lease_id)
+        return released
+
+    async def renew(
+        self,
+        owner: str,
+        ttl: int,
+        lease_ids: Set[str],
+    ) -> Set[str]:
+        """
+        Postpone the expiration of some leases of an owner.
+
+        :param owner: owner of the leases.
+        :param ttl: seconds until the leases expire if not renewed.
+        :param lease_ids: ids of the leases to renew.
+
+        :return: ids of the leases the owner still holds, renewed or not.
+        """
+        if lease_ids:
+            await self.session.execute(
+                update(CouponLease)
+                .where(CouponLease.owner == owner)
+                .where(CouponLease.id.in_(lease_ids))
+                .values(expires_at=_expires_at(ttl))
+                .execution_options(synchronize_session=False),
+            )
+        raw = await self.session.execute(
+            select(CouponLease.id).where(CouponLease.owner == owner),
+        )
+        return {str(lease_id) for lease_id in raw.scalars().all()}
+
+    async def get_owned(self, owner: str) -> List[CouponLease]:
+        """
+        Get the leases of an owner.
+
+        :param owner: owner of the leases.
+
+        :return: list of leases.
+        """
+        raw = await self.session.execute(
+            select(CouponLease)
+            .where(CouponLease.owner == owner)
+            .execution_options(populate_existing=True),
+        )
+        return raw.scalars().all()
+
+    async def get_expired_ids(self, limit: int = 100) -> List[str]:
+        """
+        Get the ids of the leases whose owner stopped renewing them.
+
+        :param limit: max number of ids.
+
+        :return: list of lease ids, the oldest expiration first.
+        """
+        raw = await self.session.execute(
+            select(CouponLease.id)
+            .where(CouponLease.expires_at < _now())
+            .order_by(CouponLease.expires_at)
+            .limit(limit),
+        )
+        return raw.scalars().all()
+
+
+def _grant(coupon: Coupon, usage: int, budget: Decimal):
+    """
+    Compute the block of usage and budget a coupon can still lease.
+
+    :param coupon: locked coupon model item.
+    :param usage: usages of the block.
+    :param budget: budget of the block.
+
+    :return: the granted usage and budget, None when not limited.
+    """
+    granted_usage = None
+    if coupon.max_usage is not None:
+        used = (
+            coupon.reserved_count
+            + coupon.confirmed_count
+            + coupon.leased_usage
+        )
+        granted_usage = max(min(usage, coupon.max_usage - used), 0)
+
+    granted_budget = None
+    if coupon.budget:
+        spent = coupon.accumulated_discount + coupon.leased_budget
+        granted_budget = max(min(budget, coupon.budget - spent), Decimal(0))
+
+    return granted_usage, granted_budget
+
+
+def _top_up(
+    lease: CouponLease,
+    granted_usage: Optional[int],
+    granted_budget: Optional[Decimal],
+):
+    """
+    Add a granted block to a lease.
+
+    :param lease: locked lease model item.
+    :param granted_usage: granted usage, None when nothing is granted.
+    :param granted_budget: granted budget, None when nothing is granted.
+    """
+    if granted_usage is not None:
+        lease.max_usage = (lease.max_usage or 0) + granted_usage
+    if granted_budget is not None:
+        lease.budget = (lease.budget or 0) + granted_budget
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(moment: datetime) -> datetime:
+    # SQLite returns naive datetimes.
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def _expires_at(ttl: int) -> datetime:
+    return _now() + timedelta(seconds=ttl)
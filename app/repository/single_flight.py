@@ -0,0 +1,89 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.metrics import metrics
+
+
+class _Flight:
+    """Load in flight, awaited by the callers of the same key."""
+
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    """
+    Share one load between the concurrent callers of the same key.
+
+    The first caller of a key runs the load in its own task, the callers
+    arriving while it is in flight wait for its result. Nothing is kept
+    once the load is done, so later callers load again.
+
+    An error of the load is raised to every waiting caller. If the caller
+    running the load is cancelled, the waiting callers are not: one of
+    them runs the load again.
+    """
+
+    def __init__(self, name: str):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.loads = metrics.counter(
+            f"{name}_loads",
+            "Loads requested, shared or not.",
+        )
+        self.coalesced = metrics.counter(
+            f"{name}_coalesced",
+            "Loads answered by a load already in flight.",
+        )
+        metrics.gauge(
+            f"{name}_coalescing_ratio",
+            "Share of the loads answered by a load already in flight.",
+        ).set_function(self.coalescing_ratio)
+
+    def __len__(self):
+        return len(self._flights)
+
+    def coalescing_ratio(self) -> float:
+        if not self.loads.value:
+            return 0
+        return self.coalesced.value / self.loads.value
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[Any]]):
+        """
+        Load a key, or wait for the load of the key in flight.
+
+        :param key: key of the load.
+        :param load: coroutine function loading the key.
+
+        :return: the result of the load.
+        """
+        self.loads.inc()
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                return await self._lead(key, load)
+
+            await flight.done.wait()
+            if flight.cancelled:
+                continue
+            self.coalesced.inc()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    async def _lead(self, key: Hashable, load: Callable[[], Awaitable[Any]]):
+        flight = self._flights[key] = _Flight()
+        try:
+            flight.result = await load()
+            return flight.result
+        except asyncio.CancelledError:
+            flight.cancelled = True
+            raise
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            del self._flights[key]
+            flight.done.set()
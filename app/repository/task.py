@@ -1,9 +1,15 @@
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
 from fastapi import Depends
+from sqlalchemy import and_, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.dependencies import get_db_session
 from app.enums import TaskStatus
-from app.models.task import Task
+from app.models.task import STRING_SIZE, Task
 from app.repository.base import BaseRepository
 
 
@@ -51,3 +57,265 @@ class TaskRepository(BaseRepository):
         )
 
         return rowcount
+
+    async def claim(
+        self,
+        owner: str,
+        stale_before: datetime,
+        max_attempts: int,
+    ) -> Optional[Task]:
+        """
+        Claim the oldest task waiting, or abandoned by its worker, to run it.
+
+        The task is locked with SKIP LOCKED, so the workers claiming at the
+        same time take different tasks instead of waiting on each other.
+        A task to retry waits until its backoff is over.
+
+        :param owner: worker claiming the task.
+        :param stale_before: heartbeat before which a task is abandoned.
+        :param max_attempts: attempts after which a task is not claimed.
+
+        :return: the task claimed, None if no task is waiting.
+        """
+        now = datetime.now(timezone.utc)
+        raw = await self.session.execute(
+            select(Task)
+            .where(
+                or_(
+                    and_(
+                        Task.status == TaskStatus.CREATED,
+                        or_(Task.run_after.is_(None), Task.run_after <= now),
+                    ),
+                    _abandoned(stale_before),
+                ),
+            )
+            .where(Task.attempts < max_attempts)
+            .order_by(Task.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .execution_options(populate_existing=True),
+        )
+        task = raw.scalar_one_or_none()
+        if task is None:
+            return None
+
+        task.status = TaskStatus.IN_PROGRESS.value
+        task.owner = owner
+        task.heartbeat_at = now
+        task.updated_at = now
+        task.attempts += 1
+        await self.session.flush()
+        return task
+
+    async def fail_abandoned(
+        self,
+        stale_before: datetime,
+        max_attempts: int,
+    ) -> int:
+        """
+        Fail the abandoned tasks which ran out of attempts.
+
+        :param stale_before: heartbeat before which a task is abandoned.
+        :param max_attempts: attempts after which a task fails.
+
+        :return: count of tasks failed.
+        """
+        raw = await self.session.execute(
+            select(Task.id, Task.parent_id)
+            .where(_abandoned(stale_before))
+            .where(Task.attempts >= max_attempts)
+            .with_for_update(skip_locked=True),
+        )
+        abandoned = raw.all()
+        if not abandoned:
+            return 0
+
+        await self.session.execute(
+            update(Task)
+            .where(Task.id.in_([task.id for task in abandoned]))
+            .values(
+                status=TaskStatus.FAILED,
+                result="Abandoned by its workers",
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False),
+        )
+        for parent_id in {task.parent_id for task in abandoned} - {None}:
+            await self._finish_parent(parent_id)
+        return len(abandoned)
+
+    async def add_shards(self, task_id: str, shards_data: List[str]):
+        """
+        Split a task in shards, claimed by the workers as tasks of their own.
+
+        The task stays in progress, without being abandoned, until the last
+        of its shards is done.
+
+        :param task_id: id of the task.
+        :param shards_data: data of each shard.
+        """
+        self.session.add_all(
+            Task(data=data, parent_id=task_id) for data in shards_data
+        )
+        await self.session.execute(
+            update(Task)
+            .where(Task.id == task_id)
+            .values(
+                shards=len(shards_data),
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False),
+        )
+        await self.session.flush()
+
+    async def heartbeat(self, task_id: str, owner: str) -> bool:
+        """
+        Renew the heartbeat of a task run by a worker.
+
+        :param task_id: id of the task.
+        :param owner: worker running the task.
+
+        :return: False if the task is no longer run by the worker.
+        """
+        raw = await self.session.execute(
+            update(Task)
+            .where(_owned(task_id, owner))
+            .values(heartbeat_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False),
+        )
+        return raw.rowcount == 1
+
+    async def retry(
+        self,
+        task_id: str,
+        owner: str,
+        error: str,
+        run_after: datetime,
+    ) -> bool:
+        """
+        Queue again a task which failed in a worker, to run after a backoff.
+
+        :param task_id: id of the task.
+        :param owner: worker running the task.
+        :param error: error of the attempt, kept as the result meanwhile.
+        :param run_after: time before which the task is not claimed.
+
+        :return: False if the task is no longer run by the worker.
+        """
+        raw = await self.session.execute(
+            update(Task)
+            .where(_owned(task_id, owner))
+            .values(
+                status=TaskStatus.CREATED,
+                owner=None,
+                heartbeat_at=None,
+                run_after=run_after,
+                result=error[:STRING_SIZE],
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False),
+        )
+        return raw.rowcount == 1
+
+    async def finish(
+        self,
+        task_id: str,
+        owner: str,
+        status: TaskStatus,
+        result: str,
+    ) -> bool:
+        """
+        Record the end of a task run by a worker.
+
+        :param task_id: id of the task.
+        :param owner: worker running the task.
+        :param status: completed or failed.
+        :param result: result of the task.
+
+        :return: False if the task is no longer run by the worker.
+        """
+        raw = await self.session.execute(
+            update(Task)
+            .where(_owned(task_id, owner))
+            .values(
+                status=status,
+                result=result[:STRING_SIZE],
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False),
+        )
+        if raw.rowcount != 1:
+            return False
+
+        parent_id = await self.session.scalar(
+            select(Task.parent_id).where(Task.id == task_id),
+        )
+        if parent_id is not None:
+            await self._finish_parent(parent_id)
+        return True
+
+    async def _finish_parent(self, parent_id: str):
+        """
+        Finish a task split in shards once all of them are done.
+
+        The parent is locked first, so the last shards finishing at the
+        same time see each other. The results of the shards, JSON objects
+        of counts, are summed up in the result of the parent.
+
+        :param parent_id: id of the task split in shards.
+        """
+        raw = await self.session.execute(
+            select(Task.status)
+            .where(Task.id == parent_id)
+            .with_for_update(),
+        )
+        if raw.scalar_one() != TaskStatus.IN_PROGRESS:
+            return
+
+        raw = await self.session.execute(
+            select(Task.status, Task.result).where(
+                Task.parent_id == parent_id,
+            ),
+        )
+        shards = raw.all()
+        done = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+        if any(shard.status not in done for shard in shards):
+            return
+
+        failed = [s for s in shards if s.status == TaskStatus.FAILED]
+        if failed:
+            status = TaskStatus.FAILED
+            result = f"{len(failed)} of {len(shards)} shards failed"
+        else:
+            status = TaskStatus.COMPLETED
+            totals = Counter()
+            for shard in shards:
+                totals.update(json.loads(shard.result))
+            result = json.dumps(dict(totals))
+        await self.session.execute(
+            update(Task)
+            .where(Task.id == parent_id)
+            .values(
+                status=status,
+                result=result[:STRING_SIZE],
+                updated_at=datetime.now(timezone.utc),
+            )
+            .execution_options(synchronize_session=False),
+        )
+
+
+def _abandoned(stale_before: datetime):
+    # A task split in shards is done by its shards.
+    return and_(
+        Task.status == TaskStatus.IN_PROGRESS,
+        Task.heartbeat_at < stale_before,
+        Task.shards.is_(None),
+    )
+
+
+def _owned(task_id: str, owner: str):
+    return and_(
+        Task.id == task_id,
+        Task.owner == owner,
+        Task.status == TaskStatus.IN_PROGRESS,
+    )
@@ -77,16 +77,21 @@ class UsageHistoryRepository(BaseRepository):
 
         return rowcount
 
-    async def delete(self, transaction_id: str):
+    async def delete(self, transaction_id: str, coupon_id: str = None):
         """
         Delete usage history model in database.
 
         :param transaction_id: transaction_id of usage history model.
+        :param coupon_id: restrict the deletion to the usage of a coupon.
         """
-        return await self.session.execute(
-            delete(self.model).where(
-                self.model.transaction_id == transaction_id
+        query_filter = self.model.transaction_id == transaction_id
+        if coupon_id is not None:
+            query_filter = and_(
+                query_filter,
+                self.model.coupon_id == coupon_id,
             )
+        return await self.session.execute(
+            delete(self.model).where(query_filter)
         )
 
     async def get_by_coupon_id(self, coupon_id: str):
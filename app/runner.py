@@ -0,0 +1,138 @@
+import asyncio
+import gc
+import importlib.util
+import os
+import socket
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+from uvicorn import Config, Server
+
+from app.services.utils.drain import drain
+from app.supervisor import STARTUP_FAILURE, supervise
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+class DrainingServer(Server):
+    """Server draining the in-flight work of the app from the exit signal."""
+
+    def handle_exit(self, sig, frame):
+        if not self.should_exit:
+            drain.start()
+            # The server waits for its connections without a limit.
+            asyncio.get_event_loop().call_later(
+                drain.timeout,
+                setattr,
+                self,
+                "force_exit",
+                True,
+            )
+        super().handle_exit(sig, frame)
+
+
+def cpu_quota(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """
+    Read the CPU quota of the container from its cgroup.
+
+    :param root: mount point of the cgroup file system.
+    :return: the quota in CPUs, None when not limited.
+    """
+    # cgroup v2: "<quota> <period>", or "max <period>" when not limited.
+    cpu_max = root / "cpu.max"
+    if cpu_max.exists():
+        quota, period = cpu_max.read_text().split()
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+
+    # cgroup v1: a quota of -1 when not limited.
+    quota_file = root / "cpu" / "cpu.cfs_quota_us"
+    period_file = root / "cpu" / "cpu.cfs_period_us"
+    if quota_file.exists() and period_file.exists():
+        quota = int(quota_file.read_text())
+        if quota <= 0:
+            return None
+        return quota / int(period_file.read_text())
+    return None
+
+
+def available_cpus(root: Path = CGROUP_ROOT) -> float:
+    """
+    Count the CPUs the process may use, the lower of quota and affinity.
+
+    :param root: mount point of the cgroup file system.
+    :return: number of CPUs.
+    """
+    cpus = len(os.sched_getaffinity(0))
+    quota = cpu_quota(root)
+    if quota is not None:
+        return min(quota, cpus)
+    return cpus
+
+
+def workers_count(configured: int, root: Path = CGROUP_ROOT) -> int:
+    """
+    Size the workers, one per whole available CPU unless configured.
+
+    A worker per fraction of a CPU would be throttled by the quota.
+
+    :param configured: workers in the settings, 0 to size them.
+    :param root: mount point of the cgroup file system.
+    :return: number of workers.
+    """
+    if configured > 0:
+        return configured
+    return max(int(available_cpus(root)), 1)
+
+
+def event_loop() -> str:
+    """:return: uvloop when installed, else the asyncio loop."""
+    if importlib.util.find_spec("uvloop") is not None:
+        return "uvloop"
+    return "asyncio"
+
+
+def http_protocol() -> str:
+    """:return: httptools when installed, else the h11 parser."""
+    if importlib.util.find_spec("httptools") is not None:
+        return "httptools"
+    return "h11"
+
+
+def serve(config: Config, workers: int) -> int:
+    """
+    Serve the application from prefork workers.
+
+    The application is loaded once, before forking, so the imported modules
+    are shared copy on write by the workers. The loaded objects are frozen
+    out of the garbage collector, which would otherwise touch and copy
+    their pages in each worker.
+
+    :param config: server configuration, with the application to load.
+    :param workers: number of worker processes.
+    :return: exit code of the server.
+    """
+    config.load()
+    if workers == 1:
+        server = DrainingServer(config)
+        server.run()
+        return 0 if server.started else STARTUP_FAILURE
+
+    sock = config.bind_socket()
+    gc.freeze()
+    code = supervise(lambda: _fork_worker(config, sock), workers)
+    sock.close()
+    return code
+
+
+def _fork_worker(config: Config, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        server = DrainingServer(config)
+        try:
+            server.run(sockets=[sock])
+        finally:
+            os._exit(0 if server.started else STARTUP_FAILURE)
+    return pid
@@ -1,12 +1,13 @@
 import json
 from datetime import datetime, timezone
 from decimal import Decimal
+from typing import List, Tuple
 
-from fastapi import BackgroundTasks
 from loguru import logger
-from sqlalchemy import and_
+from sqlalchemy import and_, func
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 from starlette.status import (
     HTTP_404_NOT_FOUND,
     HTTP_409_CONFLICT,
@@ -27,15 +28,23 @@ from app.api.helpers.exception import (
     TransactionIdException,
 )
 from app.enums import UsageHistoryStatus
-from app.models.coupon import Coupon, UsageHistory
+from app.models.coupon import Coupon
 from app.models.task import Task
-from app.repository.coupon import CouponRepository
+from app.repository.coupon import CouponRepository, CouponUsage
+from app.repository.coupon_cache import (
+    coupon_definition_cache,
+    coupon_negative_cache,
+)
+from app.repository.coupon_code_filter import coupon_code_filter
+from app.repository.coupon_lease import CouponLeaseRepository
 from app.repository.task import TaskRepository
 from app.repository.usage_history import UsageHistoryRepository
 from app.services.storage import StorageAWSService
-from app.services.usage_history import UsageHistoryService
 from app.services.utils.calculate_discount import calculate_discount
-from app.services.utils.task_manager import task_wrapper
+from app.services.utils.quota_lease import quota_lease_manager
+from app.services.utils.usage_write_coalescer import usage_write_coalescer
+
+RESERVATION_ATTEMPTS = 3
 
 
 class CouponService:
@@ -47,8 +56,8 @@ class CouponService:
     ):
         self.coupon_repository = CouponRepository(db_session)
         self.usage_history_repository = UsageHistoryRepository(db_session)
-        self.usage_history_service = UsageHistoryService(db_session)
         self.task_repository = TaskRepository(db_session)
+        self.coupon_lease_repository = CouponLeaseRepository(db_session)
         self.filter_dict = {
             "active": lambda value: Coupon.active == value,
             "valid_from": lambda value: Coupon.valid_from >= value,
@@ -88,11 +97,7 @@ class CouponService:
             )
 
         coupon = await self.coupon_repository.get_by_id(coupon_id)
-        usage_histories = await self.usage_history_repository.get_by_coupon_id(
-            str(coupon_id),
-        )
-
-        total_coupon_usage = len(usage_histories)
+        total_coupon_usage = coupon.total_usage
 
         await self.check_coupon_max_usage(
             total_coupon_usage,
@@ -109,10 +114,76 @@ class CouponService:
                 "valid_until": updated_coupon_object["valid_until"],
             }
 
-        return await self.coupon_repository.update(
+        rowcount = await self.coupon_repository.update(
             (Coupon.coupon_id == coupon_id),
-            updated_coupon_object,
+            {**updated_coupon_object, "update_at": func.now()},
         )
+        code = updated_coupon_object.get("code", coupon.code)
+        coupon_definition_cache.invalidate(coupon_id)
+        coupon_code_filter.add(code)
+        coupon_negative_cache.clear()
+        await self.coupon_repository.notify_coupon_changed(coupon_id, code)
+        if coupon.counter_shards:
+            await self.coupon_repository.split_counter_shards_quota(coupon_id)
+        if coupon.quota_leasing:
+            # The pods lease again from the new limits.
+            await self.coupon_lease_repository.release_all(coupon_id)
+
+        return rowcount
+
+    async def enable_counter_shards(self, coupon_id: str, shards: int):
+        """
+        Split the usage counters of a hot coupon across shard rows.
+
+        Reservations of a coupon with sharded counters lock one of its
+        shards instead of the coupon row, so they no longer wait for each
+        other. The sharding cannot be undone.
+
+        :param coupon_id: A id of a coupon
+        :param shards: number of counter shards.
+
+        :raises HTTPError: 404 - Coupon cannot be found
+        :raises HTTPError: 409 - Coupon counters are already sharded
+        """
+        already_sharded = await self.coupon_repository.enable_counter_shards(
+            coupon_id,
+            shards,
+        )
+        coupon_definition_cache.invalidate(coupon_id)
+        await self.coupon_repository.notify_coupon_changed(coupon_id)
+
+        if already_sharded:
+            raise HTTPError(
+                status_code=HTTP_409_CONFLICT,
+                error_message="Coupon counters are already sharded.",
+                error_code="coupon_counters_already_sharded",
+            )
+
+    async def enable_quota_leasing(self, coupon_id: str):
+        """
+        Let each pod lease blocks of the usage and budget of a hot coupon.
+
+        Reservations of a coupon with quota leasing are approved from the
+        lease of the pod, and only update the lease row instead of the
+        coupon row. The leasing cannot be undone.
+
+        :param coupon_id: A id of a coupon
+
+        :raises HTTPError: 404 - Coupon cannot be found
+        :raises HTTPError: 409 - Coupon counters are already distributed
+        """
+        already_distributed = (
+            await self.coupon_repository.enable_quota_leasing(coupon_id)
+        )
+        coupon_definition_cache.invalidate(coupon_id)
+        await self.coupon_repository.notify_coupon_changed(coupon_id)
+
+        if already_distributed:
+            raise HTTPError(
+                status_code=HTTP_409_CONFLICT,
+                error_message="Coupon counters are already sharded or leased.",
+                error_code="coupon_counters_already_distributed",
+            )
 
     async def delete_by_id(self, coupon_id: str):
         """
@@ -133,10 +204,13 @@ class CouponService:
                 error_code="error_on_delete",
             )
 
-        return await self.coupon_repository.update(
+        rowcount = await self.coupon_repository.update(
             (Coupon.coupon_id == coupon_id),
             {"active": False, "delete_at": datetime.now()},
         )
+        coupon_definition_cache.invalidate(coupon_id)
+        await self.coupon_repository.notify_coupon_changed(coupon_id)
+        return rowcount
 
     async def add_reserved(
         self,
@@ -146,6 +220,11 @@ class CouponService:
         """
         Add reserved usage to coupon model in database.
 
+        The limits of the coupon are enforced by the reservation statement
+        itself. When it refuses the reservation the coupon usage is read
+        again to raise the matching error, and the reservation is retried
+        if a concurrent release made room for it.
+
         :param code: new coupon model item.
 
         :return: new coupon model.
@@ -154,43 +233,130 @@ class CouponService:
         :raises HTTPError: 409 - conflict.
         """
         upper_code = code.upper()
-        coupon_model = await self.coupon_repository.get_valid_coupon(
-            upper_code,
+        for attempt in range(RESERVATION_ATTEMPTS):
+            (
+                coupon_model,
+                coupon_usage,
+            ) = await self.coupon_repository.get_valid_coupon(
+                upper_code,
+                coupon_reserved_input.customer_key,
+                coupon_reserved_input.first_purchase,
+                coupon_reserved_input.purchase_amount,
+            )
+
+            if attempt:
+                await self.check_reservation_refused(
+                    coupon_model,
+                    coupon_usage,
+                    coupon_reserved_input,
+                )
+
+            discount_amount = calculate_discount(
+                coupon_reserved_input.purchase_amount,
+                coupon_model.type,
+                coupon_model.value,
+                coupon_model.max_amount,
+            )
+
+            reserved = await self.reserve_usage(
+                coupon_model,
+                coupon_reserved_input,
+                discount_amount,
+            )
+            if reserved:
+                return coupon_model
+
+        if coupon_model.budget and (
+            coupon_model.counter_shards or coupon_model.quota_leasing
+        ):
+            # The discount does not fit the budget left in any shard or
+            # lease.
+            raise ExceedBudgetLimitException()
+        raise MaxUsageException()
+
+    async def reserve_usage(
+        self,
+        coupon: Coupon,
+        coupon_reserved_input: CouponReservedInputSchema,
+        discount_amount: Decimal,
+    ) -> bool:
+        """
+        Reserve a usage of the coupon, from the lease of the pod if any.
+
+        With group commit enabled the reservation is written by the next
+        flush of the usage history writes instead of the request session.
+
+        :param coupon: coupon model item.
+        :param coupon_reserved_input: reservation input.
+        :param discount_amount: discount granted by the reservation.
+
+        :return: True if reserved, False if a limit refused the reservation.
+        """
+        lease_id = None
+        if coupon.quota_leasing and quota_lease_manager.running:
+            lease_id = await quota_lease_manager.take(
+                coupon.coupon_id,
+                discount_amount,
+            )
+
+        reserve_usage = self.coupon_repository.reserve_usage
+        if usage_write_coalescer.running:
+            reserve_usage = usage_write_coalescer.reserve
+
+        reserved = await reserve_usage(
+            coupon,
+            coupon_reserved_input.transaction_id,
             coupon_reserved_input.customer_key,
-            coupon_reserved_input.first_purchase,
-            coupon_reserved_input.purchase_amount,
+            discount_amount,
+            lease_id=lease_id,
         )
+        if not reserved and lease_id is not None:
+            quota_lease_manager.give_back(
+                coupon.coupon_id,
+                lease_id,
+                discount_amount,
+            )
+        return reserved
 
-        total_coupon_usage = len(coupon_model.usage_histories)
-        add_reserve = 1
+    async def check_reservation_refused(
+        self,
+        coupon: Coupon,
+        coupon_usage: CouponUsage,
+        coupon_reserved_input: CouponReservedInputSchema,
+    ):
+        """
+        Check which limit refused a reservation of the coupon.
 
+        :param coupon: coupon model item.
+        :param coupon_usage: usage aggregates of the coupon.
+        :param coupon_reserved_input: reservation input.
+
+        :raises TransactionIdException.
+        :raises MaxUsageException.
+        :raises LimitPerCustomerException.
+        :raises ExceedBudgetLimitException.
+        """
         await self.check_if_usage_history_exist(
             coupon_reserved_input.transaction_id,
-            coupon_model.coupon_id,
+            coupon.coupon_id,
         )
 
         await self.check_coupon_max_usage(
-            total_coupon_usage + add_reserve,
-            coupon_model.max_usage,
+            coupon_usage.total_usage + 1,
+            coupon.max_usage,
         )
 
         await self.check_limit_per_customer(
-            coupon_model,
-            coupon_reserved_input.customer_key,
+            coupon,
+            coupon_usage.customer_usage,
         )
 
         await self.check_budget_limit(
-            coupon_model,
+            coupon,
+            coupon_usage.accumulated_value,
             coupon_reserved_input.purchase_amount,
         )
 
-        await self.usage_history_service.create(
-            coupon_model,
-            coupon_reserved_input,
-        )
-
-        return coupon_model
-
     async def remove_reserved(self, code: str, transaction_id: str):
         """
         Remove reserved usage to coupon model in database.
@@ -212,9 +378,21 @@ class CouponService:
         if usage_history_model.is_confirmed():
             raise CouponAlreadyConfirmed()
 
-        await self.usage_history_repository.delete(
-            transaction_id=transaction_id,
+        if usage_write_coalescer.running:
+            await usage_write_coalescer.release(
+                usage_history_model.coupon_id,
+                transaction_id,
+            )
+            return usage_history_model
+
+        # The usage is locked, so a concurrent release or confirmation of
+        # the same transaction does not change the counters twice.
+        already_confirmed = await self.coupon_repository.release_usages(
+            usage_history_model.coupon_id,
+            [transaction_id],
         )
+        if already_confirmed:
+            raise CouponAlreadyConfirmed()
 
         return usage_history_model
 
@@ -237,7 +415,21 @@ class CouponService:
             )
         )
 
-        usage_history_model.status = UsageHistoryStatus.CONFIRMED
+        if usage_history_model.is_reserved() and usage_write_coalescer.running:
+            await usage_write_coalescer.confirm(
+                usage_history_model.coupon_id,
+                transaction_id,
+            )
+        elif usage_history_model.is_reserved():
+            await self.coupon_repository.confirm_usages(
+                usage_history_model.coupon_id,
+                [transaction_id],
+            )
+            set_committed_value(
+                usage_history_model,
+                "status",
+                UsageHistoryStatus.CONFIRMED,
+            )
 
         return usage_history_model
 
@@ -301,6 +493,7 @@ class CouponService:
             )
 
         coupon_model = Coupon(**create_coupon_object.dict())
+        await self.announce_coupon_code(coupon_model.code)
         coupon = await self.coupon_repository.create(coupon_model)
 
         return await self.coupon_repository.get_by_id(coupon.coupon_id)
@@ -334,8 +527,52 @@ class CouponService:
                 error_code="duplicated_coupon",
             )
 
-        coupon_model = Coupon(**create_coupon_object.dict())
-        return coupon_model
+        # The bulk creation announces the code once for all the customers.
+        return Coupon(**create_coupon_object.dict())
+
+    async def create_coupon_models(
+        self,
+        data: CouponInputWithManyCustomers,
+        customer_keys: List[str],
+    ) -> Tuple[List[Coupon], List[str]]:
+        """
+        Create the coupon models of a batch of customers.
+
+        The duplicate check runs once for the batch, and the input is
+        validated once for all its customers.
+
+        :param data: coupon of the customers.
+        :param customer_keys: keys of customers of the batch.
+
+        :return: new coupon models, and keys of customers skipped because
+            the coupon name is taken or the key is repeated.
+        """
+        taken = await self.coupon_repository.get_duplicate_customer_keys(
+            code=data.code,
+            customer_keys=customer_keys,
+            valid_from=data.valid_from,
+            valid_until=data.valid_until,
+        )
+        values = data.get_coupon_schema(None).dict(exclude={"customer_key"})
+
+        coupons, skipped = [], []
+        for customer_key in customer_keys:
+            if customer_key in taken:
+                skipped.append(customer_key)
+                continue
+            taken.add(customer_key)
+            coupons.append(Coupon(**values, customer_key=customer_key))
+        return coupons, skipped
+
+    async def announce_coupon_code(self, code: str):
+        """
+        Make the coupons of a code findable as soon as they are created.
+
+        :param code: code of the coupons being created.
+        """
+        coupon_code_filter.add(code)
+        coupon_negative_cache.clear()
+        await self.coupon_repository.notify_coupon_changed(code=code)
 
     async def validate_coupon(
         self,
@@ -358,7 +595,7 @@ class CouponService:
 
         try:
             upper_code = code.upper()
-            coupon = await self.coupon_repository.get_valid_coupon(
+            coupon, _ = await self.coupon_repository.get_valid_coupon(
                 upper_code,
                 customer_key,
                 first_purchase,
@@ -401,6 +638,8 @@ class CouponService:
         already_active = await self.coupon_repository.activate_coupon(
             coupon_id,
         )
+        coupon_definition_cache.invalidate(coupon_id)
+        coupon_negative_cache.clear()
 
         if already_active:
             raise HTTPError(
@@ -424,6 +663,7 @@ class CouponService:
         already_deactive = await self.coupon_repository.deactivate_coupon(
             coupon_id,
         )
+        coupon_definition_cache.invalidate(coupon_id)
 
         if already_deactive:
             raise HTTPError(
@@ -515,32 +755,42 @@ class CouponService:
     async def check_limit_per_customer(
         self,
         coupon: Coupon,
-        customer_key: str,
+        customer_usage: int,
     ):
-        usages_by_customer = await self.usage_history_repository.get_all(
-            and_(
-                UsageHistory.customer_key == customer_key,
-                UsageHistory.coupon_id == coupon.coupon_id,
-            ),
-        )
-        all_usages_by_customer = await usages_by_customer.fetchall()
+        """
+        Check if the customer reached the coupon limit per customer.
+
+        :param coupon: coupon model item.
+        :param customer_usage: total usage of the coupon by the customer.
+
+        :raises LimitPerCustomerException.
+        """
         if coupon.limit_per_customer and not (
-            len(all_usages_by_customer) < coupon.limit_per_customer
+            customer_usage < coupon.limit_per_customer
         ):
             raise LimitPerCustomerException()
 
     async def check_budget_limit(
         self,
         coupon: Coupon,
+        accumulated_value: Decimal,
         purchase_amount: Decimal,
     ):
+        """
+        Check if the discount of the purchase fits the coupon budget.
+
+        :param coupon: coupon model item.
+        :param accumulated_value: discount amount already granted.
+        :param purchase_amount: total purchase value.
+
+        :raises ExceedBudgetLimitException.
+        """
         discount_amount = calculate_discount(
             purchase_amount,
             coupon.type,
             coupon.value,
             coupon.max_amount,
         )
-        accumulated_value = coupon.accumulated_value
 
         exceed_budget_limit = coupon.budget and coupon.budget < (
             accumulated_value + discount_amount
@@ -572,37 +822,32 @@ class CouponService:
         except NoResultFound:
             pass
 
-    async def create_task(
-        self,
-        form_data: CouponInputWithManyCustomers,
-        background_tasks: BackgroundTasks,
-    ):
-        from app.services.handlers import create_bulk_coupons_by_customers
+    async def create_task(self, form_data: CouponInputWithManyCustomers):
+        """
+        Enqueue the bulk creation of the coupons of many customers.
 
-        file_key = None
-        try:
-            if form_data.file_with_customer_keys:
-                file_key = StorageAWSService().upload_file_obj(
-                    form_data.file_with_customer_keys.file,
-                )
-        except Exception as e:
-            logger.exception(
-                f"Erro ao fazer upload do arquivo para storage: {e}",
-            )
+        The file of customer keys, if any, is streamed to the storage, from
+        where the worker claiming the task reads it.
 
-        data_dict = form_data.get_data_as_dict()
-        data_dict["file_key"] = file_key
+        :param form_data: coupon of the customers, with their keys or file.
 
-        task = Task(data=json.dumps(data_dict))
+        :return: the task created.
+        """
+        from app.services.handlers import upload_customer_keys_file
 
-        task_model = await self.task_repository.create(task)
-        await create_bulk_coupons_by_customers(form_data, self.db_session)
+        data_dict = form_data.get_data_as_dict()
+        data_dict["file_key"] = None
+        if form_data.file_with_customer_keys:
+            upload = StorageAWSService().create_upload()
+            await upload_customer_keys_file(
+                form_data.file_with_customer_keys,
+                upload,
+            )
+            data_dict["file_key"] = upload.key
 
-        # background_tasks.add_task(
-        #     task_wrapper,
-        #     create_bulk_coupons_by_customers,
-        #     task_model.id,
-        #     form_data,
-        #     self.db_session,
-        # )
+        task_model = await self.task_repository.create(
+            Task(data=json.dumps(data_dict)),
+        )
+        # The workers claim the task once committed.
+        await self.db_session.commit()
         return task_model
@@ -1,57 +1,279 @@
+import codecs
 import csv
-from io import StringIO
+import json
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+)
 
+from fastapi import UploadFile
 from loguru import logger
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, text
 
+from app.api.coupon.v1.schema import CouponInputWithManyCustomers
+from app.models.task import Task
+from app.repository.coupon import CouponRepository
+from app.repository.task import TaskRepository
 from app.services.coupon import CouponService
-import shutil
-from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Callable
-
-from fastapi import UploadFile
+from app.services.storage import StorageAWSService, StorageUpload
+from app.services.utils.task_manager import load_task_data
+from app.settings import settings
 
 COMMIT_NUMBER = 1000
+# Bytes read from an upload at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Customer keys of a bulk creation, copied in the transaction that merges
+# them into the coupons.
+coupon_staging = Table(
+    "coupon_staging",
+    MetaData(),
+    Column("ordinal", BigInteger, nullable=False),
+    Column("customer_key", String(200), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+
+class BulkCreation(NamedTuple):
+    """Outcome of a bulk creation of coupons."""
+
+    created: int
+    skipped: List[str]
+
+
+async def create_coupons(
+    db_session,
+    data,
+    customer_keys: AsyncIterable[str],
+) -> BulkCreation:
+    """
+    Create the coupons of customers, with a COPY on PostgreSQL.
 
+    :param db_session: session of the creation.
+    :param data: coupon of the customers.
+    :param customer_keys: keys of customers, blank ones are ignored.
 
-async def create_coupon_by_schema(schema, db_session):
+    :return: count of coupons created, and keys of customers skipped.
+    """
+    connection = await db_session.connection()
+    if connection.dialect.name == "postgresql":
+        return await copy_coupons(db_session, data, customer_keys)
+    return await create_coupons_by_batch(db_session, data, customer_keys)
+
+
+async def create_coupons_by_batch(
+    db_session,
+    data,
+    customer_keys: AsyncIterable[str],
+) -> BulkCreation:
+    """
+    Create the coupons of customers, a batch of them at a time.
+
+    :param db_session: session of the creation.
+    :param data: coupon of the customers.
+    :param customer_keys: keys of customers, blank ones are ignored.
+
+    :return: count of coupons created, and keys of customers skipped.
+    """
     coupon_service = CouponService(db_session)
-    try:
-        logger.info(f"oiii2")
-        return await coupon_service.create_coupon_model(schema)
-    except Exception as e:
-        logger.exception(
-            f"An error occurred when trying to create the coupon with "
-            f"the customer_key: {schema.customer_key}. Exception: {e}",
+    created, skipped = 0, []
+    async for batch in _batches(customer_keys, COMMIT_NUMBER):
+        coupons, batch_skipped = await coupon_service.create_coupon_models(
+            data,
+            batch,
         )
+        if batch_skipped:
+            logger.info(
+                f"Cupom {data.code} já existe para os clientes "
+                f"{batch_skipped}",
+            )
+        if coupons:
+            await commit_coupons(db_session, coupons)
+        created += len(coupons)
+        skipped.extend(batch_skipped)
+    return BulkCreation(created, skipped)
 
 
-async def create_coupons_from_file(db_session, tmp_path, data):
-    with open(tmp_path, "rU") as file:
-        csv_reader = csv.reader(file)
-        logger.info(f"oiii22 {csv_reader}")
+async def copy_coupons(
+    db_session,
+    data,
+    customer_keys: AsyncIterable[str],
+) -> BulkCreation:
+    """
+    Create the coupons of customers with a COPY and a single merge.
 
-        # coupons = []
-        for row in csv_reader:
-            logger.info(f"oiii {row}")
-            customer_key = row[0]
-            coupon = await create_coupon_by_schema(
-                data.get_coupon_schema(customer_key),
-                db_session,
-            )
-            logger.info("CHEGOU AQUI")
-            db_session.add(coupon)
-            logger.info("TÁ QUASE")
-            await db_session.commit()
-            logger.info("TAMBÉM CHEGOU AQUI")
-            # if coupon:
-            #     coupons.append(coupon)
-            # if index % COMMIT_NUMBER == 0:
-            #     logger.debug(f"Commit: {index}")
-            #     await commit_coupons(db_session, coupons)
-            #     coupons = []
-        # if coupons:
-        #     await commit_coupons(db_session, coupons)
+    The keys are copied in the binary format into a temporary staging
+    table, then inserted as coupons by one INSERT ... SELECT skipping the
+    keys repeated in the staging table or whose coupon name is taken, with
+    the rules of ``check_duplicate_coupon_name``. Only on PostgreSQL.
+
+    :param db_session: session of the creation, committed once.
+    :param data: coupon of the customers.
+    :param customer_keys: keys of customers, blank ones are ignored.
+
+    :return: count of coupons created, and keys of customers skipped.
+    """
+    connection = await db_session.connection()
+    await connection.run_sync(coupon_staging.create)
+    raw_connection = await connection.get_raw_connection()
+    # The statement above began the transaction of the driver connection.
+    copied = await raw_connection.driver_connection.copy_records_to_table(
+        coupon_staging.name,
+        records=_staged_records(customer_keys),
+        columns=[column.name for column in coupon_staging.columns],
+    )
+    await db_session.execute(text(f"ANALYZE {coupon_staging.name}"))
+
+    values = data.get_coupon_schema(None).dict(exclude={"customer_key"})
+    skipped = await CouponRepository(db_session).insert_staged_coupons(
+        coupon_staging,
+        values,
+    )
+    await db_session.commit()
+
+    staged = int(copied.split()[-1])
+    return BulkCreation(staged - len(skipped), skipped)
+
+
+async def _staged_records(
+    customer_keys: AsyncIterable[str],
+) -> AsyncIterator[tuple]:
+    ordinal = 0
+    async for customer_key in _clean(customer_keys):
+        yield ordinal, customer_key
+        ordinal += 1
+
+
+async def _clean(customer_keys: AsyncIterable[str]) -> AsyncIterator[str]:
+    async for customer_key in customer_keys:
+        customer_key = customer_key.strip()
+        if customer_key:
+            yield customer_key
+
+
+async def _batches(
+    customer_keys: AsyncIterable[str],
+    size: int,
+) -> AsyncIterator[List[str]]:
+    batch = []
+    async for customer_key in _clean(customer_keys):
+        batch.append(customer_key)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _iterate(customer_keys: Iterable[str]) -> AsyncIterator[str]:
+    for customer_key in customer_keys:
+        yield customer_key
+
+
+async def read_chunks(upload_file: UploadFile) -> AsyncIterator[bytes]:
+    """
+    Read an uploaded file a chunk at a time, off the event loop once the
+    upload is spooled to disk.
+
+    :param upload_file: file uploaded.
+    """
+    while True:
+        chunk = await upload_file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def upload_customer_keys_file(
+    upload_file: UploadFile,
+    upload: StorageUpload,
+):
+    """
+    Stream an uploaded file of customer keys to a storage upload.
+
+    :param upload_file: file uploaded.
+    :param upload: upload of the file to the storage, aborted on failure.
+    """
+    try:
+        async for chunk in read_chunks(upload_file):
+            await upload.write(chunk)
+        await upload.complete()
+    except Exception:
+        await upload.abort()
+        raise
+    finally:
+        await upload_file.close()
+
+
+async def parse_customer_keys(
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[str]:
+    """
+    Parse the customer keys of the first column of a CSV file as its
+    chunks come, a key per line.
+
+    :param chunks: chunks of the file, in UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    rest = ""
+    async for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).splitlines(keepends=True)
+        # The last line goes on in the next chunk, unless it ended.
+        rest = lines.pop() if lines and lines[-1][-1] not in "\r\n" else ""
+        for row in csv.reader(lines):
+            if row:
+                yield row[0]
+
+    rest += decoder.decode(b"", final=True)
+    for row in csv.reader(rest.splitlines()):
+        if row:
+            yield row[0]
+
+
+async def shard_chunks(
+    chunks: AsyncIterable[bytes],
+    start: int,
+    end: int,
+) -> AsyncIterator[bytes]:
+    """
+    Cut the lines starting in a byte range out of the chunks of a file.
+
+    A line belongs to the shard where it starts: the line going on at the
+    start of the range is left out, and the one going on at its end is
+    completed.
+
+    :param chunks: chunks of the file from the byte before the start of
+        the range, or from the first byte.
+    :param start: offset of the first byte of the range.
+    :param end: offset of the byte after the range.
+    """
+    position = max(start - 1, 0)
+    begin = 0 if start == 0 else None
+    async for chunk in chunks:
+        if begin is None:
+            begin = _line_start(chunk, position, start)
+        finish = _line_start(chunk, position, end)
+        if begin is not None:
+            stop = None if finish is None else finish - position
+            piece = chunk[max(begin - position, 0):stop]
+            if piece:
+                yield piece
+        if finish is not None:
+            return
+        position += len(chunk)
+
+
+def _line_start(chunk: bytes, position: int, offset: int) -> Optional[int]:
+    # Offset of the first line starting from an offset, when in the chunk.
+    newline = chunk.find(b"\n", max(offset - 1 - position, 0))
+    if newline == -1:
+        return None
+    return position + newline + 1
 
 
 async def commit_coupons(db_session, coupons):
@@ -59,44 +281,100 @@ async def commit_coupons(db_session, coupons):
     await db_session.commit()
 
 
-def save_upload_file_tmp(upload_file: UploadFile) -> Path:
+async def create_bulk_coupons_by_customers(
+    data,
+    db_session,
+    chunks: Optional[AsyncIterable[bytes]] = None,
+) -> BulkCreation:
+    """
+    Create the coupons of the customers of a file or of a list.
+
+    :param data: coupon of the customers, with their keys.
+    :param db_session: session of the creation.
+    :param chunks: chunks of the file of customer keys, parsed as they
+        come, instead of the keys of the data.
+
+    :return: count of coupons created, and keys of customers skipped.
+    """
+    # Notified with the first commit of the coupons.
+    await CouponService(db_session).announce_coupon_code(data.code)
+    if chunks is None:
+        customer_keys = _iterate(data.customer_keys or [])
+    else:
+        customer_keys = parse_customer_keys(chunks)
+    return await create_coupons(db_session, data, customer_keys)
+
+
+async def run_bulk_task(task: Task, db_session) -> Optional[str]:
+    """
+    Create the coupons of a bulk creation task, or of a shard of it.
+
+    A file larger than a shard is split in shards of byte ranges, tasks of
+    their own claimed by any worker, and the task is done with them.
+
+    :param task: task of the creation.
+    :param db_session: session of the creation.
+
+    :return: counts of coupons created and of customers skipped, in JSON,
+        None when the task was split in shards.
+    """
+    task_data = load_task_data(task)
+    data = CouponInputWithManyCustomers(**task_data)
+    file_key = task_data.get("file_key")
+    if not file_key:
+        result = await create_bulk_coupons_by_customers(data, db_session)
+        return _task_result(result)
+
+    is_shard = "start" in task_data
+    if not is_shard and await _split(task.id, task_data, db_session):
+        return None
+
+    start, end = task_data.get("start", 0), task_data.get("end")
+    logger.info(
+        f"Inicio de processamento do arquivo {file_key} "
+        f"com código {data.code}, bytes {start} a {end}"
+    )
+    storage = StorageAWSService()
+    chunks = storage.download_chunks(file_key, CHUNK_SIZE, max(start - 1, 0))
+    lines = chunks if end is None else shard_chunks(chunks, start, end)
     try:
-        suffix = Path(upload_file.filename).suffix
-        with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            shutil.copyfileobj(upload_file.file, tmp)
-            tmp_path = Path(tmp.name)
+        result = await create_bulk_coupons_by_customers(
+            data,
+            db_session,
+            lines,
+        )
     finally:
-        upload_file.file.close()
-    return tmp_path
+        await lines.aclose()
+        await chunks.aclose()
 
+    logger.info(
+        f"Fim de processamento do arquivo {file_key} "
+        f"com código {data.code}: {result.created} criados, "
+        f"{len(result.skipped)} ignorados"
+    )
+    return _task_result(result)
 
-async def create_bulk_coupons_by_customers(data, db_session):
-    if data.file_with_customer_keys:
-        logger.info(
-            f"Inicio de processamento do arquivo "
-            f"{data.file_with_customer_keys.filename} "
-            f"com código {data.code}"
-        )
 
-        tmp_path = save_upload_file_tmp(data.file_with_customer_keys)
-        try:
-            await create_coupons_from_file(db_session, tmp_path, data)
-        finally:
-            tmp_path.unlink()
+async def _split(task_id: str, task_data: dict, db_session) -> bool:
+    size = await StorageAWSService().file_size(task_data["file_key"])
+    if size <= settings.task_shard_size:
+        return False
 
-        logger.info(
-            f"Fim de processamento do arquivo "
-            f"{data.file_with_customer_keys.filename} "
-            f"com código {data.code}"
-        )
-    elif data.customer_keys:
-        coupons = []
-        for customer_key in data.customer_keys:
-            coupon = await create_coupon_by_schema(
-                data.get_coupon_schema(customer_key),
-                db_session,
-            )
-            if coupon:
-                coupons.append(coupon)
-        if coupons:
-            await commit_coupons(db_session, coupons)
+    offsets = list(range(0, size, settings.task_shard_size)) + [size]
+    await TaskRepository(db_session).add_shards(
+        task_id,
+        [
+            json.dumps(dict(task_data, start=start, end=end))
+            for start, end in zip(offsets, offsets[1:])
+        ],
+    )
+    await db_session.commit()
+    logger.info(f"Tarefa {task_id} dividida em {len(offsets) - 1} partes")
+    return True
+
+
+def _task_result(result: BulkCreation) -> str:
+    # The result column is short, the skipped keys are only counted.
+    return json.dumps(
+        {"created": result.created, "skipped": len(result.skipped)},
+    )
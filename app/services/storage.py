@@ -1,19 +1,121 @@
+import asyncio
 import uuid
 from abc import ABC, abstractmethod
-
-import boto3
+from typing import AsyncIterator
 
 from app.settings import settings
 
+# Size of the parts of the multipart uploads, at least 5 MiB for S3.
+PART_SIZE = 8 * 1024 * 1024
+
 
 class StorageServiceAbstract(ABC):
     @abstractmethod
     def upload_file_obj(self, file_name):
         pass
 
+    @abstractmethod
+    def create_upload(self):
+        pass
+
+    @abstractmethod
+    def download_chunks(self, file_key, chunk_size, start):
+        pass
+
+    @abstractmethod
+    def file_size(self, file_key):
+        pass
+
+
+class StorageUpload:
+    """
+    Upload of a file to the bucket, written a chunk at a time.
+
+    The chunks are buffered up to a part, which is uploaded off the event
+    loop. A file smaller than a part is uploaded at once when completed.
+    """
+
+    def __init__(self, s3_client, key: str):
+        self.key = key
+        self.completed = False
+        self._s3_client = s3_client
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    async def write(self, chunk: bytes):
+        """
+        Add a chunk to the file, uploading the parts filled.
+
+        :param chunk: next bytes of the file.
+        """
+        self._buffer += chunk
+        if len(self._buffer) >= PART_SIZE:
+            await self._upload_part()
+
+    async def complete(self):
+        """Upload the rest of the file, and make it available."""
+        if self._upload_id is None:
+            await asyncio.to_thread(
+                self._s3_client.put_object,
+                Body=bytes(self._buffer),
+                Bucket=settings.aws_s3_bucket,
+                Key=self.key,
+            )
+        else:
+            if self._buffer:
+                await self._upload_part()
+            await asyncio.to_thread(
+                self._s3_client.complete_multipart_upload,
+                Bucket=settings.aws_s3_bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buffer = bytearray()
+        self.completed = True
+
+    async def abort(self):
+        """Discard the parts uploaded."""
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            await asyncio.to_thread(
+                self._s3_client.abort_multipart_upload,
+                Bucket=settings.aws_s3_bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+            )
+            self._upload_id = None
+
+    async def _upload_part(self):
+        if self._upload_id is None:
+            response = await asyncio.to_thread(
+                self._s3_client.create_multipart_upload,
+                Bucket=settings.aws_s3_bucket,
+                Key=self.key,
+            )
+            self._upload_id = response["UploadId"]
+
+        part_number = len(self._parts) + 1
+        body, self._buffer = bytes(self._buffer), bytearray()
+        response = await asyncio.to_thread(
+            self._s3_client.upload_part,
+            Body=body,
+            Bucket=settings.aws_s3_bucket,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self._upload_id,
+        )
+        self._parts.append(
+            {"ETag": response["ETag"], "PartNumber": part_number},
+        )
+
 
 class StorageAWSService(StorageServiceAbstract):
     def __init__(self):
+        # boto3 takes a long time to import and is seldom used.
+        import boto3
+
         self.s3_client = boto3.Session(
             aws_access_key_id=settings.aws_access_key_id,
             aws_secret_access_key=settings.aws_secret_access_key,
@@ -32,3 +134,53 @@ class StorageAWSService(StorageServiceAbstract):
         )
 
         return file_key
+
+    def create_upload(self) -> StorageUpload:
+        """
+        Start the upload of a file written in chunks.
+
+        :return: the upload, under a new file key.
+        """
+        return StorageUpload(self.s3_client, str(uuid.uuid4()))
+
+    async def download_chunks(
+        self,
+        file_key: str,
+        chunk_size: int,
+        start: int = 0,
+    ) -> AsyncIterator[bytes]:
+        """
+        Download a file a chunk at a time, off the event loop.
+
+        :param file_key: key of the file.
+        :param chunk_size: bytes of each chunk.
+        :param start: offset of the first byte downloaded.
+        """
+        options = {"Range": f"bytes={start}-"} if start else {}
+        response = await asyncio.to_thread(
+            self.s3_client.get_object,
+            Bucket=settings.aws_s3_bucket,
+            Key=file_key,
+            **options,
+        )
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            body.close()
+
+    async def file_size(self, file_key: str) -> int:
+        """
+        :param file_key: key of the file.
+        :return: size of the file in bytes.
+        """
+        response = await asyncio.to_thread(
+            self.s3_client.head_object,
+            Bucket=settings.aws_s3_bucket,
+            Key=file_key,
+        )
+        return response["ContentLength"]
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.coupon.v1.schema import CouponReservedInputSchema
 from app.models.coupon import Coupon, UsageHistory
+from app.repository.coupon import CouponRepository
 from app.repository.usage_history import UsageHistoryRepository
 from app.services.utils.calculate_discount import calculate_discount
 
@@ -15,6 +16,7 @@ class UsageHistoryService:
         db_session: AsyncSession,
     ):
         self.usage_history_repository = UsageHistoryRepository(db_session)
+        self.coupon_repository = CouponRepository(db_session)
 
     async def create(
         self, coupon: Coupon, coupon_reserved_input: CouponReservedInputSchema
@@ -43,5 +45,10 @@ class UsageHistoryService:
         usage_history_model = await self.usage_history_repository.create(
             usage_history
         )
+        await self.coupon_repository.update_usage_counters(
+            coupon.coupon_id,
+            reserved=1,
+            discount_amount=discount_amount,
+        )
 
         return usage_history_model
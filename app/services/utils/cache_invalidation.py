@@ -0,0 +1,132 @@
+import asyncio
+import json
+from typing import Optional
+
+import asyncpg
+from loguru import logger
+
+from app.metrics import metrics
+from app.repository.coupon_cache import (
+    INVALIDATION_CHANNEL,
+    coupon_definition_cache,
+    coupon_negative_cache,
+)
+from app.repository.coupon_code_filter import coupon_code_filter
+from app.settings import settings
+
+invalidation_messages = metrics.counter(
+    "cache_invalidation_messages",
+    "Coupon change notifications received.",
+)
+invalidation_flushes = metrics.counter(
+    "cache_invalidation_flushes",
+    "Full flushes of the coupon caches after (re)connecting.",
+)
+
+
+class CacheInvalidationListener:
+    """
+    Dedicated LISTEN connection evicting the coupons changed by any process.
+
+    Every change of a coupon is notified on commit, and each process drops
+    its cached state of the coupon when notified. Notifications sent while
+    the connection is down are lost, so the caches are flushed whenever it
+    is (re)established. The connection is pinged to detect it is down.
+    """
+
+    def __init__(
+        self,
+        dsn: str = str(settings.db_url_alembic),
+        ping_interval: float = settings.cache_invalidation_ping_interval,
+    ):
+        self.dsn = dsn
+        self.ping_interval = ping_interval
+        self._listening: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._listening is not None
+
+    def start(self):
+        """Start listening to the coupon changes."""
+        self._listening = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """Stop listening and close the connection."""
+        if not self.running:
+            return
+
+        self._listening.cancel()
+        await asyncio.gather(self._listening, return_exceptions=True)
+        self._listening = None
+
+    async def _listen(self):
+        while True:
+            connection = await self._connect()
+            try:
+                await self._hold(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the connection listening to coupons")
+            finally:
+                connection.terminate()
+
+    async def _connect(self) -> asyncpg.Connection:
+        while True:
+            try:
+                return await asyncpg.connect(
+                    self.dsn,
+                    timeout=self.ping_interval,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Could not connect to listen to coupons")
+                await asyncio.sleep(self.ping_interval)
+
+    async def _hold(self, connection: asyncpg.Connection):
+        await connection.add_listener(
+            INVALIDATION_CHANNEL,
+            self._on_notification,
+        )
+        flush()
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            # A half-open connection would hang the ping without a timeout.
+            await connection.fetchval("SELECT 1", timeout=self.ping_interval)
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            logger.error(f"Invalid coupon change notification: {payload}")
+            return
+
+        evict(change.get("coupon_id"), change.get("code"))
+
+
+def evict(coupon_id: Optional[str], code: Optional[str]):
+    """
+    Drop the cached state of a changed coupon.
+
+    :param coupon_id: id of the changed coupon.
+    :param code: code the coupon now has, if it can now be found.
+    """
+    invalidation_messages.inc()
+    if coupon_id is not None:
+        coupon_definition_cache.invalidate(coupon_id)
+    if code is not None:
+        coupon_code_filter.add(code)
+        coupon_negative_cache.clear()
+
+
+def flush():
+    """Drop every cached coupon, as some changes may have been missed."""
+    # The code filter catches up with the missed codes on its refresh.
+    invalidation_flushes.inc()
+    coupon_definition_cache.clear()
+    coupon_negative_cache.clear()
+
+
+cache_invalidation_listener = CacheInvalidationListener()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Optional, Set
+
+from loguru import logger
+
+from app.metrics import metrics
+from app.settings import settings
+
+drain_duration = metrics.gauge(
+    "drain_duration_seconds",
+    "Time taken by the drain of this process on shutdown.",
+)
+drain_abandoned = metrics.counter(
+    "drain_abandoned",
+    "Requests and tasks cancelled at the drain deadline.",
+)
+
+
+class Drain:
+    """
+    Drain of the in-flight work of the process on shutdown.
+
+    Requests and background tasks are tracked while they run. Once the
+    drain starts, new requests are refused and the tracked ones are waited
+    for until the deadline, then cancelled, so their transactions are
+    rolled back before the pools are disposed.
+    """
+
+    def __init__(self, timeout: float = settings.drain_timeout):
+        self.timeout = timeout
+        self.draining = False
+        self.abandoned = 0
+        self._started_at: Optional[float] = None
+        self._tasks: Set[asyncio.Task] = set()
+        metrics.gauge(
+            "drain_in_flight",
+            "Requests and tasks the drain waits for.",
+        ).set_function(lambda: len(self._tasks))
+
+    @property
+    def deadline(self) -> Optional[float]:
+        if self._started_at is None:
+            return None
+        return self._started_at + self.timeout
+
+    def track(self, task: asyncio.Task):
+        """
+        Have the drain wait for a task.
+
+        :param task: running request or background task.
+        """
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        """Refuse new work, the deadline runs from the first call."""
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        self.draining = True
+
+    async def wait(self) -> bool:
+        """
+        Wait for the tracked tasks until the deadline, then cancel them.
+
+        :return: True if every task finished in time.
+        """
+        self.start()
+        tasks = self._tasks - {asyncio.current_task()}
+        remaining = max(self.deadline - time.monotonic(), 0)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=remaining)
+        else:
+            pending = set()
+
+        if pending:
+            logger.warning(
+                f"Cancelling {len(pending)} tasks at the drain deadline",
+            )
+            drain_abandoned.inc(len(pending))
+            self.abandoned += len(pending)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return not pending
+
+    def finish(self):
+        """
+        Record the duration of the drain, once the pools are disposed.
+
+        The process exits right after, before its metrics can be scraped:
+        the duration is logged too, as structured fields.
+        """
+        if self._started_at is None:
+            return
+        duration = time.monotonic() - self._started_at
+        drain_duration.set(duration)
+        logger.bind(
+            drain_duration_seconds=round(duration, 3),
+            drain_abandoned=self.abandoned,
+        ).info(
+            f"Drain finished in {duration:.3f}s, "
+            f"{self.abandoned} tasks cancelled at the deadline",
+        )
+
+    def reset(self):
+        """Accept work again, for a process serving after a drain."""
+        self.draining = False
+        self.abandoned = 0
+        self._started_at = None
+
+
+drain = Drain()
@@ -0,0 +1,337 @@
+import asyncio
+import math
+import os
+import socket
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Optional, Set
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.coupon import CouponLease
+from app.repository.coupon_lease import CouponLeaseRepository
+from app.settings import settings
+
+
+class QuotaLease:
+    """Usage and budget left in a lease, as seen by its owner."""
+
+    def __init__(self, lease: CouponLease):
+        self.lease_id = str(lease.id)
+        self.max_usage = lease.max_usage
+        self.budget = lease.budget
+        self.usage_left = None
+        if lease.max_usage is not None:
+            self.usage_left = (
+                lease.max_usage - lease.reserved_count - lease.confirmed_count
+            )
+        self.budget_left = None
+        if lease.budget is not None:
+            self.budget_left = lease.budget - lease.accumulated_discount
+
+    def extend(self, lease: CouponLease):
+        """
+        Add the quota granted to the lease since it was read.
+
+        The usage taken in memory is kept, as the reservations may not be
+        committed to the lease row yet.
+
+        :param lease: lease model item, read after the refill.
+        """
+        if self.usage_left is not None:
+            self.usage_left += lease.max_usage - self.max_usage
+        if self.budget_left is not None:
+            self.budget_left += lease.budget - self.budget
+        self.max_usage = lease.max_usage
+        self.budget = lease.budget
+
+    def fits(self, discount_amount: Decimal) -> bool:
+        return (self.usage_left is None or self.usage_left > 0) and (
+            self.budget_left is None or discount_amount <= self.budget_left
+        )
+
+    def take(self, discount_amount: Decimal):
+        if self.usage_left is not None:
+            self.usage_left -= 1
+        if self.budget_left is not None:
+            self.budget_left -= discount_amount
+
+    def give_back(self, discount_amount: Decimal):
+        if self.usage_left is not None:
+            self.usage_left += 1
+        if self.budget_left is not None:
+            self.budget_left += discount_amount
+
+    def is_low(self, usage: int, budget: Decimal, ratio: float) -> bool:
+        return (
+            self.usage_left is not None
+            and self.usage_left <= math.ceil(usage * ratio)
+        ) or (
+            self.budget_left is not None
+            and self.budget_left <= budget * Decimal(str(ratio))
+        )
+
+
+class QuotaLeaseManager:
+    """
+    Hold the quota leases of this pod.
+
+    Reservations are approved from the leases in memory, and the leases
+    are refilled in background when they run low. The usage history and
+    the lease row are still written by the reservation, whose statement
+    checks the lease row, so a stale lease in memory can only refuse a
+    reservation, never oversubscribe the coupon.
+
+    A coupon with nothing left to lease is not leased again for the
+    exhausted retry interval (seconds), or until this pod gives quota back,
+    so its reservations do not queue on the coupon row.
+
+    Every third of the ttl the leases of the pod used since the previous
+    renewal are renewed, the idle ones are given back so other pods can
+    lease their quota, and the expired leases of stopped pods are given
+    back to their coupons.
+    """
+
+    def __init__(
+        self,
+        usage: int = settings.quota_lease_usage,
+        budget: Decimal = settings.quota_lease_budget,
+        ttl: int = settings.quota_lease_ttl,
+        refill_ratio: float = settings.quota_lease_refill_ratio,
+        exhausted_retry: float = settings.quota_lease_exhausted_retry,
+    ):
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.usage = usage
+        self.budget = budget
+        self.ttl = ttl
+        self.refill_ratio = refill_ratio
+        self.exhausted_retry = exhausted_retry
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+        self._leases: Dict[str, QuotaLease] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refilling: Set[str] = set()
+        self._used: Set[str] = set()
+        self._exhausted: Dict[str, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._maintenance: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._session_factory is not None
+
+    def start(self, session_factory: Callable[[], AsyncSession]):
+        """
+        Start holding leases and the maintenance of the leases.
+
+        :param session_factory: factory of the sessions of the leases,
+            independent of the sessions of the requests.
+        """
+        self._session_factory = session_factory
+        self._maintenance = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        """Stop the maintenance and give the leases of this pod back."""
+        if not self.running:
+            return
+
+        # Pending refills are short and let finish, so their sessions are
+        # not interrupted in the middle of a statement.
+        self._maintenance.cancel()
+        await asyncio.gather(
+            self._maintenance,
+            *self._tasks,
+            return_exceptions=True,
+        )
+
+        async with self._session_factory() as session:
+            repository = CouponLeaseRepository(session)
+            for lease in await repository.get_owned(self.owner):
+                await repository.release(lease.id)
+            await session.commit()
+
+        self._session_factory = None
+        self._leases.clear()
+
+    async def take(
+        self,
+        coupon_id: str,
+        discount_amount: Decimal,
+    ) -> Optional[str]:
+        """
+        Take a usage and its discount from the lease of a coupon.
+
+        A lease is acquired first if this pod has none or the lease cannot
+        take the discount, unless the coupon recently had nothing left to
+        lease.
+
+        :param coupon_id: id of coupon.
+        :param discount_amount: discount granted by the reservation.
+
+        :return: id of the lease, None if the coupon has no quota left to
+            lease.
+        """
+        lease = self._leases.get(coupon_id)
+        if lease is None or not lease.fits(discount_amount):
+            if self._is_exhausted(coupon_id):
+                return None
+            lease = await self._acquire(coupon_id, discount_amount)
+            if lease is None or not lease.fits(discount_amount):
+                return None
+
+        lease.take(discount_amount)
+        self._used.add(lease.lease_id)
+        if lease.is_low(self.usage, self.budget, self.refill_ratio):
+            self._refill(coupon_id)
+        return lease.lease_id
+
+    def give_back(
+        self,
+        coupon_id: str,
+        lease_id: str,
+        discount_amount: Decimal,
+    ):
+        """
+        Give back a usage taken from a lease but not reserved.
+
+        The lease is dropped from memory, as the reservation may have been
+        refused because the lease was reclaimed or ran out of quota, and it
+        is read again on the next reservation.
+
+        :param coupon_id: id of coupon.
+        :param lease_id: id of lease.
+        :param discount_amount: discount of the reservation.
+        """
+        lease = self._leases.get(coupon_id)
+        if lease is not None and lease.lease_id == lease_id:
+            lease.give_back(discount_amount)
+            del self._leases[coupon_id]
+
+    async def _acquire(
+        self,
+        coupon_id: str,
+        discount_amount: Decimal,
+    ) -> Optional[QuotaLease]:
+        lock = self._locks.setdefault(coupon_id, asyncio.Lock())
+        async with lock:
+            # A concurrent reservation may have refilled the lease already,
+            # or found nothing left to lease.
+            lease = self._leases.get(coupon_id)
+            if self._is_exhausted(coupon_id) or (
+                lease is not None
+                and lease.fits(discount_amount)
+                and not lease.is_low(
+                    self.usage, self.budget, self.refill_ratio
+                )
+            ):
+                return lease
+
+            async with self._session_factory() as session:
+                lease_model = await CouponLeaseRepository(session).acquire(
+                    coupon_id,
+                    self.owner,
+                    self.usage,
+                    self.budget,
+                    self.ttl,
+                )
+                await session.commit()
+
+            if lease_model is None:
+                self._leases.pop(coupon_id, None)
+            elif lease is not None and lease.lease_id == str(lease_model.id):
+                lease.extend(lease_model)
+            else:
+                lease = self._leases[coupon_id] = QuotaLease(lease_model)
+
+            if lease_model is None or not lease.fits(discount_amount):
+                self._exhausted[coupon_id] = (
+                    time.monotonic() + self.exhausted_retry
+                )
+                return None
+            return lease
+
+    def _is_exhausted(self, coupon_id: str) -> bool:
+        retry_at = self._exhausted.get(coupon_id)
+        if retry_at is None:
+            return False
+        if retry_at <= time.monotonic():
+            del self._exhausted[coupon_id]
+            return False
+        return True
+
+    def _refill(self, coupon_id: str):
+        if coupon_id in self._refilling:
+            return
+
+        async def refill():
+            try:
+                await self._acquire(coupon_id, Decimal(0))
+            except Exception:
+                logger.exception(f"Could not refill lease of {coupon_id}")
+            finally:
+                self._refilling.discard(coupon_id)
+
+        self._refilling.add(coupon_id)
+        task = asyncio.create_task(refill())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.renew()
+                await self.reclaim_expired()
+            except Exception:
+                logger.exception("Could not maintain the quota leases")
+
+    async def renew(self):
+        """
+        Renew the leases of this pod used since the previous renewal.
+
+        The idle leases are given back, and dropped from memory first so
+        the next reservation of their coupon acquires a new lease. The
+        leases reclaimed by other pods are forgotten.
+        """
+        used, self._used = self._used, set()
+        self._keep_leases(used)
+
+        async with self._session_factory() as session:
+            repository = CouponLeaseRepository(session)
+            held = await repository.renew(self.owner, self.ttl, used)
+            for lease_id in held - used:
+                await repository.release(lease_id)
+            await session.commit()
+
+        if held - used:
+            # The quota given back can be leased again.
+            self._exhausted.clear()
+        self._keep_leases(held)
+
+    def _keep_leases(self, lease_ids: Set[str]):
+        for coupon_id, lease in list(self._leases.items()):
+            if lease.lease_id not in lease_ids:
+                self._leases.pop(coupon_id, None)
+
+    async def reclaim_expired(self) -> int:
+        """
+        Give the quota of the expired leases back to their coupons.
+
+        :return: number of reclaimed leases.
+        """
+        async with self._session_factory() as session:
+            repository = CouponLeaseRepository(session)
+            reclaimed = 0
+            for lease_id in await repository.get_expired_ids():
+                reclaimed += await repository.release(
+                    lease_id,
+                    expired_only=True,
+                )
+            await session.commit()
+
+        if reclaimed:
+            self._exhausted.clear()
+        return reclaimed
+
+
+quota_lease_manager = QuotaLeaseManager()
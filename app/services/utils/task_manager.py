@@ -1,31 +1,181 @@
-from typing import Callable
+import asyncio
+import json
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import AsyncContextManager, Awaitable, Callable, Optional
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.enums import TaskStatus
 from app.models.task import Task
 from app.repository.task import TaskRepository
+from app.settings import settings
+
+Sessions = Callable[[], AsyncContextManager[AsyncSession]]
+# Runs a task in a session, returning its result, or None when the task
+# was split in shards.
+TaskHandler = Callable[[Task, AsyncSession], Awaitable[Optional[str]]]
 
 
-async def task_wrapper(func: Callable, task_id: str, *args):
-    """Run a python function in background and update task status and result
-    :param func: python function that will be running in the background.
-    :param task_id: id of a task object.
-    :param *args: func arguments.
+def load_task_data(task: Task) -> dict:
+    """
+    :param task: task queued.
+    :return: data of the task.
     """
+    # The data was serialized before being stored in the JSON column.
+    if isinstance(task.data, str):
+        return json.loads(task.data)
+    return task.data
+
+
+class TaskWorker:
+    """
+    Worker running the queued tasks, a few at a time.
+
+    The workers claim the tasks from the database, so any number of them
+    can run side by side. A worker renews the heartbeat of its task while
+    running it: the task of a worker which crashed or hanged is claimed
+    again by another one once the heartbeat is stale.
+    """
+
+    def __init__(
+        self,
+        sessions: Sessions,
+        handler: TaskHandler,
+        owner: Optional[str] = None,
+    ):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self._sessions = sessions
+        self._handler = handler
+        self._stopping = asyncio.Event()
+
+    async def run(self, concurrency: int = 1):
+        """
+        Run the tasks claimed until stopped.
+
+        :param concurrency: number of tasks run at a time.
+        """
+        logger.info(f"Task worker {self.owner} started")
+        await asyncio.gather(*(self._work() for _ in range(concurrency)))
+        logger.info(f"Task worker {self.owner} stopped")
+
+    async def _work(self):
+        while not self._stopping.is_set():
+            if await self.run_once():
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(),
+                    settings.task_poll_interval,
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Stop claiming tasks, after the one running if any."""
+        self._stopping.set()
+
+    async def run_once(self) -> bool:
+        """
+        Claim a task and run it.
+
+        :return: False if no task was waiting.
+        """
+        task = await self._claim()
+        if task is None:
+            return False
+
+        heartbeat = asyncio.create_task(self._heartbeat(task.id))
+        try:
+            status, result = await self._run(task)
+        finally:
+            heartbeat.cancel()
+        if result is None:
+            logger.info(f"Task {task.id} split in shards")
+            return True
+
+        async with self._sessions() as session:
+            owned = await self._record(
+                TaskRepository(session),
+                task,
+                status,
+                result,
+            )
+            await session.commit()
+        if not owned:
+            logger.warning(f"Task {task.id} was taken over while running")
+        return True
 
-    db_session = args[1]
-    task_repository = TaskRepository(db_session)
+    async def _record(
+        self,
+        repository: TaskRepository,
+        task: Task,
+        status: TaskStatus,
+        result: str,
+    ) -> bool:
+        # A failure may be transient: one of a shard would fail the file.
+        if status == TaskStatus.FAILED and (
+            task.attempts < settings.task_max_attempts
+        ):
+            backoff = settings.task_retry_backoff * 2 ** (task.attempts - 1)
+            logger.info(f"Task {task.id} retried in {backoff} seconds")
+            return await repository.retry(
+                task.id,
+                self.owner,
+                result,
+                datetime.now(timezone.utc) + timedelta(seconds=backoff),
+            )
+        return await repository.finish(task.id, self.owner, status, result)
 
-    await task_repository.update_status(
-        task_id=task_id,
-        status=TaskStatus.IN_PROGRESS,
-    )
+    async def _claim(self) -> Optional[Task]:
+        stale_before = datetime.now(timezone.utc) - timedelta(
+            seconds=settings.task_stale_timeout,
+        )
+        async with self._sessions() as session:
+            repository = TaskRepository(session)
+            failed = await repository.fail_abandoned(
+                stale_before,
+                settings.task_max_attempts,
+            )
+            if failed:
+                logger.error(f"{failed} abandoned tasks failed")
+            task = await repository.claim(
+                self.owner,
+                stale_before,
+                settings.task_max_attempts,
+            )
+            await session.commit()
+        return task
 
-    result = await func(*args)
+    async def _run(self, task: Task):
+        logger.info(f"Task {task.id} claimed, attempt {task.attempts}")
+        async with self._sessions() as session:
+            try:
+                result = await self._handler(task, session)
+            except Exception as e:
+                await session.rollback()
+                logger.exception(f"Task {task.id} failed: {e}")
+                return TaskStatus.FAILED, str(e)
+        if result is not None:
+            logger.info(f"Task {task.id} completed: {result}")
+        return TaskStatus.COMPLETED, result
 
-    await task_repository.update(
-        query_filter=(Task.id == task_id),
-        data_to_update={
-            "result": result,
-            "status": TaskStatus.COMPLETED,
-        },
-    )
+    async def _heartbeat(self, task_id: str):
+        while True:
+            await asyncio.sleep(settings.task_heartbeat_interval)
+            try:
+                async with self._sessions() as session:
+                    owned = await TaskRepository(session).heartbeat(
+                        task_id,
+                        self.owner,
+                    )
+                    await session.commit()
+            except Exception as e:
+                # The next heartbeat may go through before the task is stale.
+                logger.warning(f"Heartbeat of task {task_id} failed: {e}")
+                continue
+            if not owned:
+                logger.warning(f"Task {task_id} was taken over while running")
+                return
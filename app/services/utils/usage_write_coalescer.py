@@ -0,0 +1,296 @@
+import asyncio
+from collections import defaultdict
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Set
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.helpers.exception import CouponAlreadyConfirmed
+from app.metrics import metrics
+from app.models.coupon import Coupon
+from app.repository.coupon import CouponRepository, UsageReservation
+from app.settings import settings
+
+RESERVE = "reserve"
+CONFIRM = "confirm"
+RELEASE = "release"
+
+flush_size = metrics.histogram(
+    "usage_write_flush_size",
+    "Usage history writes committed by each flush.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+flush_failures = metrics.counter(
+    "usage_write_flush_failures",
+    "Flushes whose transaction failed.",
+)
+
+
+class PendingWrite:
+    """Usage history write waiting for the next flush."""
+
+    def __init__(self, kind: str, coupon_id: str, payload, coupon=None):
+        self.kind = kind
+        self.coupon_id = coupon_id
+        self.payload = payload
+        self.coupon = coupon
+        self.future = asyncio.get_running_loop().create_future()
+        self.result = None
+        self.error: Optional[Exception] = None
+
+
+class UsageWriteCoalescer:
+    """
+    Group commit of the usage history writes of concurrent requests.
+
+    Reservations, confirmations and releases are collected during the
+    batch window, or until the batch is full, and written by a single
+    transaction with one statement per coupon. Each request waits for the
+    commit and gets its own result, or its own error. The writes of each
+    coupon are applied in a savepoint, so a failing coupon only fails its
+    own writes.
+    """
+
+    def __init__(
+        self,
+        window_ms: float = settings.usage_write_batch_window_ms,
+        max_size: int = settings.usage_write_batch_max_size,
+    ):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+        self._pending: List[PendingWrite] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._session_factory is not None
+
+    def start(self, session_factory: Callable[[], AsyncSession]):
+        """
+        Start coalescing the usage history writes.
+
+        :param session_factory: factory of the sessions of the flushes,
+            independent of the sessions of the requests.
+        """
+        self._session_factory = session_factory
+
+    async def stop(self):
+        """Flush the pending writes and stop coalescing."""
+        if not self.running:
+            return
+
+        self._flush()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        self._session_factory = None
+
+    async def reserve(
+        self,
+        coupon: Coupon,
+        transaction_id: str,
+        customer_key: str,
+        discount_amount: Decimal,
+        lease_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Reserve a usage of a coupon in the next flush.
+
+        :param coupon: coupon model item.
+        :param transaction_id: transaction id of the reservation.
+        :param customer_key: key of customer.
+        :param discount_amount: discount granted by the reservation.
+        :param lease_id: quota lease the reservation is taken from.
+
+        :return: True if reserved, False if a limit refused the reservation.
+        """
+        return await self._submit(
+            PendingWrite(
+                RESERVE,
+                coupon.coupon_id,
+                UsageReservation(
+                    transaction_id,
+                    customer_key,
+                    discount_amount,
+                    lease_id,
+                ),
+                coupon=coupon,
+            ),
+        )
+
+    async def confirm(self, coupon_id: str, transaction_id: str):
+        """
+        Confirm a reserved usage of a coupon in the next flush.
+
+        :param coupon_id: id of coupon.
+        :param transaction_id: transaction id of the usage.
+        """
+        await self._submit(PendingWrite(CONFIRM, coupon_id, transaction_id))
+
+    async def release(self, coupon_id: str, transaction_id: str):
+        """
+        Release a reserved usage of a coupon in the next flush.
+
+        :param coupon_id: id of coupon.
+        :param transaction_id: transaction id of the usage.
+
+        :raises CouponAlreadyConfirmed: the usage was confirmed meanwhile.
+        """
+        await self._submit(PendingWrite(RELEASE, coupon_id, transaction_id))
+
+    def _submit(self, write: PendingWrite) -> asyncio.Future:
+        self._pending.append(write)
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window,
+                self._flush,
+            )
+        return write.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[PendingWrite]):
+        flush_size.observe(len(batch))
+        try:
+            async with self._session_factory() as session:
+                repository = CouponRepository(session)
+                for writes in _group(batch):
+                    await _apply_nested(session, repository, writes)
+                await session.commit()
+        except Exception as error:
+            flush_failures.inc()
+            logger.exception("Could not flush the usage history writes")
+            for write in batch:
+                write.error = error
+                _resolve(write)
+            return
+
+        for write in batch:
+            _resolve(write)
+
+
+def _group(batch: List[PendingWrite]) -> List[List[PendingWrite]]:
+    """
+    Group the pending writes by coupon and kind.
+
+    :param batch: pending writes of the flush.
+
+    :return: the groups, in coupon order so concurrent flushes lock the
+        coupons in the same order.
+    """
+    groups: Dict[tuple, List[PendingWrite]] = defaultdict(list)
+    for write in batch:
+        groups[(write.coupon_id, write.kind)].append(write)
+    return [groups[key] for key in sorted(groups)]
+
+
+def _resolve(write: PendingWrite):
+    # The request of the write may have been cancelled while waiting.
+    if write.future.done():
+        return
+    if write.error is not None:
+        write.future.set_exception(write.error)
+    else:
+        write.future.set_result(write.result)
+
+
+async def _apply_nested(
+    session: AsyncSession,
+    repository: CouponRepository,
+    writes: List[PendingWrite],
+):
+    """
+    Write the pending writes of a coupon in a savepoint.
+
+    A failure only rolls back and fails the writes of the coupon, the
+    other writes of the flush are still committed.
+
+    :param session: session of the flush.
+    :param repository: coupon repository of the flush session.
+    :param writes: pending writes of the coupon.
+    """
+    try:
+        async with session.begin_nested():
+            await _apply(repository, writes)
+    except Exception as error:
+        logger.exception(
+            f"Could not write the usages of coupon {writes[0].coupon_id}",
+        )
+        for write in writes:
+            write.error = error
+
+
+async def _apply(repository: CouponRepository, writes: List[PendingWrite]):
+    """
+    Write the pending writes of a coupon, all of the same kind.
+
+    :param repository: coupon repository of the flush session.
+    :param writes: pending writes of the coupon.
+    """
+    coupon_id = writes[0].coupon_id
+    kind = writes[0].kind
+    if kind == RESERVE:
+        await _reserve(repository, writes[0].coupon, writes)
+        return
+
+    transaction_ids = [write.payload for write in writes]
+    if kind == CONFIRM:
+        await repository.confirm_usages(coupon_id, transaction_ids)
+        return
+
+    confirmed = await repository.release_usages(coupon_id, transaction_ids)
+    for write in writes:
+        if write.payload in confirmed:
+            write.error = CouponAlreadyConfirmed()
+
+
+async def _reserve(
+    repository: CouponRepository,
+    coupon: Coupon,
+    writes: List[PendingWrite],
+):
+    """
+    Reserve the pending reservations of a coupon.
+
+    Coupons whose counters are sharded or leased lock a shard or lease per
+    reservation, so their reservations are only grouped in the
+    transaction.
+
+    :param repository: coupon repository of the flush session.
+    :param coupon: coupon model item.
+    :param writes: pending reservations of the coupon.
+    """
+    if coupon.counter_shards or coupon.quota_leasing:
+        for write in writes:
+            reservation = write.payload
+            write.result = await repository.reserve_usage(
+                coupon,
+                reservation.transaction_id,
+                reservation.customer_key,
+                reservation.discount_amount,
+                lease_id=reservation.lease_id,
+            )
+        return
+
+    reserved = await repository.reserve_usages(
+        coupon.coupon_id,
+        [write.payload for write in writes],
+    )
+    for write, result in zip(writes, reserved):
+        write.result = result
+
+
+usage_write_coalescer = UsageWriteCoalescer()
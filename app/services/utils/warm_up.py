@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import Callable, List, Optional
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.metrics import metrics
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_cache import (
+    CouponDefinition,
+    coupon_definition_cache,
+)
+from app.settings import settings
+
+warm_up_duration = metrics.gauge(
+    "warm_up_duration_seconds",
+    "Time taken by the warm-up of this process.",
+)
+
+
+class WarmUp:
+    """
+    Warm-up of a new process before it reports ready.
+
+    Connections are opened in each pool, the statements of the hot paths
+    compiled on each engine, and the definitions of the most used valid
+    coupons cached. The process is ready once it is done, even if a step
+    failed, as a cold process is still able to serve.
+    """
+
+    def __init__(
+        self,
+        connections: int = settings.warm_up_connections,
+        prefetch_coupons: int = settings.warm_up_prefetch_coupons,
+    ):
+        self.connections = connections
+        self.prefetch_coupons = prefetch_coupons
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(
+        self,
+        engines: List[AsyncEngine],
+        session_factory: Callable[[], AsyncSession],
+    ):
+        """
+        Start the warm-up in background, so the health check can answer.
+
+        :param engines: engines to warm up.
+        :param session_factory: factory of the sessions of the warm-up.
+        """
+        self.ready = False
+        self._task = asyncio.create_task(
+            self._run(engines, session_factory),
+        )
+
+    async def stop(self):
+        """Cancel the warm-up if still running."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(
+        self,
+        engines: List[AsyncEngine],
+        session_factory: Callable[[], AsyncSession],
+    ):
+        start = time.monotonic()
+        try:
+            for engine in engines:
+                await self.open_connections(engine)
+                await self.compile_statements(engine)
+            if self.prefetch_coupons:
+                await self.prefetch(session_factory)
+        except Exception:
+            logger.exception("Could not complete the warm-up")
+        finally:
+            warm_up_duration.set(time.monotonic() - start)
+            self.ready = True
+
+    async def open_connections(self, engine: AsyncEngine):
+        """
+        Open connections of the pool of an engine, kept open by the pool.
+
+        :param engine: engine to warm up.
+        """
+        connections = []
+        try:
+            for _ in range(self.connections):
+                connections.append(await engine.connect())
+        finally:
+            for connection in connections:
+                await connection.close()
+
+    async def compile_statements(self, engine: AsyncEngine):
+        """
+        Run the hot statements on an engine, to fill its compiled cache.
+
+        :param engine: engine to warm up.
+        """
+        async with AsyncSession(engine) as session:
+            await CouponRepository(session).warm_up()
+            await session.rollback()
+
+    async def prefetch(self, session_factory: Callable[[], AsyncSession]):
+        """
+        Cache the definitions of the most used valid coupons.
+
+        :param session_factory: factory of the session reading them.
+        """
+        generation = coupon_definition_cache.generation
+        async with session_factory() as session:
+            coupons = await CouponRepository(session).get_most_used_valid(
+                self.prefetch_coupons,
+            )
+        for coupon in coupons:
+            coupon_definition_cache.put(
+                CouponDefinition.from_coupon(coupon),
+                coupon.customer_key,
+                generation,
+            )
+
+
+warm_up = WarmUp()
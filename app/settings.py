@@ -1,4 +1,5 @@
-from typing import List
+from decimal import Decimal
+from typing import Dict, List, Optional
 
 from pydantic import BaseSettings
 from yarl import URL
@@ -12,8 +13,8 @@ class Settings(BaseSettings):
     host: str
     port: int
 
-    # quantity of workers for uvicorn
-    workers_count: int
+    # quantity of workers for uvicorn, 0 for one per CPU of the container
+    workers_count: int = 0
 
     # Enable uvicorn reloading
     reload: bool
@@ -25,6 +26,49 @@ class Settings(BaseSettings):
     db_base: str
     db_echo: bool
 
+    # Reader endpoint of the read-only views, the writer when not set.
+    # Reads echoing the X-Last-Write header of a write within the read your
+    # writes window (milliseconds) are served by the writer, zero disables
+    # it.
+    db_read_host: str = ""
+    db_read_port: Optional[int] = None
+    db_read_your_writes_ms: float = 0
+
+    # Isolation level of the read-only views, the default when empty.
+    # AUTOCOMMIT runs every statement outside a transaction and gives the
+    # connection back to the pool after it. Transactions are READ ONLY on
+    # PostgreSQL, unless disabled.
+    db_read_isolation_level: str = ""
+    db_read_only_transactions: bool = True
+
+    # Prepared statements of the connections: "cached" keeps up to the
+    # cache size of them per connection, "pooler" prepares them again under
+    # unique names, safe behind a transaction pooler, and "direct" caches
+    # them on connections to the direct host, bypassing the sidecar. The
+    # mode is checked at startup. Numeric columns are decoded from their
+    # text, unless disabled.
+    db_statement_cache_mode: str = "cached"
+    db_statement_cache_size: int = 100
+    db_direct_host: str = ""
+    db_direct_port: Optional[int] = None
+    db_fast_numeric_codec: bool = True
+
+    # Pool of each engine. Connections are replaced after the recycle time
+    # (seconds), never if -1, and tested before use with pre ping.
+    db_pool_size: int = 5
+    db_pool_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+
+    # Server timeouts (milliseconds) of the connections, zero disables
+    # them. The route statement timeouts override the statement timeout of
+    # the transactions of a route, as in {"GET /v1/coupons/validate":
+    # 500}.
+    db_statement_timeout_ms: int = 0
+    db_idle_in_transaction_timeout_ms: int = 0
+    db_route_statement_timeouts: Dict[str, int] = {}
+
     api_key: str
     backend_cors_origins: List[str] = []
 
@@ -39,6 +83,86 @@ class Settings(BaseSettings):
     aws_region_name: str = ""
     aws_s3_bucket: str = ""
 
+    # Deadline (seconds) of the drain of the in-flight requests and tasks
+    # on shutdown, before they are cancelled. Keep it under the termination
+    # grace period of the pods.
+    drain_timeout: float = 20
+
+    # Health checks: each check fails after the check timeout (seconds),
+    # and the readiness result is reused for the cache ttl (seconds).
+    health_check_timeout: float = 1
+    health_check_cache_ttl: float = 2
+    # The pool check fails when a check out timed out, or the check outs
+    # waited more than the pool wait (milliseconds) on average, within the
+    # pool window (seconds).
+    health_check_pool_wait_ms: float = 500
+    health_check_pool_window: float = 10
+
+    # Bulk task workers: an idle worker polls the queue every poll interval
+    # and a busy one renews the heartbeat of its task every heartbeat
+    # interval (seconds). A task without heartbeat for the stale timeout is
+    # taken over by another worker, and failed after the max attempts. A
+    # task which failed is run again after the retry backoff (seconds),
+    # doubled on each attempt, until the max attempts.
+    task_poll_interval: float = 1
+    task_heartbeat_interval: float = 10
+    task_stale_timeout: float = 60
+    task_max_attempts: int = 3
+    task_retry_backoff: float = 5
+    # Bulk files larger than the shard size (bytes) are split in shards
+    # which any worker claims. A worker runs in its processes, 0 for one
+    # per CPU of the container, each running its concurrency of tasks.
+    task_shard_size: int = 8 * 1024 * 1024
+    task_worker_processes: int = 0
+    task_worker_concurrency: int = 2
+
+    # Warm-up of a new process, in background until it reports ready:
+    # connections opened in each pool, the hot statements compiled and the
+    # definitions of the most used valid coupons cached, zero for none.
+    warm_up_enabled: bool = True
+    warm_up_connections: int = 5
+    warm_up_prefetch_coupons: int = 0
+
+    # Quota leasing: each pod leases blocks of usage and budget of the
+    # coupons with quota leasing enabled, renewed every third of the ttl
+    # (seconds) and refilled when less than the refill ratio is left. A
+    # coupon with nothing left is leased again after the exhausted retry
+    # (seconds).
+    quota_lease_enabled: bool = True
+    quota_lease_usage: int = 50
+    quota_lease_budget: Decimal = Decimal(500)
+    quota_lease_ttl: int = 60
+    quota_lease_refill_ratio: float = 0.2
+    quota_lease_exhausted_retry: float = 1
+
+    # Group commit: the usage history writes of concurrent requests are
+    # collected for the batch window (milliseconds), or until the batch is
+    # full, and written by one transaction.
+    usage_write_batching: bool = False
+    usage_write_batch_window_ms: float = 2
+    usage_write_batch_max_size: int = 100
+
+    # Cache of the definitions of the valid coupons, per process. A zero
+    # max entries disables it.
+    coupon_cache_max_entries: int = 10000
+    coupon_cache_ttl: float = 30
+
+    # Bloom filter of the existing coupon codes, per process, refreshed
+    # every refresh interval (seconds) from the coupons changed since.
+    # Codes it rules out, or not found in the negative cache ttl
+    # (seconds), are rejected without a query.
+    coupon_code_filter_enabled: bool = True
+    coupon_code_filter_capacity: int = 1000000
+    coupon_code_filter_error_rate: float = 0.01
+    coupon_code_filter_refresh: float = 30
+    coupon_negative_cache_max_entries: int = 10000
+    coupon_negative_cache_ttl: float = 5
+
+    # Cross-process invalidation of the coupon caches by LISTEN/NOTIFY, on
+    # a dedicated connection pinged every ping interval (seconds).
+    cache_invalidation_enabled: bool = True
+    cache_invalidation_ping_interval: float = 10
+
     @property
     def db_url(self) -> URL:
         """
@@ -46,15 +170,32 @@ class Settings(BaseSettings):
 
         :return: database URL.
         """
+        host, port = self.db_host, self.db_port
+        if self.db_statement_cache_mode == "direct":
+            host = self.db_direct_host or host
+            port = self.db_direct_port or port
         return URL.build(
             scheme="postgresql+asyncpg",
-            host=self.db_host,
-            port=self.db_port,
+            host=host,
+            port=port,
             user=self.db_user,
             password=self.db_pass,
             path=f"/{self.db_base}",
         )
 
+    @property
+    def db_read_url(self) -> URL:
+        """
+        Assemble database URL of the reader endpoint from settings.
+
+        :return: database URL.
+        """
+        if not (self.db_read_host or self.db_read_port):
+            return self.db_url
+        return self.db_url.with_host(
+            self.db_read_host or self.db_host,
+        ).with_port(self.db_read_port or self.db_port)
+
     @property
     def db_url_alembic(self) -> URL:
         """
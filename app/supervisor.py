@@ -0,0 +1,91 @@
+import os
+import signal
+import time
+from typing import Callable, Set
+
+from loguru import logger
+
+# Exit code of a worker that could not start, as uvicorn's.
+STARTUP_FAILURE = 3
+
+# Pause before replacing a dead worker, so a crash loop does not spin.
+RESTART_DELAY = 1
+
+
+class Supervisor:
+    """
+    Worker processes run until the exit signals, the dead ones replaced.
+
+    The workers drain on the signals forwarded by the supervisor. A worker
+    dying outside the shutdown is replaced, unless it failed to start: the
+    others would fail alike, so all stop and the supervisor fails.
+    """
+
+    def __init__(self, spawn: Callable[[], int], count: int):
+        """
+        :param spawn: forks a worker and returns its pid.
+        :param count: number of workers.
+        """
+        self.spawn = spawn
+        self.count = count
+        self.children: Set[int] = set()
+        self.stopping = False
+        self.code = 0
+
+    def run(self) -> int:
+        """
+        Start the workers and wait for them to exit.
+
+        :return: exit code of the supervisor.
+        """
+        handlers = {
+            sig: signal.signal(sig, lambda sig, frame: self.stop(sig))
+            for sig in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            for _ in range(self.count):
+                self.children.add(self.spawn())
+            logger.info(f"Started {self.count} workers: {self.children}")
+            while self.children:
+                pid, status = os.wait()
+                self.children.discard(pid)
+                self._exited(pid, os.waitstatus_to_exitcode(status))
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+        return self.code
+
+    def stop(self, sig: int):
+        """Forward an exit signal to the workers and stop replacing them."""
+        self.stopping = True
+        for child in list(self.children):
+            try:
+                os.kill(child, sig)
+            except ProcessLookupError:
+                pass
+
+    def _exited(self, pid: int, code: int):
+        if self.stopping:
+            self.code = self.code or int(code != 0)
+            return
+        if code == STARTUP_FAILURE:
+            logger.error(f"Worker {pid} failed to start, stopping")
+            self.code = STARTUP_FAILURE
+            self.stop(signal.SIGTERM)
+            return
+
+        logger.warning(f"Worker {pid} exited with {code}, restarting")
+        time.sleep(RESTART_DELAY)
+        if not self.stopping:
+            self.children.add(self.spawn())
+
+
+def supervise(spawn: Callable[[], int], count: int) -> int:
+    """
+    Run worker processes until the exit signals, replacing the dead ones.
+
+    :param spawn: forks a worker and returns its pid.
+    :param count: number of workers.
+    :return: exit code of the supervisor.
+    """
+    return Supervisor(spawn, count).run()
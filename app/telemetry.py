@@ -1,24 +1,17 @@
 import abc
 import os
+from typing import TYPE_CHECKING
 
-from opentelemetry import trace
-from opentelemetry.exporter.datadog import (
-    DatadogExportSpanProcessor,
-    DatadogSpanExporter,
-)
-from opentelemetry.exporter.datadog.propagator import DatadogFormat
-from opentelemetry.instrumentation.asyncpg import AsyncPGInstrumentor
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
-from opentelemetry.propagate import get_global_textmap, set_global_textmap
-from opentelemetry.propagators.composite import CompositeHTTPPropagator
-from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+# The OpenTelemetry SDK, instrumentors and Datadog exporter take long to
+# import, they are imported on first use, only where telemetry is enabled.
+if TYPE_CHECKING:
+    from opentelemetry.sdk.trace import SpanProcessor
 
 
 class Exporter(abc.ABC):
     @staticmethod
     @abc.abstractmethod
-    def get_span_processor() -> SpanProcessor:
+    def get_span_processor() -> "SpanProcessor":
         ...
 
 
@@ -39,6 +32,15 @@ class Uninstrument(abc.ABC):
 class DatadogExporter(Exporter):
     @staticmethod
     def configure_propagator():
+        from opentelemetry.exporter.datadog.propagator import DatadogFormat
+        from opentelemetry.propagate import (
+            get_global_textmap,
+            set_global_textmap,
+        )
+        from opentelemetry.propagators.composite import (
+            CompositeHTTPPropagator,
+        )
+
         global_textmap = get_global_textmap()
         if isinstance(global_textmap, CompositeHTTPPropagator) and not any(
             isinstance(p, DatadogFormat) for p in global_textmap._propagators
@@ -52,7 +54,12 @@ class DatadogExporter(Exporter):
             set_global_textmap(DatadogFormat())
 
     @classmethod
-    def get_span_processor(cls) -> SpanProcessor:
+    def get_span_processor(cls) -> "SpanProcessor":
+        from opentelemetry.exporter.datadog import (
+            DatadogExportSpanProcessor,
+            DatadogSpanExporter,
+        )
+
         cls.configure_propagator()
 
         return DatadogExportSpanProcessor(
@@ -65,32 +72,54 @@ class DatadogExporter(Exporter):
 class FastAPIInstrument(Instrument, Uninstrument):
     @staticmethod
     def perform_instrumentation(app) -> None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
         FastAPIInstrumentor.instrument_app(app)
 
     @staticmethod
     def perform_uninstrument(app) -> None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
         FastAPIInstrumentor.uninstrument_app(app)
 
 
 class AsyncPGInstrument(Instrument):
     @staticmethod
     def perform_instrumentation() -> None:
+        from opentelemetry.instrumentation.asyncpg import AsyncPGInstrumentor
+
         AsyncPGInstrumentor().instrument()
 
 
 class SQLAlchemyInstrument(Instrument):
     @staticmethod
-    def perform_instrumentation(engine) -> None:
+    def perform_instrumentation(engine, *engines) -> None:
+        from opentelemetry import trace
+        from opentelemetry.instrumentation.sqlalchemy import (
+            SQLAlchemyInstrumentor,
+        )
+        from opentelemetry.instrumentation.sqlalchemy.engine import (
+            EngineTracer,
+        )
+
         SQLAlchemyInstrumentor().instrument(engine=engine.sync_engine)
+        # The instrumentor only traces the first engine it is given.
+        for other_engine in engines:
+            EngineTracer(trace.get_tracer(__name__), other_engine.sync_engine)
 
 
 class Telemetry:
     @staticmethod
     def init() -> None:
+        from opentelemetry import trace
+        from opentelemetry.sdk.trace import TracerProvider
+
         trace.set_tracer_provider(TracerProvider())
 
     @staticmethod
     def configure_exporter(exporter: Exporter) -> None:
+        from opentelemetry import trace
+
         trace.get_tracer_provider().add_span_processor(
             exporter.get_span_processor()
         )
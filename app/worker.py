@@ -0,0 +1,63 @@
+"""
+Worker running the bulk coupon creations enqueued by the API.
+
+Usage::
+
+    python -m app.worker
+"""
+import asyncio
+import os
+import signal
+import sys
+
+from loguru import logger
+
+from app.api.helpers.logging import setup_logging
+from app.lifetime import engine, session_factory
+from app.runner import workers_count
+from app.services.handlers import run_bulk_task
+from app.services.utils.task_manager import TaskWorker
+from app.settings import settings
+from app.supervisor import supervise
+
+
+async def work() -> None:
+    """Run the tasks until a termination signal, then finish the current."""
+    worker = TaskWorker(session_factory.session_factory, run_bulk_task)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run(settings.task_worker_concurrency)
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    setup_logging()
+    processes = workers_count(settings.task_worker_processes)
+    if processes == 1:
+        asyncio.run(work())
+        return
+
+    # Forked before any loop, thread or connection, each process claims
+    # its own tasks, so the shards of a file are parsed on every CPU.
+    sys.exit(supervise(_fork_worker, processes))
+
+
+def _fork_worker() -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            asyncio.run(work())
+            code = 0
+        except Exception:
+            logger.exception("Task worker crashed")
+        finally:
+            os._exit(code)
+    return pid
+
+
+if __name__ == "__main__":
+    main()
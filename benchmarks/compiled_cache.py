@@ -0,0 +1,152 @@
+"""
+Cost of building and compiling the statements of ``CouponRepository``.
+
+The statements run by the coupon lookup and by the reservation are
+captured, then their compilation is timed alone. Each method is then
+timed end to end, building its statements included, with the compiled
+cache of the engine and without it, as every statement using ``CustomID``
+ran before it was made cache safe::
+
+    python -m benchmarks.compiled_cache --repeat 200
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import event
+
+from app.api.coupon.v1.schema import CouponReservedInputSchema
+from app.models.coupon import Coupon
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_cache import coupon_definition_cache
+from app.services.coupon import CouponService
+from benchmarks.utils import (
+    benchmark_engine,
+    get_parser,
+    measure,
+    percentile,
+    print_table,
+    session_maker,
+)
+
+CODE = "BENCHCOMPILE"
+CUSTOMER_KEY = "customer-benchmark"
+
+
+async def create_coupon(factory):
+    async with factory() as session:
+        session.add(
+            Coupon(
+                description="benchmark",
+                code=CODE,
+                valid_from=datetime.now(timezone.utc) - timedelta(days=1),
+                valid_until=datetime.now(timezone.utc) + timedelta(days=1),
+                type="percent",
+                value=Decimal(10),
+                user_create="benchmark",
+            ),
+        )
+        await session.commit()
+
+
+def get_valid_coupon(factory):
+    async def run():
+        async with factory() as session:
+            await CouponRepository(session).get_valid_coupon(
+                CODE,
+                CUSTOMER_KEY,
+                False,
+                Decimal(100),
+            )
+
+    return run
+
+
+def add_reserved(factory):
+    transaction_ids = iter(range(10 ** 9))
+
+    async def run():
+        async with factory() as session:
+            await CouponService(session).add_reserved(
+                CODE,
+                CouponReservedInputSchema(
+                    customer_key=CUSTOMER_KEY,
+                    transaction_id=f"transaction-{next(transaction_ids)}",
+                    purchase_amount=Decimal(100),
+                    first_purchase=False,
+                ),
+            )
+            # The usage is not kept, so the coupon never runs out.
+            await session.rollback()
+
+    return run
+
+
+async def capture_statements(engine, method) -> list:
+    statements = []
+
+    def capture(conn, clauseelement, multiparams, params, options):
+        statements.append(clauseelement)
+
+    event.listen(engine.sync_engine, "before_execute", capture)
+    try:
+        await method()
+    finally:
+        event.remove(engine.sync_engine, "before_execute", capture)
+    return statements
+
+
+def compile_time(statements, dialect, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for statement in statements:
+            statement.compile(dialect=dialect)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+async def run(repeat: int, db_url: str = None):
+    # Every lookup builds and runs its statements.
+    coupon_definition_cache.max_entries = 0
+    rows = []
+    async with benchmark_engine(db_url) as engine:
+        await create_coupon(session_maker(engine))
+        cached = session_maker(engine)
+        uncached = session_maker(engine.execution_options(compiled_cache=None))
+        for name, method in [
+            ("get_valid_coupon", get_valid_coupon),
+            ("add_reserved", add_reserved),
+        ]:
+            statements = await capture_statements(engine, method(cached))
+            cached_latencies = await measure(method(cached), repeat)
+            uncached_latencies = await measure(method(uncached), repeat)
+            rows.append(
+                [
+                    name,
+                    len(statements),
+                    compile_time(statements, engine.dialect, repeat),
+                    percentile(uncached_latencies, 50),
+                    percentile(cached_latencies, 50),
+                ],
+            )
+
+    print_table(
+        [
+            "method",
+            "statements",
+            "compile ms",
+            "uncached p50 ms",
+            "cached p50 ms",
+        ],
+        rows,
+    )
+
+
+def main():
+    parser = get_parser(__doc__)
+    args = parser.parse_args()
+    asyncio.run(run(args.repeat, args.db_url))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Cold start of a new process of the application.
+
+Each run boots a fresh interpreter that imports the application, builds it
+and serves its first request, the liveness check, and reports:
+
+- the import time of ``app.application``,
+- the time from spawning the process to its first response,
+- the resident memory of the process once it answered.
+
+The import time of a separate run is then broken down by top level
+package, as reported by ``python -X importtime``. The settings are read
+from the environment, as the server does::
+
+    python -m benchmarks.startup --repeat 10
+
+With ``--startup`` the startup events run before the first request, which
+connects to the database of the settings.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.utils import percentile, print_table
+
+# Run in the fresh interpreter, which must not import anything else first.
+BOOT = """
+import json, os, resource, sys, time
+
+start = time.perf_counter()
+from app.application import get_app
+imported = time.perf_counter()
+
+import asyncio
+from httpx import AsyncClient
+
+
+async def first_request(startup):
+    app = get_app()
+    if startup:
+        await app.router.startup()
+    async with AsyncClient(app=app, base_url="http://startup") as client:
+        response = await client.get("/health/live")
+    response.raise_for_status()
+    return app
+
+
+app = asyncio.run(first_request(sys.argv[1] == "1"))
+served_at = time.time()
+try:
+    with open("/proc/self/statm") as statm:
+        rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "served_at": served_at,
+    "rss_mb": rss / 2 ** 20,
+}))
+if sys.argv[1] == "1":
+    asyncio.run(app.router.shutdown())
+"""
+
+
+def boot(startup: bool) -> dict:
+    """
+    Boot a fresh process of the application, up to its first response.
+
+    :param startup: run the startup events before the first request.
+
+    :return: import time, time to first request and memory of the process.
+    """
+    spawned_at = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", BOOT, "1" if startup else "0"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["first_request_ms"] = (report.pop("served_at") - spawned_at) * 1000
+    return report
+
+
+def import_times() -> Dict[str, float]:
+    """
+    Break down the import time of the application by top level package.
+
+    :return: import time in milliseconds, by package.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.application"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages: Dict[str, float] = defaultdict(float)
+    # "import time: <self us> | <cumulative us> | <indented module>"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, module = line[len("import time:"):].split("|")
+        packages[module.strip().split(".")[0]] += int(self_us) / 1000
+    return packages
+
+
+def run(repeat: int, startup: bool, packages: int):
+    reports = [boot(startup) for _ in range(repeat)]
+
+    rows: List[List] = []
+    for name, key in [
+        ("import ms", "import_ms"),
+        ("first request ms", "first_request_ms"),
+        ("rss MB", "rss_mb"),
+    ]:
+        values = [report[key] for report in reports]
+        rows.append(
+            [
+                name,
+                percentile(values, 50),
+                percentile(values, 95),
+                max(values),
+            ],
+        )
+    print_table(["metric", "p50", "p95", "max"], rows)
+
+    print()
+    times = sorted(import_times().items(), key=lambda item: -item[1])
+    print_table(
+        ["package", "import ms"],
+        [list(item) for item in times[:packages]],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="number of processes booted.",
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="run the startup events, which connect to the database.",
+    )
+    parser.add_argument(
+        "--packages",
+        type=int,
+        default=15,
+        help="number of packages in the import time breakdown.",
+    )
+    args = parser.parse_args()
+    run(args.repeat, args.startup, args.packages)
+
+
+if __name__ == "__main__":
+    main()
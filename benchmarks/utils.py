@@ -0,0 +1,170 @@
+"""Shared helpers for the benchmark scripts."""
+import argparse
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base, CreateCustomID
+from app.models import load_all_models
+
+
+@compiles(CreateCustomID, "sqlite")
+def create_custom_id_for_sqlite(element, compiler, **kwargs):
+    return compiler.process(func.random())
+
+
+def default_db_url() -> str:
+    """
+    Build a throwaway SQLite database url.
+
+    A file is used instead of ``:memory:`` so that concurrent connections
+    share the same database.
+
+    :return: database url.
+    """
+    tmp = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False)
+    return f"sqlite+aiosqlite:///{tmp.name}"
+
+
+def get_parser(description: str) -> argparse.ArgumentParser:
+    """
+    Build the argument parser shared by the benchmarks.
+
+    :param description: benchmark description.
+
+    :return: argument parser.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--db-url",
+        default=None,
+        help="database url, a temporary SQLite database is used if empty.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=30,
+        help="number of measured runs per scenario.",
+    )
+    return parser
+
+
+@asynccontextmanager
+async def benchmark_engine(
+    db_url: str = None,
+    **engine_options,
+) -> AsyncIterator[AsyncEngine]:
+    """
+    Create an engine with a fresh schema.
+
+    :param db_url: database url.
+    :param engine_options: options of ``create_async_engine``.
+
+    :yield: async engine.
+    """
+    load_all_models()
+    engine = create_async_engine(db_url or default_db_url(), **engine_options)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+
+
+def concurrent_engine_options(db_url: str, connections: int) -> dict:
+    """
+    Build the engine options for benchmarks with concurrent sessions.
+
+    :param db_url: database url, None for the temporary SQLite database.
+    :param connections: number of concurrent sessions.
+
+    :return: options of ``create_async_engine``.
+    """
+    if db_url:
+        return {"pool_size": connections, "max_overflow": 0}
+    # SQLite serializes writers, wait for the lock instead of failing.
+    return {"connect_args": {"timeout": 60}}
+
+
+def session_maker(engine: AsyncEngine) -> sessionmaker:
+    """
+    Create the session factory used by the benchmarks.
+
+    :param engine: async engine.
+
+    :return: session factory.
+    """
+    return sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+async def measure(
+    func_: Callable[[], Awaitable],
+    repeat: int,
+    warmup: int = 3,
+) -> List[float]:
+    """
+    Measure the latency of a coroutine function.
+
+    :param func_: coroutine function to measure.
+    :param repeat: number of measured runs.
+    :param warmup: number of runs discarded before measuring.
+
+    :return: latencies in milliseconds.
+    """
+    for _ in range(warmup):
+        await func_()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func_()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(latencies: List[float], value: int) -> float:
+    """
+    Get a percentile of a latency sample.
+
+    :param latencies: latencies in milliseconds.
+    :param value: percentile between 1 and 99.
+
+    :return: percentile value.
+    """
+    if len(latencies) < 2:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100)[value - 1]
+
+
+def print_table(headers: List[str], rows: List[List]) -> None:
+    """
+    Print a plain text table.
+
+    :param headers: column names.
+    :param rows: table rows.
+    """
+    table = [headers] + [
+        [
+            f"{cell:.2f}" if isinstance(cell, float) else str(cell)
+            for cell in row
+        ]
+        for row in rows
+    ]
+    widths = [
+        max(len(row[index]) for row in table) for index in range(len(headers))
+    ]
+    for row in table:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
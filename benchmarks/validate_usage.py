@@ -0,0 +1,153 @@
+"""
+Latency of coupon validation by number of usage histories.
+
+Compares the previous validation query, which loaded every usage history
+of the coupon with ``selectinload``, with the aggregate projection of
+``CouponRepository.get_valid_coupon``.
+
+Usage::
+
+    python -m benchmarks.validate_usage --sizes 0 1000 10000 100000
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.orm import selectinload
+
+from app.models.coupon import Coupon, UsageHistory
+from app.repository.coupon import CouponRepository
+from benchmarks.utils import (
+    benchmark_engine,
+    get_parser,
+    measure,
+    percentile,
+    print_table,
+    session_maker,
+)
+
+CODE = "BENCHVALIDATE"
+CUSTOMER_KEY = "customer-benchmark"
+INSERT_CHUNK = 5000
+
+
+async def legacy_get_valid_coupon(session, code: str, customer_key: str):
+    raw = await session.execute(
+        select(Coupon)
+        .options(selectinload(Coupon.usage_histories))
+        .where(Coupon.code == code)
+        .where(Coupon.valid_from <= datetime.now(timezone.utc))
+        .where(Coupon.valid_until >= datetime.now(timezone.utc))
+        .where(
+            or_(
+                Coupon.customer_key.is_(None),
+                Coupon.customer_key == customer_key,
+            ),
+        )
+        .where(Coupon.active.is_(True)),
+    )
+    coupon = raw.scalar_one()
+    return len(coupon.usage_histories)
+
+
+async def create_coupon(session) -> str:
+    coupon = Coupon(
+        description="benchmark",
+        code=CODE,
+        valid_from=datetime.now(timezone.utc) - timedelta(days=1),
+        valid_until=datetime.now(timezone.utc) + timedelta(days=1),
+        type="percent",
+        value=Decimal(10),
+        user_create="benchmark",
+    )
+    session.add(coupon)
+    await session.commit()
+    return coupon.coupon_id
+
+
+async def fill_usage_histories(session, coupon_id: str, start: int, end: int):
+    for chunk_start in range(start, end, INSERT_CHUNK):
+        chunk_end = min(chunk_start + INSERT_CHUNK, end)
+        await session.execute(
+            insert(UsageHistory),
+            [
+                {
+                    "id": f"benchmark-{index}",
+                    "transaction_id": f"transaction-{index}",
+                    "customer_key": f"customer-{index % 1000}",
+                    "discount_amount": Decimal("1.50"),
+                    "coupon_id": coupon_id,
+                }
+                for index in range(chunk_start, chunk_end)
+            ],
+        )
+    await session.commit()
+
+
+async def run(sizes, repeat: int, db_url: str = None):
+    rows = []
+    async with benchmark_engine(db_url) as engine:
+        factory = session_maker(engine)
+        async with factory() as session:
+            await session.execute(delete(UsageHistory))
+            coupon_id = await create_coupon(session)
+
+        filled = 0
+        for size in sorted(sizes):
+            async with factory() as session:
+                await fill_usage_histories(session, coupon_id, filled, size)
+            filled = size
+
+            async def legacy():
+                async with factory() as session:
+                    await legacy_get_valid_coupon(session, CODE, CUSTOMER_KEY)
+
+            async def aggregate():
+                async with factory() as session:
+                    await CouponRepository(session).get_valid_coupon(
+                        CODE,
+                        CUSTOMER_KEY,
+                        True,
+                        Decimal(100),
+                    )
+
+            legacy_latencies = await measure(legacy, repeat)
+            aggregate_latencies = await measure(aggregate, repeat)
+            rows.append(
+                [
+                    size,
+                    percentile(legacy_latencies, 50),
+                    percentile(legacy_latencies, 95),
+                    percentile(aggregate_latencies, 50),
+                    percentile(aggregate_latencies, 95),
+                ],
+            )
+
+    print_table(
+        [
+            "usage rows",
+            "selectinload p50 ms",
+            "selectinload p95 ms",
+            "aggregate p50 ms",
+            "aggregate p95 ms",
+        ],
+        rows,
+    )
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[0, 100, 1000, 10000, 50000],
+        help="number of usage histories of the validated coupon.",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.repeat, args.db_url))
+
+
+if __name__ == "__main__":
+    main()
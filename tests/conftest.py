@@ -1,5 +1,6 @@
 from asyncio import current_task
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from io import StringIO
 from typing import AsyncGenerator, Callable
 
@@ -19,9 +20,13 @@ from sqlalchemy.orm import sessionmaker
 from app.api.coupon.v1.schema import CouponInputWithManyCustomers
 from app.application import get_app
 from app.db.base import Base, CreateCustomID
-from app.db.dependencies import get_db_session
+from app.db.dependencies import get_db_session, get_read_session
 from app.models.coupon import Coupon, UsageHistory
 from app.models.task import Task
+from app.repository.coupon_cache import (
+    coupon_definition_cache,
+    coupon_negative_cache,
+)
 from app.settings import settings
 
 
@@ -55,6 +60,13 @@ async def db_session() -> AsyncSession:
             await session.rollback()
 
 
+@pytest.fixture(autouse=True)
+def clear_coupon_caches():
+    # Every test has its own database.
+    coupon_definition_cache.clear()
+    coupon_negative_cache.clear()
+
+
 @pytest.fixture()
 def override_get_db(db_session: AsyncSession) -> Callable:
     async def _override_get_db():
@@ -67,6 +79,7 @@ def override_get_db(db_session: AsyncSession) -> Callable:
 def app(override_get_db: Callable) -> FastAPI:
     app = get_app()
     app.dependency_overrides[get_db_session] = override_get_db
+    app.dependency_overrides[get_read_session] = override_get_db
     return app
 
 
@@ -621,9 +634,15 @@ async def usage_histories_factory(db_session, coupons_factory):
             "coupon_id": coupons_factory[1].coupon_id,
         },
     ]
+    coupons = {coupon.coupon_id: coupon for coupon in coupons_factory}
     result = []
     for usage_history in usage_histories:
         new_usage_history = UsageHistory(**usage_history)
+        coupon = coupons[usage_history["coupon_id"]]
+        coupon.reserved_count += 1
+        coupon.accumulated_discount += Decimal(
+            str(usage_history["discount_amount"]),
+        )
         db_session.add(new_usage_history)
         await db_session.commit()
         await db_session.refresh(new_usage_history)
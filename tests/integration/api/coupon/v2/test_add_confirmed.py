@@ -53,11 +53,11 @@ async def test_should_confirme_usage_coupon(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
 
     coupon_model: Coupon = raw.scalar_one()
-    await db_session.refresh(coupon_model)
     assert coupon_model.confirmed_usage == 1
     assert coupon_model.reserved_usage == 0
     assert coupon_model.total_usage == 1
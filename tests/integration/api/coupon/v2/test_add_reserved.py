@@ -45,10 +45,10 @@ async def test_should_reserve_coupon(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id),
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.confirmed_usage == 0
     assert coupon_model.reserved_usage == 1
@@ -107,10 +107,10 @@ async def test_should_not_reserve_coupon_with_same_transaction_id_and_code_multi
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id),
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.confirmed_usage == 0
     assert coupon_model.reserved_usage == 1
@@ -1,21 +1,66 @@
 import csv
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 from io import StringIO
 from tempfile import TemporaryFile
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 from fastapi import status
 from httpx import AsyncClient
 from sqlalchemy import select
 
+from app.enums import TaskStatus
 from app.models.coupon import Coupon
 from app.models.task import Task
+from app.services.handlers import run_bulk_task
+from app.services.utils.task_manager import TaskWorker
 
 VALID_DATE_ISOFORMAT = datetime.now().isoformat()
 
 
+def storage_mock():
+    upload = Mock(
+        key="file_key_test",
+        completed=False,
+        write=AsyncMock(),
+        abort=AsyncMock(),
+    )
+
+    async def complete():
+        upload.completed = True
+
+    upload.complete = AsyncMock(side_effect=complete)
+
+    def written():
+        return b"".join(call.args[0] for call in upload.write.mock_calls)
+
+    async def file_size(file_key):
+        return len(written())
+
+    async def download_chunks(file_key, chunk_size, start=0):
+        content = written()
+        # Small chunks, cutting lines and shards anywhere.
+        for offset in range(start, len(content), 5):
+            yield content[offset:offset + 5]
+
+    return Mock(
+        create_upload=Mock(return_value=upload),
+        download_chunks=download_chunks,
+        file_size=file_size,
+    )
+
+
+async def run_worker(db_session, storage) -> bool:
+    @asynccontextmanager
+    async def sessions():
+        yield db_session
+
+    with patch("app.services.handlers.StorageAWSService", storage):
+        return await TaskWorker(sessions, run_bulk_task).run_once()
+
+
 @pytest.mark.asyncio
 async def test_should_bulk_create_coupon_from_file(
     async_client: AsyncClient,
@@ -23,9 +68,7 @@ async def test_should_bulk_create_coupon_from_file(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -65,6 +108,13 @@ async def test_should_bulk_create_coupon_from_file(
                 ),
             },
         )
+        raw_task = await db_session.execute(select(Task))
+        task = raw_task.scalar_one()
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json() == {"task_id": task.id}
+        assert task.status == TaskStatus.CREATED
+        assert await run_worker(db_session, mocky)
+
         # THEN
         raw = await db_session.execute(
             select(Coupon).where(
@@ -72,13 +122,15 @@ async def test_should_bulk_create_coupon_from_file(
             ),
         )
         coupons = raw.scalars().all()
-
-        raw_task = await db_session.execute(select(Task))
-        task = raw_task.scalar_one()
-        assert response.status_code == status.HTTP_202_ACCEPTED
+        await db_session.refresh(task)
+        assert task.status == TaskStatus.COMPLETED
+        assert json.loads(task.result) == {"created": 3, "skipped": 0}
         assert len(coupons) == 3
         assert json.loads(task.data)["file_key"] == "file_key_test"
-        assert mocky.return_value.upload_file_obj.call_count == 1
+        assert mocky.return_value.create_upload.call_count == 1
+        upload = mocky.return_value.create_upload.return_value
+        written = b"".join(call.args[0] for call in upload.write.mock_calls)
+        assert written == f.getvalue().encode("utf-8")
 
 
 @pytest.mark.asyncio
@@ -88,9 +140,7 @@ async def test_should_bulk_create_coupon_from_customer_keys(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -112,6 +162,7 @@ async def test_should_bulk_create_coupon_from_customer_keys(
             "/v1/coupons/bulk/by-client",
             data=payload,
         )
+        await run_worker(db_session, mocky)
 
         # THEN
         raw = await db_session.execute(
@@ -127,7 +178,7 @@ async def test_should_bulk_create_coupon_from_customer_keys(
         assert (
             json.loads(task.data)["customer_keys"] == payload["customer_keys"]
         )
-        assert mocky.return_value.upload_file_obj.call_count == 0
+        assert mocky.return_value.create_upload.call_count == 0
 
 
 @pytest.mark.asyncio
@@ -137,9 +188,7 @@ async def test_should_not_bulk_create_coupon_from_file(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -207,9 +256,7 @@ async def test_should_ignore_empty_lines_in_file(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -253,6 +300,8 @@ async def test_should_ignore_empty_lines_in_file(
                 ),
             },
         )
+        await run_worker(db_session, mocky)
+
         # THEN
         raw = await db_session.execute(
             select(Coupon).where(
@@ -271,9 +320,7 @@ async def test_should_ignore_empty_index_in_array_customer_keys(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -295,6 +342,7 @@ async def test_should_ignore_empty_index_in_array_customer_keys(
             "/v1/coupons/bulk/by-client",
             data=payload,
         )
+        await run_worker(db_session, mocky)
 
         # THEN
         raw = await db_session.execute(
@@ -309,7 +357,7 @@ async def test_should_ignore_empty_index_in_array_customer_keys(
         assert response.status_code == status.HTTP_202_ACCEPTED
         assert len(coupons) == len(customer_keys_clean)
         assert json.loads(task.data)["customer_keys"] == customer_keys_clean
-        assert mocky.return_value.upload_file_obj.call_count == 0
+        assert mocky.return_value.create_upload.call_count == 0
 
 
 @pytest.mark.asyncio
@@ -318,9 +366,7 @@ async def test_should_throw_exception_if_not_csv(
 ):
     with patch("app.services.coupon.StorageAWSService") as mocky:
         # GIVEN
-        mocky.return_value = Mock(
-            upload_file_obj=Mock(return_value="file_key_test"),
-        )
+        mocky.return_value = storage_mock()
         payload = {
             "description": "10% de desconto na cerveja",
             "code": "cerveja10",
@@ -356,4 +402,101 @@ async def test_should_throw_exception_if_not_csv(
         assert (
             result["error_message"][0]["msg"] == "file must be in CSV format"
         )
-        assert mocky.return_value.upload_file_obj.call_count == 0
+        assert mocky.return_value.create_upload.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_should_not_enqueue_bulk_create_if_upload_fails(
+    async_client: AsyncClient,
+    db_session,
+):
+    with patch("app.services.coupon.StorageAWSService") as mocky:
+        # GIVEN
+        mocky.return_value = storage_mock()
+        upload = mocky.return_value.create_upload.return_value
+        upload.complete.side_effect = ConnectionError("storage down")
+        payload = {
+            "description": "10% de desconto na cerveja",
+            "code": "cerveja10",
+            "valid_from": VALID_DATE_ISOFORMAT,
+            "valid_until": VALID_DATE_ISOFORMAT,
+            "max_usage": 1,
+            "type": "percent",
+            "value": "10.00",
+            "user_create": "test",
+        }
+
+        # WHEN
+        response = await async_client.post(
+            "/v1/coupons/bulk/by-client",
+            data=payload,
+            files={
+                "file_with_customer_keys": (
+                    "customer_key.csv",
+                    b"customerkey1\n",
+                    "text/csv",
+                ),
+            },
+        )
+
+        # THEN
+        raw_task = await db_session.execute(select(Task))
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+        assert raw_task.scalar_one_or_none() is None
+        upload.abort.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("app.services.handlers.settings.task_shard_size", 16)
+async def test_should_bulk_create_coupon_from_file_in_shards(
+    async_client: AsyncClient,
+    db_session,
+):
+    with patch("app.services.coupon.StorageAWSService") as mocky:
+        # GIVEN
+        mocky.return_value = storage_mock()
+        payload = {
+            "description": "10% de desconto na cerveja",
+            "code": "cerveja10",
+            "valid_from": VALID_DATE_ISOFORMAT,
+            "valid_until": VALID_DATE_ISOFORMAT,
+            "max_usage": 1,
+            "type": "percent",
+            "value": "10.00",
+            "user_create": "test",
+        }
+        customer_keys = [f"customerkey{index}" for index in range(10)]
+        content = "".join(f"{key}\r\n" for key in customer_keys)
+        await async_client.post(
+            "/v1/coupons/bulk/by-client",
+            data=payload,
+            files={
+                "file_with_customer_keys": (
+                    "customer_key.csv",
+                    content.encode("utf-8"),
+                    "text/csv",
+                ),
+            },
+        )
+
+        # WHEN
+        runs = 0
+        while await run_worker(db_session, mocky):
+            runs += 1
+
+        # THEN
+        raw = await db_session.execute(
+            select(Coupon).where(Coupon.customer_key.in_(customer_keys)),
+        )
+        coupons = raw.scalars().all()
+        raw_task = await db_session.execute(
+            select(Task)
+            .where(Task.parent_id.is_(None))
+            .execution_options(populate_existing=True),
+        )
+        task = raw_task.scalar_one()
+        assert runs == 1 + task.shards
+        assert task.shards == len(content) // 16 + 1
+        assert task.status == TaskStatus.COMPLETED
+        assert json.loads(task.result) == {"created": 10, "skipped": 0}
+        assert sorted(c.customer_key for c in coupons) == customer_keys
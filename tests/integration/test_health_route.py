@@ -0,0 +1,88 @@
+import pytest
+from fastapi import FastAPI, status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.api.healthcheck.views import get_engines
+from app.services.utils.warm_up import warm_up
+from app.settings import settings
+
+
+@pytest.fixture(autouse=True)
+async def engine(app: FastAPI, monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    app.dependency_overrides[get_engines] = lambda: [engine]
+    monkeypatch.setattr(settings, "health_check_cache_ttl", 0)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_should_not_be_ready_before_warm_up(
+    async_client: AsyncClient,
+    monkeypatch,
+):
+    # GIVEN
+    monkeypatch.setattr(warm_up, "ready", False)
+
+    # WHEN
+    response = await async_client.get("/health")
+
+    # THEN
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()["status"] is False
+
+
+@pytest.mark.asyncio
+async def test_should_be_ready_after_warm_up(
+    async_client: AsyncClient,
+    monkeypatch,
+):
+    # GIVEN
+    monkeypatch.setattr(warm_up, "ready", True)
+
+    # WHEN
+    response = await async_client.get("/health/ready")
+
+    # THEN
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] is True
+    assert {check["name"] for check in response.json()["checks"]} == {
+        "Warm-up",
+        "Postgres",
+        "Pool",
+    }
+
+
+@pytest.mark.asyncio
+async def test_should_be_alive_without_checking_the_database(
+    async_client: AsyncClient,
+    engine,
+    monkeypatch,
+):
+    # GIVEN
+    monkeypatch.setattr(warm_up, "ready", False)
+    await engine.dispose()
+
+    # WHEN
+    response = await async_client.get("/health/live")
+
+    # THEN
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] is True
+
+
+@pytest.mark.asyncio
+async def test_should_not_be_ready_when_a_check_times_out(
+    async_client: AsyncClient,
+    monkeypatch,
+):
+    # GIVEN
+    monkeypatch.setattr(warm_up, "ready", True)
+    monkeypatch.setattr(settings, "health_check_timeout", 0)
+
+    # WHEN
+    response = await async_client.get("/health/ready")
+
+    # THEN
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
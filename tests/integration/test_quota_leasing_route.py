@@ -0,0 +1,166 @@
+from decimal import Decimal
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import select
+
+from app.models.coupon import Coupon, CouponLease
+from app.services.utils.quota_lease import quota_lease_manager
+
+
+@pytest.fixture()
+async def running_quota_lease_manager(db_session):
+    quota_lease_manager.start(
+        sessionmaker(
+            db_session.bind,
+            class_=AsyncSession,
+            expire_on_commit=False,
+        ),
+    )
+    yield quota_lease_manager
+    await quota_lease_manager.stop()
+
+
+async def get_coupon(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon_id)
+    )
+    return raw.scalar_one()
+
+
+def reserve_payload(transaction_id):
+    return {
+        "transaction_id": transaction_id,
+        "customer_key": f"customer{transaction_id}",
+        "purchase_amount": 100,
+        "first_purchase": True,
+    }
+
+
+@pytest.mark.asyncio
+async def test_should_enable_quota_leasing(
+    async_client: AsyncClient, coupons_factory, db_session
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+
+    # WHEN
+    response = await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/quota-leasing",
+    )
+
+    # THEN
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.quota_leasing is True
+
+
+@pytest.mark.asyncio
+async def test_should_reserve_from_quota_lease(
+    async_client: AsyncClient,
+    coupons_factory,
+    db_session,
+    running_quota_lease_manager,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(f"/v1/coupons/{coupon.coupon_id}/quota-leasing")
+
+    # WHEN
+    responses = [
+        await async_client.put(
+            f"/v1/coupons/{coupon.code}/reserved",
+            json=reserve_payload(str(index)),
+        )
+        for index in range(coupon.max_usage + 1)
+    ]
+
+    # THEN
+    assert [response.status_code for response in responses[:-1]] == [
+        status.HTTP_204_NO_CONTENT
+    ] * coupon.max_usage
+    assert responses[-1].status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert responses[-1].json()["error_code"] == "max_usage_reached"
+
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.reserved_usage == coupon.max_usage
+    assert coupon_model.leased_usage == coupon.max_usage
+    assert coupon_model.accumulated_value == Decimal(100)
+
+    raw = await db_session.execute(select(CouponLease.reserved_count))
+    assert raw.scalars().all() == [coupon.max_usage]
+
+
+@pytest.mark.asyncio
+async def test_should_update_lease_of_usage(
+    async_client: AsyncClient,
+    coupons_factory,
+    db_session,
+    running_quota_lease_manager,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(f"/v1/coupons/{coupon.coupon_id}/quota-leasing")
+    for transaction_id in ("1", "2"):
+        await async_client.put(
+            f"/v1/coupons/{coupon.code}/reserved",
+            json=reserve_payload(transaction_id),
+        )
+
+    # WHEN
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/confirmed",
+        json={"transaction_id": "1"},
+    )
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/unreserved",
+        json={"transaction_id": "2"},
+    )
+    await running_quota_lease_manager.stop()
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.confirmed_count == 1
+    assert coupon_model.leased_usage == 0
+    assert coupon_model.accumulated_value == 10
+
+
+@pytest.mark.asyncio
+async def test_should_not_lease_sharded_coupon(
+    async_client: AsyncClient, coupons_factory
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 2},
+    )
+
+    # WHEN
+    response = await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/quota-leasing",
+    )
+
+    # THEN
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert (
+        response.json()["error_code"] == "coupon_counters_already_distributed"
+    )
+
+
+@pytest.mark.asyncio
+async def test_should_not_lease_inexistent_coupon(
+    async_client: AsyncClient, db_session
+):
+    # WHEN
+    response = await async_client.post("/v1/coupons/WRONG_ID/quota-leasing")
+
+    # THEN
+    assert response.status_code == status.HTTP_404_NOT_FOUND
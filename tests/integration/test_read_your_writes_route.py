@@ -0,0 +1,105 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+import app.db.dependencies as dependencies
+from app.application import get_app
+from app.db.dependencies import LAST_WRITE_HEADER
+from app.models.coupon import Coupon
+from app.settings import settings
+
+
+class SharedSession:
+    """Session of the test database, left open by the dependencies."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture()
+def served_by(monkeypatch, db_session):
+    served = []
+
+    def factory(endpoint):
+        def create():
+            served.append(endpoint)
+            return SharedSession(db_session)
+
+        return create
+
+    monkeypatch.setattr(settings, "db_read_your_writes_ms", 5000)
+    monkeypatch.setattr(dependencies, "session_factory", factory("writer"))
+    monkeypatch.setattr(
+        dependencies,
+        "writer_read_session_factory",
+        factory("writer"),
+    )
+    monkeypatch.setattr(
+        dependencies,
+        "read_session_factory",
+        factory("reader"),
+    )
+    return served
+
+
+@pytest.fixture()
+async def client(served_by) -> AsyncClient:
+    async with AsyncClient(app=get_app(), base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.mark.asyncio
+async def test_read_following_own_write_is_served_by_the_writer(
+    client: AsyncClient,
+    served_by,
+    coupons_factory,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[0]
+    write = await client.post(f"/v1/coupons/{coupon.coupon_id}/deactivate")
+    served_by.clear()
+
+    # WHEN
+    response = await client.get(
+        f"/v1/coupons/{coupon.coupon_id}",
+        headers={LAST_WRITE_HEADER: write.headers[LAST_WRITE_HEADER]},
+    )
+
+    # THEN
+    assert write.status_code == status.HTTP_204_NO_CONTENT
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["active"] is False
+    assert served_by == ["writer"]
+
+
+@pytest.mark.asyncio
+async def test_read_of_other_clients_is_served_by_the_reader(
+    client: AsyncClient,
+    served_by,
+    coupons_factory,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[0]
+
+    # WHEN
+    response = await client.get(f"/v1/coupons/{coupon.coupon_id}")
+
+    # THEN
+    assert response.status_code == status.HTTP_200_OK
+    assert served_by == ["reader"]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_not_marked(client: AsyncClient):
+    # WHEN
+    response = await client.post("/v1/coupons/unknown/deactivate")
+
+    # THEN
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert LAST_WRITE_HEADER not in response.headers
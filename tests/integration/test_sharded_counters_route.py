@@ -0,0 +1,169 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.sql.expression import select
+
+from app.models.coupon import Coupon, CouponCounterShard
+
+
+async def get_coupon(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon_id)
+    )
+    return raw.scalar_one()
+
+
+async def get_counter_shards(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(CouponCounterShard)
+        .execution_options(populate_existing=True)
+        .where(CouponCounterShard.coupon_id == coupon_id)
+        .order_by(CouponCounterShard.shard)
+    )
+    return raw.scalars().all()
+
+
+def reserve_payload(transaction_id):
+    return {
+        "transaction_id": transaction_id,
+        "customer_key": f"customer{transaction_id}",
+        "purchase_amount": 100,
+        "first_purchase": True,
+    }
+
+
+@pytest.mark.asyncio
+async def test_should_shard_coupon_counters(
+    async_client: AsyncClient, coupons_factory, db_session
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    assert coupon.max_usage == 10
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/reserved",
+        json=reserve_payload("1"),
+    )
+
+    # WHEN
+    response = await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 4},
+    )
+
+    # THEN
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.counter_shards == 4
+    assert coupon_model.total_usage == 1
+
+    counter_shards = await get_counter_shards(db_session, coupon.coupon_id)
+    assert [shard.max_usage for shard in counter_shards] == [3, 2, 2, 2]
+    assert [shard.budget for shard in counter_shards] == [None] * 4
+
+
+@pytest.mark.asyncio
+async def test_should_not_oversubscribe_sharded_coupon(
+    async_client: AsyncClient, coupons_factory, db_session
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 3},
+    )
+
+    # WHEN
+    responses = [
+        await async_client.put(
+            f"/v1/coupons/{coupon.code}/reserved",
+            json=reserve_payload(str(index)),
+        )
+        for index in range(coupon.max_usage + 1)
+    ]
+
+    # THEN
+    assert [response.status_code for response in responses[:-1]] == [
+        status.HTTP_204_NO_CONTENT
+    ] * coupon.max_usage
+    assert responses[-1].status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert responses[-1].json()["error_code"] == "max_usage_reached"
+
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.reserved_usage == coupon.max_usage
+    assert coupon_model.accumulated_value == 100
+
+    counter_shards = await get_counter_shards(db_session, coupon.coupon_id)
+    assert [shard.reserved_count for shard in counter_shards] == [4, 3, 3]
+
+
+@pytest.mark.asyncio
+async def test_should_update_counter_shard_of_usage(
+    async_client: AsyncClient, coupons_factory, db_session
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 2},
+    )
+    for transaction_id in ("1", "2"):
+        await async_client.put(
+            f"/v1/coupons/{coupon.code}/reserved",
+            json=reserve_payload(transaction_id),
+        )
+
+    # WHEN
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/confirmed",
+        json={"transaction_id": "1"},
+    )
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/unreserved",
+        json={"transaction_id": "2"},
+    )
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert coupon_model.reserved_usage == 0
+    assert coupon_model.confirmed_usage == 1
+    assert coupon_model.accumulated_value == 10
+
+
+@pytest.mark.asyncio
+async def test_should_not_shard_coupon_counters_twice(
+    async_client: AsyncClient, coupons_factory
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[8]
+    await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 2},
+    )
+
+    # WHEN
+    response = await async_client.post(
+        f"/v1/coupons/{coupon.coupon_id}/sharded-counters",
+        json={"shards": 4},
+    )
+
+    # THEN
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["error_code"] == "coupon_counters_already_sharded"
+
+
+@pytest.mark.asyncio
+async def test_should_not_shard_counters_of_inexistent_coupon(
+    async_client: AsyncClient, db_session
+):
+    # WHEN
+    response = await async_client.post(
+        "/v1/coupons/WRONG_ID/sharded-counters",
+        json={"shards": 2},
+    )
+
+    # THEN
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -450,7 +450,7 @@ async def test_should_not_update_coupon_with_max_usage_less_than_coupon_usage(
 ):
     # GIVEN
     coupon: Coupon = coupons_factory[0]
-    coupon.max_usage = 1
+    coupon.max_usage = 2
     valid_until = datetime.now(timezone.utc)
 
     # WHEN
@@ -493,7 +493,7 @@ async def test_should_not_update_coupon_with_max_usage_less_than_coupon_usage(
     assert response1.status_code == status.HTTP_204_NO_CONTENT
     assert response2.status_code == status.HTTP_412_PRECONDITION_FAILED
 
-    assert coupon.max_usage == 1
+    assert coupon.max_usage == 2
 
 
 @pytest.mark.asyncio
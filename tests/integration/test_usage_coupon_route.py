@@ -42,10 +42,10 @@ async def test_should_reserve_coupon(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.reserved_usage == 1
 
@@ -76,10 +76,10 @@ async def test_should_reserve_coupon_with_code_in_lowercase(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.reserved_usage == 1
 
@@ -148,10 +148,10 @@ async def test_should_not_reserve_coupon_with_max_usage(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.reserved_usage == 1
 
@@ -171,10 +171,10 @@ async def test_should_not_reserve_coupon_with_max_usage(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.reserved_usage == 1
 
@@ -205,6 +205,7 @@ async def test_should_not_reserve_coupon_out_of_period(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
@@ -603,14 +604,13 @@ async def test_should_not_reserve_exceeded_budget_coupom(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon_id)
     )
     coupon_model = raw.scalar_one_or_none()
 
     assert coupon_model is not None
 
-    await db_session.refresh(coupon_model)
-
     first_accumulated_value = sum(
         [
             usage_history.discount_amount
@@ -635,6 +635,7 @@ async def test_should_not_reserve_exceeded_budget_coupom(
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon_id)
     )
 
@@ -642,8 +643,6 @@ async def test_should_not_reserve_exceeded_budget_coupom(
 
     assert coupon_model is not None
 
-    await db_session.refresh(coupon_model)
-
     second_accumulated_value = sum(
         [
             usage_history.discount_amount
@@ -680,11 +679,11 @@ async def test_should_reserve_coupon_and_ensure_that_after_any_reserve_the_total
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
 
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     accumulated_value = sum(
         [
@@ -712,11 +711,11 @@ async def test_should_reserve_coupon_and_ensure_that_after_any_reserve_the_total
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
 
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     accumulated_value = sum(
         [
@@ -743,11 +742,11 @@ async def test_should_reserve_coupon_and_ensure_that_after_any_reserve_the_total
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
 
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     accumulated_value = sum(
         [
@@ -1250,9 +1249,9 @@ async def test_should_not_raise_http_500_error_when_try_reserve_coupon_with_same
     raw = await db_session.execute(
         select(Coupon)
         .options(selectinload(Coupon.usage_histories))
+        .execution_options(populate_existing=True)
         .where(Coupon.coupon_id == coupon.coupon_id)
     )
     coupon_model = raw.scalar_one()
-    await db_session.refresh(coupon_model)
 
     assert coupon_model.reserved_usage == 1
@@ -0,0 +1,98 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import select
+
+from app.models.coupon import Coupon
+from app.services.utils.usage_write_coalescer import usage_write_coalescer
+
+
+@pytest.fixture()
+async def running_usage_write_coalescer(db_session):
+    usage_write_coalescer.start(
+        sessionmaker(
+            db_session.bind,
+            class_=AsyncSession,
+            expire_on_commit=False,
+        ),
+    )
+    yield usage_write_coalescer
+    await usage_write_coalescer.stop()
+
+
+def reserve_payload(transaction_id):
+    return {
+        "transaction_id": transaction_id,
+        "customer_key": f"customer{transaction_id}",
+        "purchase_amount": 100,
+        "first_purchase": True,
+    }
+
+
+@pytest.mark.asyncio
+async def test_should_write_usages_through_group_commit(
+    async_client: AsyncClient,
+    coupons_factory,
+    db_session,
+    running_usage_write_coalescer,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[0]
+    reserved = await async_client.put(
+        f"/v1/coupons/{coupon.code}/reserved",
+        json=reserve_payload("1"),
+    )
+
+    # WHEN
+    exceeded = await async_client.put(
+        f"/v1/coupons/{coupon.code}/reserved",
+        json=reserve_payload("2"),
+    )
+    confirmed = await async_client.put(
+        f"/v1/coupons/{coupon.code}/confirmed",
+        json={"transaction_id": "1"},
+    )
+    unreserved = await async_client.put(
+        f"/v1/coupons/{coupon.code}/unreserved",
+        json={"transaction_id": "1"},
+    )
+
+    # THEN
+    assert reserved.status_code == status.HTTP_204_NO_CONTENT
+    assert exceeded.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert confirmed.status_code == status.HTTP_204_NO_CONTENT
+    assert unreserved.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon.coupon_id)
+    )
+    coupon_model = raw.scalar_one()
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.confirmed_count == 1
+
+
+@pytest.mark.asyncio
+async def test_should_expose_flush_size_metrics(
+    async_client: AsyncClient,
+    coupons_factory,
+    running_usage_write_coalescer,
+):
+    # GIVEN
+    coupon: Coupon = coupons_factory[0]
+    await async_client.put(
+        f"/v1/coupons/{coupon.code}/reserved",
+        json=reserve_payload("1"),
+    )
+
+    # WHEN
+    response = await async_client.get("/metrics")
+
+    # THEN
+    assert response.status_code == status.HTTP_200_OK
+    flush_size = response.json()["usage_write_flush_size"]
+    assert flush_size["type"] == "histogram"
+    assert flush_size["count"] >= 1
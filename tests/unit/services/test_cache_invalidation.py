@@ -0,0 +1,119 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from app.repository.coupon_cache import (
+    CouponDefinition,
+    coupon_definition_cache,
+    coupon_negative_cache,
+)
+from app.services.utils.cache_invalidation import (
+    CacheInvalidationListener,
+    flush,
+    invalidation_flushes,
+    invalidation_messages,
+)
+
+
+def cache_definition(coupon_id, code):
+    now = datetime.now(timezone.utc)
+    coupon_definition_cache.put(
+        CouponDefinition(
+            coupon_id=coupon_id,
+            code=code,
+            customer_key=None,
+            type="percent",
+            value=Decimal(10),
+            max_amount=None,
+            min_purchase_amount=None,
+            valid_from=now,
+            valid_until=now + timedelta(hours=1),
+            first_purchase=False,
+        ),
+        "customer",
+        coupon_definition_cache.generation,
+    )
+
+
+def notify(listener, payload):
+    listener._on_notification(None, 1, "channel", payload)
+
+
+def test_evict_notified_coupon_only():
+    # GIVEN
+    listener = CacheInvalidationListener()
+    cache_definition("1", "ONE")
+    cache_definition("2", "TWO")
+    messages = invalidation_messages.value
+
+    # WHEN
+    notify(listener, json.dumps({"coupon_id": "1", "code": None}))
+
+    # THEN
+    assert invalidation_messages.value == messages + 1
+    assert coupon_definition_cache.get("ONE", "customer") is None
+    assert coupon_definition_cache.get("TWO", "customer") is not None
+
+
+def test_forget_codes_not_found_when_a_code_is_notified():
+    # GIVEN
+    listener = CacheInvalidationListener()
+    coupon_negative_cache.put(
+        "NEW",
+        "customer",
+        coupon_negative_cache.generation,
+    )
+
+    # WHEN
+    notify(listener, json.dumps({"coupon_id": None, "code": "NEW"}))
+    notify(listener, "not json")
+
+    # THEN
+    assert ("NEW", "customer") not in coupon_negative_cache
+
+
+def test_flush_every_cached_coupon():
+    # GIVEN
+    cache_definition("1", "ONE")
+    coupon_negative_cache.put(
+        "NEW",
+        "customer",
+        coupon_negative_cache.generation,
+    )
+
+    # WHEN
+    flush()
+
+    # THEN
+    assert len(coupon_definition_cache) == 0
+    assert len(coupon_negative_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_reconnect_and_flush_when_the_ping_times_out():
+    # GIVEN
+    connection = Mock(
+        add_listener=AsyncMock(),
+        fetchval=AsyncMock(side_effect=asyncio.TimeoutError),
+    )
+    listener = CacheInvalidationListener(dsn="postgresql://", ping_interval=0)
+    flushes = invalidation_flushes.value
+
+    # WHEN
+    with patch(
+        "app.services.utils.cache_invalidation.asyncpg.connect",
+        AsyncMock(return_value=connection),
+    ):
+        listener.start()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await listener.stop()
+
+    # THEN
+    assert invalidation_flushes.value >= flushes + 2
+    assert connection.terminate.call_count >= 2
+    assert not listener.running
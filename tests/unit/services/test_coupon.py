@@ -1,11 +1,35 @@
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from sqlalchemy.orm.attributes import set_committed_value
 
-from app.enums import CouponType
+from app.api.coupon.v1.schema import (
+    CouponInputWithManyCustomers,
+    CouponReservedInputSchema,
+)
+from app.api.helpers.exception import (
+    ExceedBudgetLimitException,
+    LimitPerCustomerException,
+    MaxUsageException,
+    TransactionIdException,
+)
+from app.enums import CouponType, UsageHistoryStatus
+from app.models.coupon import Coupon
+from app.repository.coupon import CouponRepository
 from app.services.coupon import CouponService
 
 
+def reserved_input(transaction_id, customer_key="customer1"):
+    return CouponReservedInputSchema(
+        transaction_id=transaction_id,
+        customer_key=customer_key,
+        purchase_amount=Decimal(100),
+        first_purchase=True,
+    )
+
+
 @pytest.mark.asyncio
 async def test_calculate_total_purchase_nominal_discount(db_session):
     # GIVEN
@@ -92,3 +116,193 @@ async def test_calculate_total_purchase_parcent_discount_with_max_amount(
 
     # THEN
     assert total_purchase == Decimal(990)
+
+
+@pytest.mark.asyncio
+async def test_add_reserved_updates_usage_counters(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_service = CouponService(db_session)
+
+    # WHEN
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake1"))
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake2"))
+
+    # THEN
+    coupon_model = await CouponRepository(db_session).get_by_id(
+        coupon.coupon_id,
+    )
+    assert coupon_model.reserved_usage == 2
+    assert coupon_model.accumulated_value == Decimal(20)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "coupon_limits, exception",
+    [
+        ({"max_usage": 1}, MaxUsageException),
+        ({"limit_per_customer": 1}, LimitPerCustomerException),
+        ({"budget": Decimal(15)}, ExceedBudgetLimitException),
+    ],
+)
+async def test_add_reserved_refused_by_coupon_limits(
+    coupons_factory,
+    db_session,
+    coupon_limits,
+    exception,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    for key, value in coupon_limits.items():
+        setattr(coupon, key, value)
+    await db_session.commit()
+    coupon_service = CouponService(db_session)
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake1"))
+
+    # WHEN
+    with pytest.raises(exception):
+        await coupon_service.add_reserved(
+            coupon.code,
+            reserved_input("fake2"),
+        )
+
+    # THEN
+    coupon_model = await CouponRepository(db_session).get_by_id(
+        coupon.coupon_id,
+    )
+    assert coupon_model.reserved_usage == 1
+    assert coupon_model.accumulated_value == Decimal(10)
+
+
+@pytest.mark.asyncio
+async def test_add_reserved_refused_by_transaction_id(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_service = CouponService(db_session)
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake1"))
+
+    # WHEN
+    with pytest.raises(TransactionIdException):
+        await coupon_service.add_reserved(
+            coupon.code,
+            reserved_input("fake1", customer_key="customer2"),
+        )
+
+    # THEN
+    coupon_model = await CouponRepository(db_session).get_by_id(
+        coupon.coupon_id,
+    )
+    assert coupon_model.reserved_usage == 1
+
+
+@pytest.mark.asyncio
+async def test_remove_reserved_twice_releases_the_usage_once(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_service = CouponService(db_session)
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake1"))
+    usage_history = await coupon_service.usage_history_repository.get_one(
+        transaction_id="fake1",
+        coupon_id=coupon.coupon_id,
+    )
+    await coupon_service.remove_reserved(coupon.code, "fake1")
+
+    # WHEN
+    with patch.object(
+        coupon_service.usage_history_repository,
+        "get_by_coupon_code_transaction",
+        AsyncMock(return_value=usage_history),
+    ):
+        await coupon_service.remove_reserved(coupon.code, "fake1")
+
+    # THEN
+    coupon_model = await CouponRepository(db_session).get_by_id(
+        coupon.coupon_id,
+    )
+    assert coupon_model.reserved_usage == 0
+    assert coupon_model.accumulated_value == Decimal(0)
+
+
+@pytest.mark.asyncio
+async def test_add_confirmed_twice_confirms_the_usage_once(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_service = CouponService(db_session)
+    await coupon_service.add_reserved(coupon.code, reserved_input("fake1"))
+    await coupon_service.coupon_repository.confirm_usages(
+        coupon.coupon_id,
+        ["fake1"],
+    )
+    usage_history = await coupon_service.usage_history_repository.get_one(
+        transaction_id="fake1",
+        coupon_id=coupon.coupon_id,
+    )
+    set_committed_value(usage_history, "status", UsageHistoryStatus.RESERVED)
+
+    # WHEN
+    with patch.object(
+        coupon_service.usage_history_repository,
+        "get_by_coupon_code_transaction",
+        AsyncMock(return_value=usage_history),
+    ):
+        await coupon_service.add_confirmed(coupon.code, "fake1")
+
+    # THEN
+    coupon_model = await CouponRepository(db_session).get_by_id(
+        coupon.coupon_id,
+    )
+    assert coupon_model.reserved_usage == 0
+    assert coupon_model.confirmed_usage == 1
+
+
+@pytest.mark.asyncio
+async def test_skip_taken_and_repeated_customer_keys_of_a_batch(db_session):
+    # GIVEN
+    valid_from = datetime.now(timezone.utc)
+    valid_until = valid_from + timedelta(hours=1)
+    data = CouponInputWithManyCustomers(
+        code="BULK10",
+        valid_from=valid_from,
+        valid_until=valid_until,
+        type=CouponType.PERCENT,
+        value=Decimal(10),
+        user_create="Test",
+    )
+    db_session.add(
+        Coupon(
+            code="BULK10",
+            customer_key="customer2",
+            valid_from=valid_from,
+            valid_until=valid_until,
+            type="percent",
+            value=Decimal(10),
+            user_create="Test",
+        ),
+    )
+    await db_session.flush()
+
+    # WHEN
+    coupons, skipped = await CouponService(db_session).create_coupon_models(
+        data,
+        ["customer1", "customer2", "customer3", "customer1"],
+    )
+
+    # THEN
+    assert [coupon.customer_key for coupon in coupons] == [
+        "customer1",
+        "customer3",
+    ]
+    assert all(coupon.code == "BULK10" for coupon in coupons)
+    assert skipped == ["customer2", "customer1"]
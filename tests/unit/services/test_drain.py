@@ -0,0 +1,67 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI, status
+from httpx import AsyncClient
+
+from app.metrics import metrics
+from app.services.utils.drain import Drain, drain
+
+
+@pytest.mark.asyncio
+async def test_wait_for_in_flight_tasks_before_deadline():
+    # GIVEN
+    draining = Drain(timeout=1)
+    task = asyncio.create_task(asyncio.sleep(0.01, result="done"))
+    draining.track(task)
+
+    # WHEN
+    drained = await draining.wait()
+    draining.finish()
+
+    # THEN
+    assert drained is True
+    assert task.result() == "done"
+    assert 0 < metrics.snapshot()["drain_duration_seconds"]["value"] < 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_tasks_at_the_drain_deadline():
+    # GIVEN
+    draining = Drain(timeout=0.01)
+    task = asyncio.create_task(asyncio.sleep(10))
+    draining.track(task)
+
+    # WHEN
+    drained = await draining.wait()
+    with patch("app.services.utils.drain.logger") as logger:
+        draining.finish()
+
+    # THEN
+    assert drained is False
+    assert task.cancelled()
+    logger.bind.assert_called_once()
+    assert logger.bind.call_args.kwargs["drain_abandoned"] == 1
+
+
+@pytest.mark.asyncio
+async def test_refuse_requests_while_draining(app: FastAPI):
+    # GIVEN
+    drain.start()
+
+    # WHEN
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/health/ready")
+            live = await client.get("/health/live")
+            metrics_response = await client.get("/metrics")
+    finally:
+        drain.reset()
+
+    # THEN
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["connection"] == "close"
+    assert live.status_code == status.HTTP_200_OK
+    assert metrics_response.status_code == status.HTTP_200_OK
+    assert "drain_in_flight" in metrics_response.json()
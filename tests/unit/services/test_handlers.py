@@ -0,0 +1,51 @@
+import pytest
+
+from app.services.handlers import parse_customer_keys, shard_chunks
+
+
+async def chunks(*values: bytes):
+    for value in values:
+        yield value
+
+
+@pytest.mark.asyncio
+async def test_parse_customer_keys_split_across_chunks():
+    # GIVEN
+    file = chunks(
+        b"\xef\xbb\xbfcustomer1\r\ncust",
+        b"omer2,ignored\r",
+        b"\n\ncustomer\xc3",
+        b"\xa73",
+    )
+
+    # WHEN
+    customer_keys = [key async for key in parse_customer_keys(file)]
+
+    # THEN
+    assert customer_keys == ["customer1", "customer2", "customerç3"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shard_size", [1, 3, 7, 10, 64])
+async def test_shard_chunks_cut_whole_lines(shard_size):
+    # GIVEN
+    content = b"a\nbb\nccc\n\ndddddddd\r\ne\nfff"
+    offsets = list(range(0, len(content), shard_size)) + [len(content)]
+
+    # WHEN
+    shards = []
+    for start, end in zip(offsets, offsets[1:]):
+        begin = max(start - 1, 0)
+        file = chunks(
+            *[content[i:i + 4] for i in range(begin, len(content), 4)],
+        )
+        shard = [chunk async for chunk in shard_chunks(file, start, end)]
+        await file.aclose()
+        shards.append(b"".join(shard))
+
+    # THEN
+    assert b"".join(shards) == content
+    offset = 0
+    for shard in filter(None, shards):
+        assert offset == 0 or content[offset - 1:offset] == b"\n"
+        offset += len(shard)
@@ -0,0 +1,159 @@
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.models.coupon import Coupon, CouponLease
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_lease import CouponLeaseRepository
+from app.services.utils.quota_lease import QuotaLeaseManager
+
+
+@pytest.fixture()
+async def quota_lease_manager(db_session):
+    manager = QuotaLeaseManager(
+        usage=4,
+        budget=Decimal(20),
+        ttl=60,
+        refill_ratio=0.25,
+    )
+    manager.start(
+        sessionmaker(
+            db_session.bind,
+            class_=AsyncSession,
+            expire_on_commit=False,
+        ),
+    )
+    yield manager
+    await manager.stop()
+
+
+async def get_leases(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(CouponLease)
+        .execution_options(populate_existing=True)
+        .where(CouponLease.coupon_id == coupon_id)
+    )
+    return raw.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_take_from_lease_in_memory(
+    coupons_factory, db_session, quota_lease_manager
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+
+    # WHEN
+    lease_ids = [
+        await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+        for _ in range(2)
+    ]
+
+    # THEN
+    leases = await get_leases(db_session, coupon.coupon_id)
+    assert len(leases) == 1
+    assert lease_ids == [str(leases[0].id)] * 2
+    assert leases[0].max_usage == 4
+    assert leases[0].owner == quota_lease_manager.owner
+
+
+@pytest.mark.asyncio
+async def test_take_refused_when_quota_exhausted(
+    coupons_factory, db_session, quota_lease_manager
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+
+    # WHEN
+    lease_ids = [
+        await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+        for _ in range(11)
+    ]
+
+    # THEN
+    leases = await get_leases(db_session, coupon.coupon_id)
+    assert lease_ids[:10] == [str(leases[0].id)] * 10
+    assert lease_ids[10] is None
+    assert leases[0].max_usage == 10
+
+
+@pytest.mark.asyncio
+async def test_stop_gives_leases_back(
+    coupons_factory, db_session, quota_lease_manager
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+    await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+
+    # WHEN
+    await quota_lease_manager.stop()
+
+    # THEN
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon.coupon_id)
+    )
+    assert await get_leases(db_session, coupon.coupon_id) == []
+    assert raw.scalar_one().leased_usage == 0
+    assert quota_lease_manager.running is False
+
+
+@pytest.mark.asyncio
+async def test_renew_gives_idle_leases_back(
+    coupons_factory, db_session, quota_lease_manager
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+    await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+
+    # WHEN
+    await quota_lease_manager.renew()
+    leases_after_use = await get_leases(db_session, coupon.coupon_id)
+    await quota_lease_manager.renew()
+
+    # THEN
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon.coupon_id)
+    )
+    coupon_model = raw.scalar_one()
+    assert len(leases_after_use) == 1
+    assert await get_leases(db_session, coupon.coupon_id) == []
+    assert coupon_model.leased_usage == 0
+    assert coupon_model.reserved_count == 0
+
+
+@pytest.mark.asyncio
+async def test_take_does_not_lease_again_when_quota_exhausted(
+    coupons_factory, db_session, quota_lease_manager
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+    for _ in range(11):
+        await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+
+    # WHEN
+    with patch.object(
+        CouponLeaseRepository,
+        "acquire",
+        wraps=CouponLeaseRepository.acquire,
+    ) as acquire:
+        lease_ids = [
+            await quota_lease_manager.take(coupon.coupon_id, Decimal(1))
+            for _ in range(5)
+        ]
+
+    # THEN
+    assert lease_ids == [None] * 5
+    acquire.assert_not_called()
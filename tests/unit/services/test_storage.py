@@ -1,3 +1,4 @@
+from io import BytesIO
 from unittest.mock import patch
 
 import pytest
@@ -14,3 +15,73 @@ async def test_upload_file_obj(mock_client):
     file_key = storage_service.upload_file_obj("file.csv")
 
     assert file_key is not None
+
+
+@pytest.mark.asyncio
+@patch("app.services.storage.PART_SIZE", 4)
+@patch("boto3.Session.client")
+async def test_upload_file_in_parts(mock_client):
+    # GIVEN
+    s3_client = mock_client.return_value
+    s3_client.create_multipart_upload.return_value = {"UploadId": "upload"}
+    s3_client.upload_part.side_effect = [
+        {"ETag": "1"},
+        {"ETag": "2"},
+        {"ETag": "3"},
+    ]
+    upload = StorageAWSService().create_upload()
+
+    # WHEN
+    for chunk in [b"cust", b"omer", b"1"]:
+        await upload.write(chunk)
+    await upload.complete()
+
+    # THEN
+    assert upload.completed is True
+    assert [
+        call.kwargs["Body"] for call in s3_client.upload_part.mock_calls
+    ] == [b"cust", b"omer", b"1"]
+    parts = s3_client.complete_multipart_upload.call_args.kwargs[
+        "MultipartUpload"
+    ]["Parts"]
+    assert [part["PartNumber"] for part in parts] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+@patch("boto3.Session.client")
+async def test_download_file_in_chunks(mock_client):
+    # GIVEN
+    body = BytesIO(b"customer1\ncustomer2\n")
+    mock_client.return_value.get_object.return_value = {"Body": body}
+
+    # WHEN
+    chunks = [
+        chunk
+        async for chunk in StorageAWSService().download_chunks("key", 8)
+    ]
+
+    # THEN
+    assert chunks == [b"customer", b"1\ncustom", b"er2\n"]
+    assert body.closed
+
+
+@pytest.mark.asyncio
+@patch("boto3.Session.client")
+async def test_download_file_from_offset(mock_client):
+    # GIVEN
+    s3_client = mock_client.return_value
+    s3_client.get_object.return_value = {"Body": BytesIO(b"customer2\n")}
+    s3_client.head_object.return_value = {"ContentLength": 20}
+    storage_service = StorageAWSService()
+
+    # WHEN
+    size = await storage_service.file_size("key")
+    chunks = [
+        chunk
+        async for chunk in storage_service.download_chunks("key", 64, 10)
+    ]
+
+    # THEN
+    assert size == 20
+    assert chunks == [b"customer2\n"]
+    assert s3_client.get_object.call_args.kwargs["Range"] == "bytes=10-"
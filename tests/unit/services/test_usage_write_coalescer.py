@@ -0,0 +1,212 @@
+import asyncio
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.api.helpers.exception import CouponAlreadyConfirmed
+from app.models.coupon import Coupon, UsageHistory
+from app.repository.coupon import CouponRepository
+from app.services.utils.usage_write_coalescer import (
+    UsageWriteCoalescer,
+    flush_size,
+)
+
+
+def start_coalescer(db_session, **options):
+    coalescer = UsageWriteCoalescer(**options)
+    coalescer.start(
+        sessionmaker(
+            db_session.bind,
+            class_=AsyncSession,
+            expire_on_commit=False,
+        ),
+    )
+    return coalescer
+
+
+async def get_coupon(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon_id)
+    )
+    return raw.scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_reserve_concurrent_usages_in_one_flush(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coalescer = start_coalescer(db_session, window_ms=5, max_size=100)
+    flushes = flush_size.count
+
+    # WHEN
+    reserved = await asyncio.gather(
+        *[
+            coalescer.reserve(
+                coupon,
+                str(index),
+                f"customer{index}",
+                Decimal(10),
+            )
+            for index in range(12)
+        ],
+    )
+    await coalescer.stop()
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert reserved == [True] * 10 + [False] * 2
+    assert flush_size.count == flushes + 1
+    assert coupon_model.reserved_count == 10
+    assert coupon_model.accumulated_discount == Decimal(100)
+
+
+@pytest.mark.asyncio
+async def test_refuse_batched_duplicates_and_customer_limit(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.limit_per_customer = 1
+    await db_session.commit()
+    coalescer = start_coalescer(db_session, window_ms=5, max_size=100)
+
+    # WHEN
+    reserved = await asyncio.gather(
+        coalescer.reserve(coupon, "1", "customer1", Decimal(10)),
+        coalescer.reserve(coupon, "1", "customer2", Decimal(10)),
+        coalescer.reserve(coupon, "2", "customer1", Decimal(10)),
+        coalescer.reserve(coupon, "3", "customer3", Decimal(10)),
+    )
+    await coalescer.stop()
+
+    # THEN
+    assert reserved == [True, False, False, True]
+
+
+@pytest.mark.asyncio
+async def test_resolve_each_write_with_its_own_result(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coalescer = start_coalescer(db_session, window_ms=5, max_size=100)
+    await asyncio.gather(
+        coalescer.reserve(coupon, "1", "customer1", Decimal(10)),
+        coalescer.reserve(coupon, "2", "customer2", Decimal(10)),
+    )
+
+    # WHEN
+    results = await asyncio.gather(
+        coalescer.confirm(coupon.coupon_id, "1"),
+        coalescer.release(coupon.coupon_id, "2"),
+        coalescer.release(coupon.coupon_id, "1"),
+        return_exceptions=True,
+    )
+    await coalescer.stop()
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    raw = await db_session.execute(
+        select(UsageHistory.transaction_id).where(
+            UsageHistory.coupon_id == coupon.coupon_id
+        )
+    )
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], CouponAlreadyConfirmed)
+    assert raw.scalars().all() == ["1"]
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.confirmed_count == 1
+    assert coupon_model.accumulated_discount == Decimal(10)
+
+
+@pytest.mark.asyncio
+async def test_flush_full_batch_before_window(coupons_factory, db_session):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coalescer = start_coalescer(db_session, window_ms=60000, max_size=2)
+
+    # WHEN
+    reserved = await asyncio.wait_for(
+        asyncio.gather(
+            coalescer.reserve(coupon, "1", "customer1", Decimal(10)),
+            coalescer.reserve(coupon, "2", "customer2", Decimal(10)),
+        ),
+        timeout=5,
+    )
+    await coalescer.stop()
+
+    # THEN
+    assert reserved == [True, True]
+
+
+@pytest.mark.asyncio
+async def test_resolve_writes_queued_after_a_cancelled_one(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coalescer = start_coalescer(db_session, window_ms=5, max_size=100)
+    await asyncio.gather(
+        coalescer.reserve(coupon, "1", "customer1", Decimal(10)),
+        coalescer.reserve(coupon, "2", "customer2", Decimal(10)),
+    )
+    cancelled = asyncio.create_task(coalescer.confirm(coupon.coupon_id, "1"))
+    await asyncio.sleep(0)
+
+    # WHEN
+    confirmed = asyncio.create_task(coalescer.confirm(coupon.coupon_id, "2"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.wait_for(confirmed, timeout=5)
+    await coalescer.stop()
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert cancelled.cancelled()
+    assert coupon_model.confirmed_count == 2
+
+
+@pytest.mark.asyncio
+async def test_fail_only_the_writes_of_the_failing_coupon(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon, other_coupon = coupons_factory[8], coupons_factory[9]
+    coalescer = start_coalescer(db_session, window_ms=5, max_size=100)
+    await asyncio.gather(
+        coalescer.reserve(coupon, "1", "customer1", Decimal(10)),
+        coalescer.reserve(other_coupon, "1", "customer1", Decimal(10)),
+    )
+    confirm_usages = CouponRepository.confirm_usages
+
+    async def fail_for_coupon(repository, coupon_id, transaction_ids):
+        await confirm_usages(repository, coupon_id, transaction_ids)
+        if coupon_id == coupon.coupon_id:
+            raise NoResultFound("CouponCounterShard not found")
+
+    # WHEN
+    with patch.object(CouponRepository, "confirm_usages", fail_for_coupon):
+        results = await asyncio.gather(
+            coalescer.confirm(coupon.coupon_id, "1"),
+            coalescer.confirm(other_coupon.coupon_id, "1"),
+            return_exceptions=True,
+        )
+    await coalescer.stop()
+
+    # THEN
+    assert isinstance(results[0], NoResultFound)
+    assert results[1] is None
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    other_coupon_model = await get_coupon(db_session, other_coupon.coupon_id)
+    assert coupon_model.confirmed_count == 0
+    assert coupon_model.reserved_count == 1
+    assert other_coupon_model.confirmed_count == 1
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.models.coupon import Coupon
+from app.repository.coupon_cache import coupon_definition_cache
+from app.services.utils.warm_up import WarmUp
+
+
+@pytest.fixture()
+async def engine(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'coupon.sqlite3'}",
+    )
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        for coupon_id, code, confirmed_count in [
+            ("1", "LESSUSED", 1),
+            ("2", "MOSTUSED", 5),
+        ]:
+            await connection.execute(
+                Coupon.__table__.insert().values(
+                    coupon_id=coupon_id,
+                    description="coupon",
+                    code=code,
+                    valid_from=datetime.now(timezone.utc),
+                    valid_until=datetime.now(timezone.utc)
+                    + timedelta(hours=1),
+                    type="percent",
+                    value=Decimal(10),
+                    user_create="Test",
+                    confirmed_count=confirmed_count,
+                ),
+            )
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_before_reporting_ready(engine):
+    # GIVEN
+    warm_up = WarmUp(connections=2, prefetch_coupons=1)
+    session_factory = sessionmaker(
+        engine,
+        expire_on_commit=False,
+        class_=AsyncSession,
+    )
+
+    # WHEN
+    warm_up.start([engine], session_factory)
+    ready_before = warm_up.ready
+    await warm_up._task
+
+    # THEN
+    assert ready_before is False
+    assert warm_up.ready is True
+    assert len(engine.sync_engine._compiled_cache) > 0
+    assert coupon_definition_cache.get("MOSTUSED", "customer") is not None
+    assert coupon_definition_cache.get("LESSUSED", "customer") is None
@@ -0,0 +1,29 @@
+import pytest
+
+from app.db.compiled_cache import instrument_compiled_cache
+from app.metrics import metrics
+from app.repository.coupon import CouponRepository
+
+
+def count(outcome: str, source: str) -> int:
+    name = f"sql_compiled_cache_{outcome}.{source}"
+    return metrics.snapshot().get(name, {}).get("value", 0)
+
+
+@pytest.mark.asyncio
+async def test_reuse_compiled_statements_of_coupon_ids(
+    coupons_factory, db_session
+):
+    # GIVEN
+    instrument_compiled_cache(db_session.bind.engine)
+    coupon_repository = CouponRepository(db_session)
+    source = "CouponRepository.get_by_id"
+    await coupon_repository.get_by_id(coupons_factory[0].coupon_id)
+    hits = count("hits", source)
+
+    # WHEN
+    await coupon_repository.get_by_id(coupons_factory[1].coupon_id)
+
+    # THEN
+    assert count("hits", source) == hits + 1
+    assert count("uncached", source) == 0
@@ -1,10 +1,13 @@
+from decimal import Decimal
+
 import pytest
 import pytz
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
 from app.api.coupon.v1.schema import CouponSchema, CouponSchemaBase
-from app.models.coupon import Coupon
+from app.models.coupon import Coupon, CouponCounterShard, UsageHistory
+from app.repository.coupon import CouponRepository
 from app.settings import settings
 
 
@@ -110,3 +113,219 @@ async def test_coupon_output_timezone(coupons_factory, db_session):
 
     assert coupon_schema.valid_from.tzinfo.zone == settings.timezone
     assert coupon_schema.valid_until.tzinfo.zone == settings.timezone
+
+
+@pytest.mark.asyncio
+async def test_get_valid_coupon_with_usage_counters(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    for index, customer_key in enumerate(["customer1", "customer1", "other"]):
+        db_session.add(
+            UsageHistory(
+                transaction_id=f"fake{index}",
+                customer_key=customer_key,
+                discount_amount=Decimal("2.50"),
+                coupon_id=coupon.coupon_id,
+            ),
+        )
+    coupon.reserved_count = 2
+    coupon.confirmed_count = 1
+    coupon.accumulated_discount = Decimal("7.50")
+    await db_session.commit()
+
+    # WHEN
+    coupon_model, coupon_usage = await CouponRepository(
+        db_session,
+    ).get_valid_coupon(coupon.code, "customer1", True, Decimal(100))
+
+    # THEN
+    assert coupon_model.coupon_id == coupon.coupon_id
+    assert coupon_usage.total_usage == 3
+    assert coupon_usage.customer_usage == 2
+    assert coupon_usage.accumulated_value == Decimal("7.50")
+
+
+@pytest.mark.asyncio
+async def test_get_valid_coupon_without_usage(coupons_factory, db_session):
+    # GIVEN
+    coupon = coupons_factory[8]
+
+    # WHEN
+    _, coupon_usage = await CouponRepository(db_session).get_valid_coupon(
+        coupon.code,
+        "customer1",
+        True,
+        Decimal(100),
+    )
+
+    # THEN
+    assert coupon_usage.total_usage == 0
+    assert coupon_usage.customer_usage == 0
+    assert coupon_usage.accumulated_value == Decimal(0)
+
+
+@pytest.mark.asyncio
+async def test_update_usage_counters(coupons_factory, db_session):
+    # GIVEN
+    coupon = coupons_factory[0]
+    coupon_repository = CouponRepository(db_session)
+
+    # WHEN
+    await coupon_repository.update_usage_counters(
+        coupon.coupon_id,
+        reserved=2,
+        discount_amount=Decimal("10.50"),
+    )
+    await coupon_repository.update_usage_counters(
+        coupon.coupon_id,
+        reserved=-1,
+        confirmed=1,
+    )
+
+    # THEN
+    coupon_model = await coupon_repository.get_by_id(coupon.coupon_id)
+    assert coupon_model.reserved_usage == 1
+    assert coupon_model.confirmed_usage == 1
+    assert coupon_model.total_usage == 2
+    assert coupon_model.accumulated_value == Decimal("10.50")
+
+
+@pytest.mark.asyncio
+async def test_repair_usage_counters_drift(
+    coupons_factory,
+    usage_histories_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[0]
+    coupon.reserved_count = 0
+    coupon.accumulated_discount = Decimal(0)
+    await db_session.commit()
+    coupon_repository = CouponRepository(db_session)
+
+    # WHEN
+    drift, last_coupon_id = await coupon_repository.get_usage_counters_drift()
+    repaired = await coupon_repository.repair_usage_counters(
+        [coupon_drift.coupon_id for coupon_drift in drift],
+    )
+    after_repair, _ = await coupon_repository.get_usage_counters_drift()
+
+    # THEN
+    assert [coupon_drift.coupon_id for coupon_drift in drift] == [
+        coupon.coupon_id,
+    ]
+    assert drift[0].expected_reserved == 2
+    assert drift[0].expected_accumulated == Decimal("8001.12")
+    assert last_coupon_id == max(c.coupon_id for c in coupons_factory)
+    assert repaired == 1
+    assert after_repair == []
+    coupon_model = await coupon_repository.get_by_id(coupon.coupon_id)
+    assert coupon_model.reserved_usage == 2
+    assert coupon_model.accumulated_value == Decimal("8001.12")
+
+
+@pytest.mark.asyncio
+async def test_enable_counter_shards_splits_budget(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.budget = Decimal(100)
+    coupon.accumulated_discount = Decimal("0.01")
+    await db_session.commit()
+    coupon_repository = CouponRepository(db_session)
+
+    # WHEN
+    already_sharded = await coupon_repository.enable_counter_shards(
+        coupon.coupon_id,
+        3,
+    )
+
+    # THEN
+    raw = await db_session.execute(
+        select(CouponCounterShard)
+        .where(CouponCounterShard.coupon_id == coupon.coupon_id)
+        .order_by(CouponCounterShard.shard),
+    )
+    counter_shards = raw.scalars().all()
+    assert already_sharded is False
+    assert [shard.budget for shard in counter_shards] == [
+        Decimal("33.33"),
+        Decimal("33.33"),
+        Decimal("33.33"),
+    ]
+    assert [shard.max_usage for shard in counter_shards] == [4, 3, 3]
+
+
+@pytest.mark.asyncio
+async def test_repair_counter_shards_drift(coupons_factory, db_session):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_repository = CouponRepository(db_session)
+    await coupon_repository.enable_counter_shards(coupon.coupon_id, 2)
+    db_session.add(
+        UsageHistory(
+            transaction_id="fake",
+            customer_key="customer1",
+            discount_amount=Decimal("2.50"),
+            coupon_id=coupon.coupon_id,
+            counter_shard=1,
+        ),
+    )
+    await db_session.commit()
+
+    # WHEN
+    drift, _ = await coupon_repository.get_usage_counters_drift()
+    await coupon_repository.repair_usage_counters(
+        [coupon_drift.coupon_id for coupon_drift in drift],
+    )
+    after_repair, _ = await coupon_repository.get_usage_counters_drift()
+
+    # THEN
+    assert [(d.coupon_id, d.shard) for d in drift] == [(coupon.coupon_id, 1)]
+    assert after_repair == []
+    coupon_model = await coupon_repository.get_by_id(coupon.coupon_id)
+    assert coupon_model.reserved_count == 0
+    assert coupon_model.reserved_usage == 1
+    assert coupon_model.accumulated_value == Decimal("2.50")
+
+
+@pytest.mark.asyncio
+async def test_reserve_discount_bigger_than_any_shard_budget(
+    coupons_factory,
+    db_session,
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.budget = Decimal(15)
+    await db_session.commit()
+    coupon_repository = CouponRepository(db_session)
+    await coupon_repository.enable_counter_shards(coupon.coupon_id, 2)
+
+    # WHEN
+    reserved = [
+        await coupon_repository.reserve_usage(
+            coupon,
+            transaction_id,
+            "customer1",
+            Decimal(10),
+        )
+        for transaction_id in ("fake1", "fake2")
+    ]
+
+    # THEN
+    assert reserved == [True, False]
+    raw = await db_session.execute(
+        select(CouponCounterShard)
+        .where(CouponCounterShard.coupon_id == coupon.coupon_id)
+        .order_by(CouponCounterShard.shard)
+        .execution_options(populate_existing=True),
+    )
+    counter_shards = raw.scalars().all()
+    assert sum(shard.budget for shard in counter_shards) == Decimal(15)
+    assert sum(
+        shard.accumulated_discount for shard in counter_shards
+    ) == Decimal(10)
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.exc import NoResultFound
+
+from app.api.helpers.exception import FirstPurchaseException
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_cache import (
+    CouponDefinition,
+    CouponDefinitionCache,
+    cache_hits,
+    coupon_definition_cache,
+)
+from app.services.coupon import CouponService
+
+
+def definition(coupon_id, code, valid_for=timedelta(hours=1)):
+    now = datetime.now(timezone.utc)
+    return CouponDefinition(
+        coupon_id=coupon_id,
+        code=code,
+        customer_key=None,
+        type="percent",
+        value=Decimal(10),
+        max_amount=None,
+        min_purchase_amount=None,
+        valid_from=now,
+        valid_until=now + valid_for,
+        first_purchase=False,
+    )
+
+
+def test_evict_least_recently_used_definition():
+    cache = CouponDefinitionCache(max_entries=2, ttl=60)
+    cache.put(definition("1", "ONE"), "customer", cache.generation)
+    cache.put(definition("2", "TWO"), "customer", cache.generation)
+
+    cache.get("one", "customer")
+    cache.put(definition("3", "THREE"), "customer", cache.generation)
+
+    assert cache.get("ONE", "customer").coupon_id == "1"
+    assert cache.get("TWO", "customer") is None
+    assert cache.get("THREE", "customer").coupon_id == "3"
+
+
+def test_expire_definition_with_coupon_validity():
+    cache = CouponDefinitionCache(max_entries=10, ttl=60)
+
+    cache.put(
+        definition("1", "ONE", valid_for=timedelta(seconds=-1)),
+        "customer",
+        cache.generation,
+    )
+
+    assert cache.get("ONE", "customer") is None
+
+
+def test_discard_definition_read_before_invalidation():
+    cache = CouponDefinitionCache(max_entries=10, ttl=60)
+    generation = cache.generation
+
+    cache.invalidate("1")
+    cache.put(definition("1", "ONE"), "customer", generation)
+
+    assert cache.get("ONE", "customer") is None
+
+
+@pytest.mark.asyncio
+async def test_get_valid_coupon_from_cached_definition(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.first_purchase = True
+    await db_session.commit()
+    coupon_repository = CouponRepository(db_session)
+    await coupon_repository.get_valid_coupon(
+        coupon.code, "customer", True, Decimal(100)
+    )
+    hits = cache_hits.value
+
+    # WHEN
+    coupon_model, coupon_usage = await coupon_repository.get_valid_coupon(
+        coupon.code, "customer", True, Decimal(100)
+    )
+
+    # THEN
+    assert cache_hits.value == hits + 1
+    assert coupon_model.coupon_id == coupon.coupon_id
+    assert coupon_usage.total_usage == 0
+    with pytest.raises(FirstPurchaseException):
+        await coupon_repository.get_valid_coupon(
+            coupon.code, "customer", False, Decimal(100)
+        )
+
+
+@pytest.mark.asyncio
+async def test_invalidate_definition_of_deactivated_coupon(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_repository = CouponRepository(db_session)
+    await coupon_repository.get_valid_coupon(
+        coupon.code, "customer", False, Decimal(100)
+    )
+
+    # WHEN
+    await CouponService(db_session).deactivate_coupon(coupon.coupon_id)
+
+    # THEN
+    assert coupon_definition_cache.get(coupon.code, "customer") is None
+    with pytest.raises(NoResultFound):
+        await coupon_repository.get_valid_coupon(
+            coupon.code, "customer", False, Decimal(100)
+        )
+
+
+@pytest.mark.asyncio
+async def test_cache_public_coupon_once_for_every_customer(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_repository = CouponRepository(db_session)
+    coupon_definition_cache.clear()
+    await coupon_repository.get_valid_coupon(
+        coupon.code, "customer1", False, Decimal(100)
+    )
+    hits = cache_hits.value
+
+    # WHEN
+    coupon_model, coupon_usage = await coupon_repository.get_valid_coupon(
+        coupon.code, "customer2", False, Decimal(100)
+    )
+
+    # THEN
+    assert cache_hits.value == hits + 1
+    assert len(coupon_definition_cache) == 1
+    assert isinstance(coupon_model, CouponDefinition)
+    assert coupon_model.max_usage == coupon.max_usage
+    assert coupon_usage.customer_usage == 0
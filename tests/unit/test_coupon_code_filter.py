@@ -0,0 +1,138 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.models.coupon import Coupon
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_cache import negative_cache_hits
+from app.repository.coupon_code_filter import (
+    BloomFilter,
+    CouponCodeFilter,
+    coupon_code_filter,
+    filter_false_positives,
+    filter_rejections,
+)
+
+
+def session_factory(db_session):
+    return sessionmaker(
+        db_session.bind,
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+
+
+@pytest.fixture()
+async def built_coupon_code_filter(coupons_factory, db_session):
+    coupon_code_filter._session_factory = session_factory(db_session)
+    await coupon_code_filter.build()
+    yield coupon_code_filter
+    coupon_code_filter.clear()
+    coupon_code_filter._session_factory = None
+
+
+def test_keep_false_positives_near_error_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for index in range(1000):
+        bloom.add(f"CODE{index}")
+
+    false_positives = sum(f"OTHER{index}" in bloom for index in range(10000))
+
+    assert all(f"CODE{index}" in bloom for index in range(1000))
+    assert false_positives < 300
+    assert bloom.error_rate == pytest.approx(0.01, rel=0.2)
+
+
+@pytest.mark.asyncio
+async def test_refresh_adds_coupons_created_since_build(
+    coupons_factory, db_session
+):
+    # GIVEN
+    code_filter = CouponCodeFilter(capacity=100, error_rate=0.01)
+    code_filter._session_factory = session_factory(db_session)
+    await code_filter.build()
+    db_session.add(Coupon(code="NEWCODE", type="percent", value=10))
+    await db_session.commit()
+
+    # WHEN
+    before = code_filter.might_contain("NEWCODE")
+    await code_filter.refresh()
+
+    # THEN
+    assert all(
+        code_filter.might_contain(coupon.code) for coupon in coupons_factory
+    )
+    assert not before
+    assert code_filter.might_contain("NEWCODE")
+
+
+@pytest.mark.asyncio
+async def test_build_keeps_codes_of_deleted_coupons(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.active = False
+    coupon.delete_at = datetime.now()
+    await db_session.commit()
+    code_filter = CouponCodeFilter(capacity=100, error_rate=0.01)
+    code_filter._session_factory = session_factory(db_session)
+
+    # WHEN
+    await code_filter.build()
+    await CouponRepository(db_session).activate_coupon(coupon.coupon_id)
+
+    # THEN
+    assert code_filter.might_contain(coupon.code)
+
+
+@pytest.mark.asyncio
+async def test_reject_unknown_code_without_query(
+    built_coupon_code_filter, db_session
+):
+    # GIVEN
+    rejections = filter_rejections.value
+    coupon_repository = CouponRepository(db_session)
+
+    # WHEN
+    with pytest.raises(NoResultFound):
+        await coupon_repository.get_valid_coupon(
+            "UNKNOWN",
+            "customer",
+            False,
+            Decimal(100),
+        )
+
+    # THEN
+    assert filter_rejections.value == rejections + 1
+
+
+@pytest.mark.asyncio
+async def test_cache_code_not_found_for_customer(
+    built_coupon_code_filter, coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.active = False
+    await db_session.commit()
+    coupon_repository = CouponRepository(db_session)
+    false_positives = filter_false_positives.value
+    hits = negative_cache_hits.value
+
+    # WHEN
+    for _ in range(2):
+        with pytest.raises(NoResultFound):
+            await coupon_repository.get_valid_coupon(
+                coupon.code,
+                "customer",
+                False,
+                Decimal(100),
+            )
+
+    # THEN
+    assert filter_false_positives.value == false_positives + 1
+    assert negative_cache_hits.value == hits + 1
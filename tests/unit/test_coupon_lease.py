@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from app.models.coupon import Coupon, CouponLease, UsageHistory
+from app.repository.coupon import CouponRepository
+from app.repository.coupon_lease import CouponLeaseRepository
+
+
+async def get_coupon(db_session, coupon_id):
+    raw = await db_session.execute(
+        select(Coupon)
+        .execution_options(populate_existing=True)
+        .where(Coupon.coupon_id == coupon_id)
+    )
+    return raw.scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_acquire_lease_takes_quota_from_coupon(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon.budget = Decimal(30)
+    await db_session.commit()
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+    coupon_lease_repository = CouponLeaseRepository(db_session)
+
+    # WHEN
+    await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-a", 4, Decimal(20), 60
+    )
+    refilled = await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-a", 4, Decimal(20), 60
+    )
+    exhausted = await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-b", 4, Decimal(20), 60
+    )
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    raw = await db_session.execute(select(CouponLease.owner))
+    assert raw.scalars().all() == ["pod-a"]
+    assert (refilled.max_usage, refilled.budget) == (8, Decimal(30))
+    assert exhausted is None
+    assert coupon_model.leased_usage == 8
+    assert coupon_model.leased_budget == Decimal(30)
+
+
+@pytest.mark.asyncio
+async def test_acquire_lease_refused_without_quota_leasing(
+    coupons_factory, db_session
+):
+    coupon_lease_repository = CouponLeaseRepository(db_session)
+
+    lease = await coupon_lease_repository.acquire(
+        coupons_factory[8].coupon_id, "pod-a", 4, Decimal(20), 60
+    )
+
+    assert lease is None
+
+
+@pytest.mark.asyncio
+async def test_release_lease_moves_usage_to_coupon(
+    coupons_factory, db_session
+):
+    # GIVEN
+    coupon = coupons_factory[8]
+    coupon_repository = CouponRepository(db_session)
+    await coupon_repository.enable_quota_leasing(coupon.coupon_id)
+    coupon_lease_repository = CouponLeaseRepository(db_session)
+    lease = await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-a", 4, Decimal(20), 60
+    )
+    reserved = await coupon_repository.reserve_usage(
+        coupon, "1", "customer1", Decimal("2.50"), lease_id=lease.id
+    )
+    lease_id = lease.id
+
+    # WHEN
+    released = await coupon_lease_repository.release(lease_id)
+
+    # THEN
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    raw = await db_session.execute(
+        select(UsageHistory)
+        .execution_options(populate_existing=True)
+        .where(UsageHistory.coupon_id == coupon.coupon_id)
+    )
+    usage_history = raw.scalar_one()
+    assert reserved and released
+    assert coupon_model.reserved_count == 1
+    assert coupon_model.accumulated_discount == Decimal("2.50")
+    assert coupon_model.leased_usage == 0
+    assert coupon_model.total_usage == 1
+    assert usage_history.lease_id is None
+    drift, _ = await coupon_repository.get_usage_counters_drift()
+    assert drift == []
+
+
+@pytest.mark.asyncio
+async def test_reclaim_only_expired_leases(coupons_factory, db_session):
+    # GIVEN
+    coupon = coupons_factory[8]
+    await CouponRepository(db_session).enable_quota_leasing(coupon.coupon_id)
+    coupon_lease_repository = CouponLeaseRepository(db_session)
+    expired = await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-a", 4, Decimal(20), 60
+    )
+    expired.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    live = await coupon_lease_repository.acquire(
+        coupon.coupon_id, "pod-b", 4, Decimal(20), 60
+    )
+    await db_session.flush()
+    expired_id, live_id = str(expired.id), str(live.id)
+
+    # WHEN
+    expired_ids = await coupon_lease_repository.get_expired_ids()
+    released_live = await coupon_lease_repository.release(
+        live_id, expired_only=True
+    )
+    released_expired = await coupon_lease_repository.release(
+        expired_id, expired_only=True
+    )
+
+    # THEN
+    raw = await db_session.execute(select(CouponLease.id))
+    coupon_model = await get_coupon(db_session, coupon.coupon_id)
+    assert expired_ids == [expired_id]
+    assert released_live is False
+    assert released_expired is True
+    assert raw.scalars().all() == [live_id]
+    assert coupon_model.leased_usage == 4
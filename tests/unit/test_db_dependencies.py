@@ -0,0 +1,91 @@
+import time
+
+import pytest
+from fastapi import Request
+
+from app.api.coupon.v1.views import get_valid_coupon
+from app.application import get_app
+from app.db.dependencies import (
+    LAST_WRITE_HEADER,
+    commit_request_session,
+    follows_own_write,
+    get_db_session,
+    route_name,
+)
+from app.settings import settings
+
+
+def request(method="GET", last_write=None):
+    headers = []
+    if last_write is not None:
+        headers.append(
+            (LAST_WRITE_HEADER.lower().encode(), str(last_write).encode()),
+        )
+    return Request({"type": "http", "method": method, "headers": headers})
+
+
+def test_pin_request_following_own_write(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(settings, "db_read_your_writes_ms", 500)
+    written_at = int(time.time() * 1000)
+
+    # WHEN
+    recent = follows_own_write(request(last_write=written_at))
+    old = follows_own_write(request(last_write=written_at - 1000))
+
+    # THEN
+    assert recent is True
+    assert old is False
+    assert follows_own_write(request()) is False
+    assert follows_own_write(request(last_write="invalid")) is False
+
+
+def test_do_not_pin_when_read_your_writes_is_disabled(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(settings, "db_read_your_writes_ms", 0)
+
+    # WHEN
+    pinned = follows_own_write(request(last_write=int(time.time() * 1000)))
+
+    # THEN
+    assert pinned is False
+
+
+@pytest.mark.asyncio
+async def test_time_the_commit_of_writes():
+    # GIVEN
+    write, read = request("PUT"), request("GET")
+    sessions = [get_db_session(write), get_db_session(read)]
+    for session in sessions:
+        await session.__anext__()
+
+    # WHEN
+    written_at = await commit_request_session(write)
+    read_at = await commit_request_session(read)
+    for session in sessions:
+        await session.aclose()
+
+    # THEN
+    assert time.time() * 1000 - written_at < 1000
+    assert read_at is None
+    assert await commit_request_session(request("PUT")) is None
+
+
+def test_name_route_after_its_path_template():
+    # GIVEN
+    current = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/v1/coupons/validate",
+            "headers": [],
+            "app": get_app(),
+            "endpoint": get_valid_coupon,
+        },
+    )
+
+    # WHEN
+    name = route_name(current)
+
+    # THEN
+    assert name == "GET /v1/coupons/validate"
@@ -0,0 +1,124 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.api.healthcheck.checkers.pool import Checker as PoolChecker
+from app.db.engine import (
+    Checkout,
+    InstrumentedPool,
+    PoolerSafeConnection,
+    check_statement_cache,
+    engine_options,
+)
+from app.settings import settings
+
+
+def test_disable_statement_caches_behind_pooler():
+    # WHEN
+    options = engine_options("pooler")
+
+    # THEN
+    assert options["connect_args"]["prepared_statement_cache_size"] == 0
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["connection_class"] is PoolerSafeConnection
+
+
+def test_size_statement_caches_by_setting(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(settings, "db_statement_cache_size", 500)
+
+    # WHEN
+    options = engine_options("cached")
+
+    # THEN
+    assert options["connect_args"]["prepared_statement_cache_size"] == 500
+    assert options["connect_args"]["statement_cache_size"] == 500
+
+
+def test_configure_pool_and_server_timeouts(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(settings, "db_pool_size", 8)
+    monkeypatch.setattr(settings, "db_pool_pre_ping", True)
+    monkeypatch.setattr(settings, "db_statement_timeout_ms", 2000)
+    monkeypatch.setattr(settings, "db_idle_in_transaction_timeout_ms", 0)
+
+    # WHEN
+    options = engine_options("cached")
+
+    # THEN
+    assert options["pool_size"] == 8
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"]["server_settings"] == {
+        "statement_timeout": "2000",
+    }
+
+
+def test_reject_unknown_statement_cache_mode():
+    with pytest.raises(ValueError):
+        engine_options("unknown")
+
+
+def test_name_pooler_statements_uniquely():
+    # WHEN
+    names = {
+        PoolerSafeConnection._get_unique_id(None, "stmt") for _ in range(3)
+    }
+
+    # THEN
+    assert len(names) == 3
+
+
+@pytest.mark.asyncio
+async def test_pass_statement_cache_self_test_without_pgpool():
+    # GIVEN
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    # WHEN
+    try:
+        await check_statement_cache(engine, "direct")
+    finally:
+        await engine.dispose()
+
+    # THEN no error is raised
+
+
+def pool_engine(pool):
+    return Mock(sync_engine=Mock(pool=pool))
+
+
+@pytest.mark.asyncio
+async def test_pool_busy_without_waits_is_ready():
+    # GIVEN
+    pool = InstrumentedPool(Mock(), pool_size=2, max_overflow=-1)
+    pool._checkouts.append(Checkout(time.monotonic(), 2, False))
+
+    # WHEN
+    result = await PoolChecker(pool_engine(pool)).check()
+
+    # THEN
+    assert result["status"] is True
+    assert result["capacity"] is None
+
+
+@pytest.mark.asyncio
+async def test_pool_waiting_or_timing_out_is_not_ready(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(settings, "health_check_pool_wait_ms", 100)
+    waiting = InstrumentedPool(Mock(), pool_size=2, max_overflow=1)
+    waiting._checkouts.append(Checkout(time.monotonic(), 150, False))
+    timing_out = InstrumentedPool(Mock(), pool_size=2, max_overflow=1)
+    timing_out._checkouts.append(Checkout(time.monotonic(), 10, True))
+    recovered = InstrumentedPool(Mock(), pool_size=2, max_overflow=1)
+    recovered._checkouts.append(Checkout(time.monotonic() - 60, 150, True))
+
+    # WHEN
+    results = [
+        await PoolChecker(pool_engine(pool)).check()
+        for pool in (waiting, timing_out, recovered)
+    ]
+
+    # THEN
+    assert [result["status"] for result in results] == [False, False, True]
+    assert results[0]["capacity"] == 3
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base
+from app.db.session import ReadOnlySession
+from app.models.coupon import Coupon
+
+
+@pytest.fixture()
+async def engine(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'coupon.sqlite3'}",
+    )
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(
+            Coupon.__table__.insert().values(
+                coupon_id="1",
+                description="coupon",
+                code="READONLY",
+                valid_from=datetime.now(timezone.utc),
+                valid_until=datetime.now(timezone.utc) + timedelta(hours=1),
+                type="percent",
+                value=Decimal(10),
+                user_create="Test",
+            ),
+        )
+    yield engine
+    await engine.dispose()
+
+
+def count_checkins(engine) -> list:
+    checkins = []
+    event.listen(
+        engine.sync_engine.pool,
+        "checkin",
+        lambda *args: checkins.append(1),
+    )
+    return checkins
+
+
+@pytest.mark.asyncio
+async def test_release_connection_after_every_statement(engine):
+    # GIVEN
+    factory = sessionmaker(
+        engine.execution_options(isolation_level="AUTOCOMMIT"),
+        expire_on_commit=False,
+        class_=ReadOnlySession,
+        release_connections=True,
+    )
+    checkins = count_checkins(engine)
+
+    async with factory() as session:
+        # WHEN
+        raw = await session.execute(select(Coupon))
+        coupon = raw.scalar_one()
+
+        # THEN
+        assert len(checkins) == 1
+        assert coupon.code == "READONLY"
+        assert coupon.total_usage == 0
+
+
+@pytest.mark.asyncio
+async def test_keep_connection_until_closed_by_default(engine):
+    # GIVEN
+    factory = sessionmaker(engine, class_=ReadOnlySession)
+    checkins = count_checkins(engine)
+
+    async with factory() as session:
+        # WHEN
+        await session.execute(select(Coupon))
+
+        # THEN
+        assert checkins == []
+    assert len(checkins) == 1
@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("uvicorn")
+import app.runner as runner  # noqa: E402
+
+
+def test_read_cgroup_v2_cpu_quota(tmp_path):
+    # GIVEN
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+
+    # WHEN
+    quota = runner.cpu_quota(tmp_path)
+
+    # THEN
+    assert quota == 2.5
+
+
+def test_read_cgroup_v1_cpu_quota(tmp_path):
+    # GIVEN
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("50000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+
+    # WHEN
+    quota = runner.cpu_quota(tmp_path)
+
+    # THEN
+    assert quota == 0.5
+
+
+def test_ignore_unlimited_cpu_quota(tmp_path):
+    # GIVEN
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+
+    # WHEN
+    quota = runner.cpu_quota(tmp_path)
+
+    # THEN
+    assert quota is None
+
+
+def test_size_workers_to_whole_cpus_unless_configured(tmp_path, monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(runner.os, "sched_getaffinity", lambda pid: {0, 1, 2})
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+
+    # WHEN
+    sized = runner.workers_count(0, tmp_path)
+    configured = runner.workers_count(4, tmp_path)
+
+    # THEN
+    assert sized == 2
+    assert configured == 4
+
+
+def test_run_at_least_one_worker(tmp_path, monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(runner.os, "sched_getaffinity", lambda pid: {0, 1})
+    (tmp_path / "cpu.max").write_text("50000 100000\n")
+
+    # WHEN
+    workers = runner.workers_count(0, tmp_path)
+
+    # THEN
+    assert workers == 1
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.repository.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_share_load_in_flight():
+    # GIVEN
+    single_flight = SingleFlight("test_share")
+    loads = []
+    release = asyncio.Event()
+
+    async def load():
+        loads.append(1)
+        await release.wait()
+        return "definition"
+
+    # WHEN
+    callers = [
+        asyncio.create_task(single_flight.do("CODE", load)) for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers)
+
+    # THEN
+    assert results == ["definition"] * 3
+    assert len(loads) == 1
+    assert len(single_flight) == 0
+    assert single_flight.coalescing_ratio() == pytest.approx(2 / 3)
+
+
+@pytest.mark.asyncio
+async def test_raise_load_error_to_waiting_callers():
+    # GIVEN
+    single_flight = SingleFlight("test_error")
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        raise LookupError("not found")
+
+    # WHEN
+    callers = [
+        asyncio.create_task(single_flight.do("CODE", load)) for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+
+    # THEN
+    assert all(isinstance(result, LookupError) for result in results)
+    assert len(single_flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_reload_when_loading_caller_is_cancelled():
+    # GIVEN
+    single_flight = SingleFlight("test_cancel")
+    loads = []
+
+    async def load():
+        loads.append(1)
+        if len(loads) == 1:
+            await asyncio.sleep(60)
+        return "definition"
+
+    leader = asyncio.create_task(single_flight.do("CODE", load))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(single_flight.do("CODE", load))
+    await asyncio.sleep(0)
+
+    # WHEN
+    leader.cancel()
+
+    # THEN
+    assert await follower == "definition"
+    assert leader.cancelled()
+    assert len(loads) == 2
@@ -0,0 +1,73 @@
+import os
+import signal
+import time
+
+import pytest
+
+import app.supervisor as supervisor
+
+
+def worker(code: int, delay: float = 0) -> int:
+    pid = os.fork()
+    if pid == 0:
+        time.sleep(delay)
+        os._exit(code)
+    return pid
+
+
+@pytest.fixture(autouse=True)
+def no_restart_delay(monkeypatch):
+    monkeypatch.setattr(supervisor, "RESTART_DELAY", 0)
+
+
+def test_fail_when_a_worker_fails_to_start():
+    # GIVEN
+    codes = iter([supervisor.STARTUP_FAILURE, 0])
+
+    # WHEN
+    code = supervisor.supervise(lambda: worker(next(codes), 0.1), 2)
+
+    # THEN
+    assert code == supervisor.STARTUP_FAILURE
+
+
+def test_restart_a_worker_dying_outside_the_shutdown():
+    # GIVEN
+    spawned = []
+
+    def spawn():
+        spawned.append(worker(1 if not spawned else 0, 0.2))
+        if len(spawned) == 2:
+            # The replacement is stopped, as on the exit signal.
+            os.kill(os.getpid(), signal.SIGTERM)
+        return spawned[-1]
+
+    # WHEN
+    code = supervisor.supervise(spawn, 1)
+
+    # THEN
+    assert len(spawned) == 2
+    assert code == 0
+
+
+def test_forward_the_exit_signal_to_the_workers():
+    # GIVEN
+    supervisor_pid = os.getpid()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            time.sleep(0.2)
+            os.kill(supervisor_pid, signal.SIGTERM)
+            time.sleep(5)
+            os._exit(0)
+        return pid
+
+    # WHEN
+    started = time.monotonic()
+    code = supervisor.supervise(spawn, 1)
+
+    # THEN
+    assert time.monotonic() - started < 5
+    assert code == 1
@@ -1,5 +1,6 @@
-from datetime import datetime
-from unittest.mock import AsyncMock, patch
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 
 import pytest
 from sqlalchemy.sql.expression import select
@@ -7,7 +8,8 @@ from sqlalchemy.sql.expression import select
 from app.enums import TaskStatus
 from app.models.task import Task
 from app.repository.task import TaskRepository
-from app.services.utils.task_manager import task_wrapper
+from app.services.utils.task_manager import TaskWorker, load_task_data
+from app.settings import settings
 
 
 @pytest.mark.asyncio
@@ -89,3 +91,296 @@ async def test_update_result_task(db_session):
     assert obj.id == task.id
     assert obj.result == "FINISHTEST"
     assert row_count == 1
+
+
+async def add_task(db_session, **values) -> Task:
+    task = Task(data=json.dumps({"message": "ok"}), **values)
+    db_session.add(task)
+    await db_session.commit()
+    await db_session.refresh(task)
+    return task
+
+
+def worker_of(db_session, handler, owner="worker-1") -> TaskWorker:
+    @asynccontextmanager
+    async def sessions():
+        yield db_session
+
+    return TaskWorker(sessions, handler, owner=owner)
+
+
+@pytest.mark.asyncio
+async def test_claim_oldest_waiting_task(db_session):
+    # GIVEN
+    repository = TaskRepository(db_session)
+    now = datetime.now(timezone.utc)
+    newer = await add_task(db_session, created_at=now)
+    older = await add_task(db_session, created_at=now - timedelta(minutes=1))
+
+    # WHEN
+    task = await repository.claim("worker-1", now - timedelta(minutes=1), 3)
+
+    # THEN
+    assert task.id == older.id != newer.id
+    assert task.status == TaskStatus.IN_PROGRESS
+    assert task.owner == "worker-1"
+    assert task.attempts == 1
+    assert task.heartbeat_at is not None
+
+
+@pytest.mark.asyncio
+async def test_claim_abandoned_task_only(db_session):
+    # GIVEN
+    repository = TaskRepository(db_session)
+    now = datetime.now(timezone.utc)
+    await add_task(
+        db_session,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-1",
+        heartbeat_at=now,
+        attempts=1,
+    )
+    abandoned = await add_task(
+        db_session,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-2",
+        heartbeat_at=now - timedelta(minutes=5),
+        attempts=1,
+    )
+
+    # WHEN
+    task = await repository.claim("worker-3", now - timedelta(minutes=1), 3)
+    none_left = await repository.claim(
+        "worker-3",
+        now - timedelta(minutes=1),
+        3,
+    )
+
+    # THEN
+    assert task.id == abandoned.id
+    assert task.owner == "worker-3"
+    assert task.attempts == 2
+    assert none_left is None
+
+
+@pytest.mark.asyncio
+async def test_fail_abandoned_task_out_of_attempts(db_session):
+    # GIVEN
+    repository = TaskRepository(db_session)
+    now = datetime.now(timezone.utc)
+    task = await add_task(
+        db_session,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-1",
+        heartbeat_at=now - timedelta(minutes=5),
+        attempts=3,
+    )
+
+    # WHEN
+    failed = await repository.fail_abandoned(now - timedelta(minutes=1), 3)
+    claimed = await repository.claim("worker-2", now - timedelta(minutes=1), 3)
+    await db_session.refresh(task)
+
+    # THEN
+    assert failed == 1
+    assert claimed is None
+    assert task.status == TaskStatus.FAILED
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_of_task_taken_over(db_session):
+    # GIVEN
+    repository = TaskRepository(db_session)
+    task = await add_task(
+        db_session,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-2",
+        heartbeat_at=datetime.now(timezone.utc),
+        attempts=2,
+    )
+
+    # WHEN
+    owned = await repository.heartbeat(task.id, "worker-2")
+    taken_over = await repository.heartbeat(task.id, "worker-1")
+
+    # THEN
+    assert owned is True
+    assert taken_over is False
+
+
+@pytest.mark.asyncio
+async def test_worker_completes_task(db_session):
+    # GIVEN
+    task = await add_task(db_session)
+    received = []
+
+    async def handler(task, session):
+        received.append(load_task_data(task))
+        return "done"
+
+    # WHEN
+    ran = await worker_of(db_session, handler).run_once()
+    idle = await worker_of(db_session, handler).run_once()
+    await db_session.refresh(task)
+
+    # THEN
+    assert ran is True
+    assert idle is False
+    assert received == [{"message": "ok"}]
+    assert task.status == TaskStatus.COMPLETED
+    assert task.result == "done"
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_failed_task_after_backoff(db_session):
+    # GIVEN
+    task = await add_task(db_session)
+
+    async def handler(task, session):
+        raise ValueError("connection reset")
+
+    # WHEN
+    await worker_of(db_session, handler).run_once()
+    during_backoff = await worker_of(db_session, handler).run_once()
+    await db_session.refresh(task)
+
+    # THEN
+    assert during_backoff is False
+    assert task.status == TaskStatus.CREATED
+    assert task.owner is None
+    assert task.run_after is not None
+    assert task.result == "connection reset"
+
+
+@pytest.mark.asyncio
+async def test_worker_fails_task_on_last_attempt(db_session):
+    # GIVEN
+    task = await add_task(db_session, attempts=2)
+
+    async def handler(task, session):
+        raise ValueError("invalid customer keys")
+
+    # WHEN
+    await worker_of(db_session, handler).run_once()
+    await db_session.refresh(task)
+
+    # THEN
+    assert task.attempts == 3
+    assert task.status == TaskStatus.FAILED
+    assert task.result == "invalid customer keys"
+
+
+@pytest.mark.asyncio
+async def test_claim_retried_task_once_backoff_is_over(db_session):
+    # GIVEN
+    repository = TaskRepository(db_session)
+    now = datetime.now(timezone.utc)
+    task = await add_task(
+        db_session,
+        attempts=1,
+        run_after=now - timedelta(seconds=1),
+    )
+    await add_task(db_session, attempts=1, run_after=now + timedelta(hours=1))
+
+    # WHEN
+    claimed = await repository.claim("worker-1", now, 3)
+    none_left = await repository.claim("worker-1", now, 3)
+
+    # THEN
+    assert claimed.id == task.id
+    assert claimed.attempts == 2
+    assert none_left is None
+
+
+@pytest.mark.asyncio
+async def test_shards_finish_their_task(db_session):
+    # GIVEN
+    parent = await add_task(db_session)
+    repository = TaskRepository(db_session)
+    await repository.claim("worker-1", datetime.now(timezone.utc), 3)
+    await repository.add_shards(parent.id, ['{"start": 0}', '{"start": 8}'])
+    await db_session.commit()
+
+    async def handler(task, session):
+        start = load_task_data(task)["start"]
+        return json.dumps({"created": start + 1, "skipped": 1})
+
+    # WHEN
+    await worker_of(db_session, handler, "worker-2").run_once()
+    await db_session.refresh(parent)
+    status_after_first_shard = parent.status
+    await worker_of(db_session, handler, "worker-3").run_once()
+    await db_session.refresh(parent)
+
+    # THEN
+    assert status_after_first_shard == TaskStatus.IN_PROGRESS
+    assert parent.status == TaskStatus.COMPLETED
+    assert json.loads(parent.result) == {"created": 10, "skipped": 2}
+
+
+@pytest.mark.asyncio
+async def test_shard_failing_once_does_not_fail_its_task(
+    db_session,
+    monkeypatch,
+):
+    # GIVEN
+    monkeypatch.setattr(settings, "task_retry_backoff", 0)
+    parent = await add_task(db_session)
+    repository = TaskRepository(db_session)
+    await repository.claim("worker-1", datetime.now(timezone.utc), 3)
+    await repository.add_shards(parent.id, ['{"start": 0}'])
+    await db_session.commit()
+
+    async def handler(task, session):
+        if task.attempts == 1:
+            raise ConnectionError("connection reset")
+        return json.dumps({"created": 1})
+
+    # WHEN
+    await worker_of(db_session, handler, "worker-2").run_once()
+    await worker_of(db_session, handler, "worker-3").run_once()
+    await db_session.refresh(parent)
+
+    # THEN
+    assert parent.status == TaskStatus.COMPLETED
+    assert json.loads(parent.result) == {"created": 1}
+
+
+@pytest.mark.asyncio
+async def test_abandoned_shard_fails_its_task(db_session):
+    # GIVEN
+    now = datetime.now(timezone.utc)
+    parent = await add_task(
+        db_session,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-1",
+        heartbeat_at=now - timedelta(minutes=5),
+        attempts=1,
+        shards=2,
+    )
+    await add_task(
+        db_session,
+        parent_id=parent.id,
+        status=TaskStatus.COMPLETED,
+        result='{"created": 1}',
+    )
+    await add_task(
+        db_session,
+        parent_id=parent.id,
+        status=TaskStatus.IN_PROGRESS,
+        owner="worker-2",
+        heartbeat_at=now - timedelta(minutes=5),
+        attempts=3,
+    )
+
+    # WHEN
+    failed = await TaskRepository(db_session).fail_abandoned(
+        now - timedelta(minutes=1),
+        3,
+    )
+    await db_session.refresh(parent)
+
+    # THEN
+    assert failed == 1
+    assert parent.status == TaskStatus.FAILED
+    assert parent.result == "1 of 2 shards failed"